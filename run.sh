@@ -137,6 +137,12 @@ docker run --rm -i \
   ${TEST_LIB_DIR:+-v "${TEST_LIB_DIR}:/home/usertd/tests/`basename "${TEST_LIB_DIR}"`:ro"} \
   ${TEST_DIR:+-v "${TEST_DIR}:/home/usertd/tests/`basename "${TEST_DIR}"`:ro"} \
   ${TEST:+-e TEST="$TEST"} \
+  ${MOCKSERVER_ENGINE:+-e MOCKSERVER_ENGINE="$MOCKSERVER_ENGINE"} \
+  ${JOBS:+-e JOBS="$JOBS"} \
+  ${BROWSER_SESSION_POOL:+-e BROWSER_SESSION_POOL="$BROWSER_SESSION_POOL"} \
+  ${PROFILE_SNAPSHOTS:+-e PROFILE_SNAPSHOTS="$PROFILE_SNAPSHOTS"} \
+  ${BENCHMARK_RESULTS_DIR:+-v "${BENCHMARK_RESULTS_DIR}:/home/usertd/benchmark_results"} \
+  ${BENCHMARK_RESULTS_DIR:+-e BENCHMARK_RESULTS_DIR=/home/usertd/benchmark_results} \
   --shm-size=1gb \
   ${DOCKER_EXTRA_ARGS[@]:+"${DOCKER_EXTRA_ARGS[@]}"} \
   "$(cat .iidfile)" \
@@ -0,0 +1,156 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Runs auctions back to back from a single page kept open: auction configs are generated in Python and passed
+to `navigator.runAdAuction` with `execute_async_script`, and timings and winners are returned straight from
+JavaScript, without page loads, fenced frame rendering or polling the DOM for each auction. Winning ads are not
+rendered, so the browser sends no reports (`reportWin`, `reportResult`) unless a winner is rendered explicitly:
+
+    replay.render(results[-1].winner)
+    buyer_server.wait_for_request('/reportWin')
+
+    replay = AuctionReplay(self.driver, seller_server.address + '/replay.html')
+    config = auction_config(seller_server.address, [buyer_server.address])
+    results = replay.run_many([config] * 100, concurrency=1)
+    logger.info(f"auctions: {pretty_json(summary(results))}")
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from common.trace.store import percentiles
+
+# arguments: auction configs, the number of auctions in flight, the callback; results are in order of configs
+RUN_AUCTIONS_JS = """
+const [configs, concurrency, done] = arguments;
+const results = new Array(configs.length);
+let next = 0;
+
+async function runAuction(config) {
+  const start = performance.now();
+  try {
+    const winner = await navigator.runAdAuction(config);
+    const durationMs = performance.now() - start;
+    let adUrl = null;
+    if (typeof winner === 'string' && navigator.deprecatedURNToURL) {
+      try {
+        adUrl = await navigator.deprecatedURNToURL(winner);
+      } catch (e) {
+      }
+    }
+    return {start, durationMs, winner: winner === null ? null : String(winner), adUrl, error: null};
+  } catch (e) {
+    return {start, durationMs: performance.now() - start, winner: null, adUrl: null, error: String(e)};
+  }
+}
+
+async function runAuctions() {
+  while (next < configs.length) {
+    const i = next++;
+    results[i] = await runAuction(configs[i]);
+  }
+}
+
+if (!navigator.runAdAuction) {
+  done({error: "your browser doesn't have runAdAuction -- do you need to set some flags?"});
+} else {
+  const start = performance.now();
+  Promise.all(Array.from({length: Math.min(concurrency, configs.length)}, runAuctions))
+    .then(() => done({results, wallTimeMs: performance.now() - start}));
+}
+"""
+
+
+# arguments: the urn of a winning ad, the callback called once the ad is loaded in an iframe
+RENDER_AD_JS = """
+const [urn, done] = arguments;
+const frame = document.createElement('iframe');
+frame.onload = () => done(null);
+frame.onerror = () => done('failed to load ' + urn);
+frame.src = urn;
+(document.body || document.documentElement).appendChild(frame);
+"""
+
+
+class AuctionReplayError(Exception):
+    pass
+
+
+@dataclass
+class AuctionResult:
+    start_ms: float  # page's performance.now() when the auction was started
+    duration_ms: float  # until runAdAuction resolved
+    winner: Optional[str]  # urn of the winning ad, None if there was no winner
+    ad_url: Optional[str]  # render url of the winning ad, if the browser can map urns to urls
+    error: Optional[str] = None
+
+
+def auction_config(seller: str, buyers: Iterable[str], decision_logic_path='/seller.js', **params) -> Dict[str, Any]:
+    """An auction config (in the shape of the one seller pages pass to runAdAuction), with extra `params`."""
+    return dict(seller=seller, decisionLogicUrl=seller + decision_logic_path, interestGroupBuyers=list(buyers),
+                **params)
+
+
+class AuctionReplay:
+    """
+    Runs auctions from a page opened once (on first use), e.g. a seller's page that runs no auction by itself.
+    Auctions resolve to urns rather than fenced frame configs, so that winners can be returned.
+    """
+
+    def __init__(self, driver, page_url, script_timeout: float = 300):
+        self.driver = driver
+        self.page_url = page_url
+        self.script_timeout = script_timeout
+        self.opened = False
+        self.wall_time_ms = None
+
+    def open(self):
+        self.driver.get(self.page_url)
+        self.opened = True
+
+    def run(self, config: Dict[str, Any]) -> AuctionResult:
+        return self.run_many([config])[0]
+
+    def run_many(self, configs: List[Dict[str, Any]], concurrency=1) -> List[AuctionResult]:
+        """
+        Runs auctions with up to `concurrency` of them in flight at a time, in a single WebDriver command.
+        The wall time of all auctions is left in `wall_time_ms`.
+        """
+        if not self.opened:
+            self.open()
+        configs = [dict(config, resolveToConfig=False) for config in configs]
+        saved_timeout = self.driver.timeouts.script
+        self.driver.set_script_timeout(self.script_timeout)
+        try:
+            response = self.driver.execute_async_script(RUN_AUCTIONS_JS, configs, max(1, concurrency))
+        finally:
+            self.driver.set_script_timeout(saved_timeout)
+        if response.get('error'):
+            raise AuctionReplayError(response['error'])
+        self.wall_time_ms = response['wallTimeMs']
+        return [AuctionResult(start_ms=result['start'], duration_ms=result['durationMs'], winner=result['winner'],
+                              ad_url=result['adUrl'], error=result['error'])
+                for result in response['results']]
+
+    def render(self, winner: str):
+        """Loads the winning ad of an auction (its urn) in an iframe, which makes the browser send its reports."""
+        error = self.driver.execute_async_script(RENDER_AD_JS, winner)
+        if error:
+            raise AuctionReplayError(error)
+
+
+def summary(results: List[AuctionResult], wall_time_ms: float = None) -> Dict[str, Any]:
+    """Counts of auctions (failed, without a winner), their duration percentiles (ms) and throughput."""
+    durations = np.asarray([result.duration_ms for result in results if result.error is None])
+    if wall_time_ms is None and results:
+        wall_time_ms = max(result.start_ms + result.duration_ms for result in results) - \
+                       min(result.start_ms for result in results)
+    return dict(
+        auctions=len(results),
+        errors=sum(result.error is not None for result in results),
+        no_winner=sum(result.error is None and result.winner is None for result in results),
+        durations_ms=percentiles(durations),
+        mean_ms=float(durations.mean()) if len(durations) else None,
+        auctions_per_s=len(results) / wall_time_ms * 1000 if wall_time_ms else None,
+    )
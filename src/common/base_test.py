@@ -10,11 +10,17 @@ import unittest
 import warnings
 
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome import service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
+from common.browser_pool import get_pool, session_key
+from common.mockserver import MockServer
+from common.profile_snapshot import ProfileSnapshots, find_browser_binary
+from common.trace import TraceCollector
+from common.trace.breakdown import AuctionBreakdown
 
 logger = logging.getLogger(__file__)
 
@@ -28,6 +34,14 @@ CHROMEDRIVER_LOG_PATH = os.environ.get('CHROMEDRIVER_LOG_PATH') or str(ROOT_DIR
 NSSDB_DIR = str(pathlib.Path(__file__).absolute().parent / "ssl" / "ca" / "nssdb")
 
 CHROME_HEADLESS = os.environ.get('CHROME_HEADLESS', '0').lower() not in ['0', 'false']
+# Reuse warm browser sessions across tests (reset between tests) instead of launching a browser for each test.
+BROWSER_SESSION_POOL = os.environ.get('BROWSER_SESSION_POOL', '0').lower() not in ['0', 'false']
+BROWSER_SESSION_POOL_SIZE = int(os.environ.get('BROWSER_SESSION_POOL_SIZE', 1))
+# Clone profiles from a snapshot initialised once per browser build instead of creating them from scratch.
+PROFILE_SNAPSHOTS = os.environ.get('PROFILE_SNAPSHOTS', '0').lower() not in ['0', 'false']
+PROFILE_SNAPSHOT_DIR = os.environ.get('PROFILE_SNAPSHOT_DIR') or str(ROOT_DIR / "profile_snapshots")
+# Where auction latency breakdowns of tests are saved (as <test id>.json and <test id>.csv), if set.
+AUCTION_BREAKDOWN_DIR = os.environ.get('AUCTION_BREAKDOWN_DIR')
 
 PRIVACY_SANDBOX_ENROLLMENT_OVERRIDES = ['https://localhost']
 
@@ -35,6 +49,8 @@ class ComponentNotFoundException(Exception):
     pass
 
 class BaseTest(unittest.TestCase):
+    # tests that need a fresh browser (e.g. relying on browser-wide histograms) may opt out of session reuse
+    reuse_browser_session = True
 
     def non_feature_options(self) -> webdriver.ChromeOptions:
         # https://peter.sh/experiments/chromium-command-line-switches
@@ -42,7 +58,6 @@ class BaseTest(unittest.TestCase):
         if CHROMIUM_DIR:
             options.binary_location = CHROMIUM_DIR + '/chrome'
         options.set_capability('goog:loggingPrefs', dict(browser='ALL', performance='ALL'))
-        options.add_experimental_option('perfLoggingPrefs', dict(traceCategories='fledge'))
         options.add_argument('--enable-stats-collection-bindings')  # for histograms
         options.add_argument('--no-sandbox')
         options.add_argument('--no-zygote')
@@ -69,30 +84,81 @@ class BaseTest(unittest.TestCase):
         return options
 
     def setUp(self) -> None:
-        if os.path.exists(PROFILE_DIR):
-            shutil.rmtree(PROFILE_DIR)
+        warnings.filterwarnings("ignore")
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+        options = self.options()
+        self.browser_flags = list(options.arguments)
+        self.pooled_session = None
+        if BROWSER_SESSION_POOL and self.reuse_browser_session:
+            self.session_key = session_key(options)
+            self.pooled_session = get_pool(BROWSER_SESSION_POOL_SIZE).acquire(
+                self.session_key,
+                lambda profile_dir: self.launch_browser(profile_dir, options),
+                [PROFILE_DIR] + [f'{PROFILE_DIR}-{index}' for index in range(1, BROWSER_SESSION_POOL_SIZE)])
+            self.driver = self.pooled_session.driver
+        else:
+            self.driver = self.launch_browser(PROFILE_DIR, options)
+        self.trace_collector = TraceCollector(self.driver, categories=['fledge'])
+        self.trace_collector.start()
+        self.saved_wd = os.getcwd()
+        os.chdir(os.path.dirname(sys.modules[self.__module__].__file__))
+
+    def launch_browser(self, profile_dir, options: webdriver.ChromeOptions) -> webdriver.Chrome:
+        binary_path = PROFILE_SNAPSHOTS and find_browser_binary(options.binary_location)
+        if binary_path:
+            ProfileSnapshots(PROFILE_SNAPSHOT_DIR).clone(
+                binary_path, lambda snapshot_dir: self.build_profile_snapshot(snapshot_dir, options), profile_dir)
+        else:
+            self.create_profile(profile_dir)
+        return self.start_browser(profile_dir, options)
+
+    def create_profile(self, profile_dir):
+        if os.path.exists(profile_dir):
+            shutil.rmtree(profile_dir)
 
-        chrome_home_dir = PROFILE_DIR
+        chrome_home_dir = profile_dir
         os.makedirs(chrome_home_dir + "/.pki")
         os.symlink(NSSDB_DIR, chrome_home_dir + "/.pki/nssdb")
 
-        warnings.filterwarnings("ignore")
-        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
-        driver = webdriver.Chrome(
+    def start_browser(self, profile_dir, options: webdriver.ChromeOptions) -> webdriver.Chrome:
+        chrome_home_dir = profile_dir
+        options.arguments[:] = [arg for arg in options.arguments if not arg.startswith('--user-data-dir=')]
+        options.add_argument(f'--user-data-dir={profile_dir}')
+        return webdriver.Chrome(
             service=service.Service(
                 CHROMIUM_DIR + '/chromedriver' if CHROMIUM_DIR else 'chromedriver',
                 service_args=['--enable-chrome-logs'],
                 log_path=CHROMEDRIVER_LOG_PATH,
                 env=dict(os.environ, HOME=chrome_home_dir)
             ),
-            options=self.options()
+            options=options
         )
-        self.driver = driver
-        self.saved_wd = os.getcwd()
-        os.chdir(os.path.dirname(sys.modules[self.__module__].__file__))
+
+    def build_profile_snapshot(self, profile_dir, options: webdriver.ChromeOptions):
+        """Initialises a profile to be snapshotted: the browser is run once, with components updated."""
+        self.create_profile(profile_dir)
+        self.driver = self.start_browser(profile_dir, options)
+        try:
+            self.updatePrivacySandboxAttestationsComponent()
+        except (ComponentNotFoundException, TimeoutException) as e:
+            logger.warning(f"profile snapshot without updated attestations component: {e!r}")
+        finally:
+            self.driver.quit()
 
     def tearDown(self) -> None:
         os.chdir(self.saved_wd)
+        try:
+            self.trace_collector.close()
+        finally:
+            self.release_browser()
+
+    def release_browser(self):
+        """Quits the browser and removes its profile, or hands a pooled session back to the pool."""
+        if self.pooled_session:
+            # the profile directory is removed by the pool, when the session is quit
+            get_pool().release(self.session_key, self.pooled_session, MockServer.started_addresses)
+            MockServer.started_addresses.clear()
+            return
         self.driver.quit()
         if os.path.exists(PROFILE_DIR):
             shutil.rmtree(PROFILE_DIR)
@@ -140,13 +206,12 @@ class BaseTest(unittest.TestCase):
     def extract_browser_log(self):
         return self.driver.get_log('browser')
 
+    def iter_trace_events(self):
+        """Streams trace events recorded since the previous call (or since the test started)."""
+        return self.trace_collector.collect()
+
     def extract_trace_events(self):
-        trace_events = []
-        for entry in self.driver.get_log('performance'):
-            data = json.loads(entry['message'])
-            if data.get('message', {}).get('method') == 'Tracing.dataCollected':
-                trace_events.append(data['message']['params'])
-        return trace_events
+        return list(self.iter_trace_events())
 
     def extract_browser_histogram(self, histogram, timeout=5):
         js = 'return statsCollectionController.getBrowserHistogram("%s")' % histogram
@@ -154,6 +219,15 @@ class BaseTest(unittest.TestCase):
         return WebDriverWait(self.driver, timeout) \
             .until(lambda driver: json.loads(driver.execute_script(js)))
 
+    def auction_breakdown(self, fledge_events) -> AuctionBreakdown:
+        """Stage timings of auctions, saved to AUCTION_BREAKDOWN_DIR (if set) to compare browser builds."""
+        breakdown = AuctionBreakdown.from_events(fledge_events)
+        if AUCTION_BREAKDOWN_DIR:
+            os.makedirs(AUCTION_BREAKDOWN_DIR, exist_ok=True)
+            breakdown.to_json(os.path.join(AUCTION_BREAKDOWN_DIR, self.id() + '.json'))
+            breakdown.to_csv(os.path.join(AUCTION_BREAKDOWN_DIR, self.id() + '.csv'))
+        return breakdown
+
     def extract_fledge_trace_events(self):
         fledge_events = [x for x in self.extract_trace_events() if 'fledge' == x.get('cat', None)]
         fledge_events.sort(key=lambda x: x['ts'])
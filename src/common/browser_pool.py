@@ -0,0 +1,150 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Warm browser sessions reused across test cases (see `BROWSER_SESSION_POOL` in `common.base_test`): instead of
+launching a new browser for every test, a session is reset between tests and handed to the next test asking
+for the same options.
+"""
+import atexit
+import json
+import logging
+import shutil
+import statistics
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+logger = logging.getLogger(__file__)
+
+
+def session_key(options: webdriver.ChromeOptions) -> str:
+    """Sessions can only be shared by tests launching the browser with the same options (apart from the profile directory)."""
+    capabilities = options.to_capabilities()
+    chrome_options = capabilities.get('goog:chromeOptions', {})
+    chrome_options['args'] = [arg for arg in chrome_options.get('args', []) if not arg.startswith('--user-data-dir=')]
+    return json.dumps(capabilities, sort_keys=True)
+
+
+def logged_origins(performance_log: List[dict]) -> Iterable[str]:
+    for entry in performance_log:
+        message = json.loads(entry['message']).get('message', {})
+        url = message.get('params', {}).get('request', {}).get('url')
+        if url and url.startswith('https://'):
+            scheme, netloc = urlsplit(url)[:2]
+            yield f'{scheme}://{netloc}'
+
+
+def reset_session(driver: webdriver.Chrome, origins: Iterable[str] = ()):
+    """
+    Brings a browser back to a clean state without restarting it: closes extra windows, drops pending logs and
+    clears interest groups, storage, cookies and cache of the origins the test talked to.
+    """
+    for handle in driver.window_handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(driver.window_handles[0])
+    driver.get('about:blank')
+    origins = set(origins) | set(logged_origins(driver.get_log('performance')))
+    driver.get_log('browser')
+    for origin in sorted(origins):
+        driver.execute_cdp_cmd('Storage.clearDataForOrigin', dict(origin=origin, storageTypes='all'))
+    driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+    driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+
+
+@dataclass
+class PooledSession:
+    driver: webdriver.Chrome
+    profile_dir: str
+
+
+class BrowserSessionPool:
+    """
+    Idle browser sessions by launch options, at most `max_sessions` of them (the least recently used one is quit
+    to make room for another). A session that fails to reset is quit and the next test gets a fresh browser.
+    Profile directories of sessions are removed when they are quit, at the latest when the pool is closed.
+    """
+
+    def __init__(self, max_sessions=1):
+        self.max_sessions = max_sessions
+        self.idle: Dict[str, PooledSession] = OrderedDict()
+        self.launch_times: List[float] = []
+        self.reset_times: List[float] = []
+        self.reuses = 0
+
+    def acquire(self, key, launch: Callable[[str], webdriver.Chrome], profile_dirs: List[str]) -> PooledSession:
+        """
+        An idle session for `key` or a new one, launched in a profile directory (one of `profile_dirs`) not used
+        by any other idle session.
+        """
+        session = self.idle.pop(key, None)
+        if session is not None:
+            self.reuses += 1
+            return session
+        while len(self.idle) >= self.max_sessions:
+            self.quit(self.idle.popitem(last=False)[1])
+        used_profile_dirs = {session.profile_dir for session in self.idle.values()}
+        profile_dir = next(profile_dir for profile_dir in profile_dirs if profile_dir not in used_profile_dirs)
+        start = time.perf_counter()
+        driver = launch(profile_dir)
+        self.launch_times.append(time.perf_counter() - start)
+        return PooledSession(driver, profile_dir)
+
+    def release(self, key, session: PooledSession, origins: Iterable[str] = ()):
+        start = time.perf_counter()
+        try:
+            reset_session(session.driver, origins)
+        except WebDriverException as e:
+            logger.warning(f"failed to reset browser session, quitting it: {e!r}")
+            self.quit(session)
+            return
+        self.reset_times.append(time.perf_counter() - start)
+        self.idle[key] = session
+
+    @staticmethod
+    def quit(session: PooledSession):
+        """Quits the browser of a session and removes its profile directory."""
+        try:
+            session.driver.quit()
+        except WebDriverException as e:
+            logger.warning(f"failed to quit browser session: {e!r}")
+        shutil.rmtree(session.profile_dir, ignore_errors=True)
+
+    def close(self):
+        while self.idle:
+            self.quit(self.idle.popitem()[1])
+
+    def saved_time(self) -> Optional[float]:
+        """Estimated browser startup time saved by reusing sessions (net of the time spent resetting them)."""
+        if not self.launch_times:
+            return None
+        return self.reuses * statistics.mean(self.launch_times) - sum(self.reset_times)
+
+    def summary(self) -> str:
+        if not self.launch_times:
+            return "no browser sessions launched"
+        return (f"{len(self.launch_times)} browser launches ({statistics.mean(self.launch_times):.2f} s on average), "
+                f"{self.reuses} reuses ({statistics.mean(self.reset_times or [0.0]):.2f} s per reset), "
+                f"~{self.saved_time():.2f} s of startup time saved")
+
+
+_pool: Optional[BrowserSessionPool] = None
+
+
+def get_pool(max_sessions=1) -> BrowserSessionPool:
+    """The pool of this (worker) process; its sessions are quit when the process exits."""
+    global _pool
+    if _pool is None:
+        _pool = BrowserSessionPool(max_sessions)
+
+        def close():
+            logger.info(f"browser session pool: {_pool.summary()}")
+            _pool.close()
+
+        atexit.register(close)
+    return _pool
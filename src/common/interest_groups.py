@@ -0,0 +1,120 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Joins many interest groups with few page loads: interest groups can only be joined from a page of their owner's
+origin, so they are grouped by owner and each owner's groups are joined from its blank page (see
+`common.mockserver.BLANK_PAGE_PATH`) in batches of `joinAdInterestGroup` calls run by `execute_async_script`.
+
+    join_interest_groups(self.driver, [
+        InterestGroupSpec(owner=buyer_server.address, name=f'ig_{i}', bid=i) for i in range(0, 100)])
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from common.mockserver import BLANK_PAGE_PATH
+
+logger = logging.getLogger(__file__)
+
+# arguments: [interest group, duration] pairs, the number of joins in flight, the callback
+JOIN_INTEREST_GROUPS_JS = """
+const [groups, batchSize, done] = arguments;
+
+async function joinInterestGroups() {
+  const errors = [];
+  for (let i = 0; i < groups.length; i += batchSize) {
+    const batch = groups.slice(i, i + batchSize);
+    const results = await Promise.allSettled(
+        batch.map(([group, duration]) => navigator.joinAdInterestGroup(group, duration)));
+    results.forEach((result, j) => {
+      if (result.status === 'rejected') {
+        errors.push(batch[j][0].name + ': ' + result.reason);
+      }
+    });
+  }
+  return errors;
+}
+
+if (!navigator.joinAdInterestGroup) {
+  done(["your browser doesn't have joinAdInterestGroup -- do you need to set some flags?"]);
+} else {
+  joinInterestGroups().then(done, error => done([String(error)]));
+}
+"""
+
+
+class InterestGroupJoinError(Exception):
+    pass
+
+
+@dataclass
+class InterestGroupSpec:
+    """
+    An interest group shaped like the ones buyers' `index.html` pages join: by default with a single ad
+    (`<owner>/ad.html`) having `bid` in its metadata.
+    """
+    owner: str
+    name: str
+    execution_mode: str = 'compatibility'
+    bid: Optional[int] = None
+    bidding_logic_path: str = '/buyer.js'
+    trusted_bidding_signals_path: Optional[str] = '/ig/trusted_bidding_signals.json'
+    ads: Optional[List[Dict[str, Any]]] = None
+    duration_s: int = 10000
+    params: Dict[str, Any] = field(default_factory=dict)  # other fields of the interest group
+
+    def interest_group(self) -> Dict[str, Any]:
+        ads = self.ads
+        if ads is None:
+            ads = [dict(renderUrl=self.owner + '/ad.html', metadata=dict(bid=self.bid))]
+        interest_group = dict(owner=self.owner, name=self.name, executionMode=self.execution_mode,
+                              biddingLogicUrl=self.owner + self.bidding_logic_path, ads=ads)
+        if self.trusted_bidding_signals_path:
+            interest_group['trustedBiddingSignalsUrl'] = self.owner + self.trusted_bidding_signals_path
+        interest_group.update(self.params)
+        return interest_group
+
+
+def origin(url) -> str:
+    scheme, netloc = urlsplit(url)[:2]
+    return f'{scheme}://{netloc}'
+
+
+def clear_interest_groups(driver, owners: Iterable[str]):
+    """
+    Removes interest groups of given owners' origins, e.g. joined by an earlier measurement in the same browser
+    session by a server that had the same (ephemeral) port.
+    """
+    for owner in sorted({origin(owner) for owner in owners}):
+        driver.execute_cdp_cmd('Storage.clearDataForOrigin', dict(origin=owner, storageTypes='interest_groups'))
+
+
+def join_interest_groups(driver, specs: List[InterestGroupSpec],
+                         page_url: Callable[[str], str] = lambda owner: owner + BLANK_PAGE_PATH,
+                         batch_size=50, script_timeout: float = 300) -> int:
+    """
+    Joins interest groups, navigating once per owner (to `page_url(owner)`, unless the current page is already
+    of the owner's origin), with up to `batch_size` joins in flight. Returns the number of navigations.
+    """
+    by_owner: Dict[str, List[InterestGroupSpec]] = {}
+    for spec in specs:
+        by_owner.setdefault(origin(spec.owner), []).append(spec)
+
+    navigations = 0
+    saved_timeout = driver.timeouts.script
+    driver.set_script_timeout(script_timeout)
+    try:
+        for owner, owner_specs in by_owner.items():
+            if origin(driver.current_url) != owner:
+                driver.get(page_url(owner))
+                navigations += 1
+            errors = driver.execute_async_script(
+                JOIN_INTEREST_GROUPS_JS, [[spec.interest_group(), spec.duration_s] for spec in owner_specs],
+                max(1, batch_size))
+            if errors:
+                raise InterestGroupJoinError(f"failed to join interest groups of {owner}: {errors}")
+    finally:
+        driver.set_script_timeout(saved_timeout)
+    logger.info(f"joined {len(specs)} interest groups of {len(by_owner)} owners ({navigations} navigations)")
+    return navigations
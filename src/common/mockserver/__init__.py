@@ -1,28 +1,99 @@
 # Copyright 2021 RTBHOUSE. All rights reserved.
 # Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+import asyncio
 import http.server
+import importlib
+import inspect
+import itertools
 import json
 import logging
+import mimetypes
+import mmap
+import os
 import pathlib
+import posixpath
+import re
+import socket
 import ssl
 import threading
 import time
+from collections import defaultdict, deque
 from dataclasses import dataclass
 from functools import partial
 from http import HTTPStatus
-from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
-from urllib.parse import parse_qs, urlsplit
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .shaping import NetworkShaper, ShapedWriter
 
 logger = logging.getLogger(__file__)
 common_dir = str(pathlib.Path(__file__).absolute().parent.parent)
 
+THREADING_ENGINE = 'threading'
+ASYNCIO_ENGINE = 'asyncio'
+HTTP2_ENGINE = 'http2'  # requires the h2 package
+ENGINES = (THREADING_ENGINE, ASYNCIO_ENGINE, HTTP2_ENGINE)
+DEFAULT_ENGINE = os.environ.get('MOCKSERVER_ENGINE', THREADING_ENGINE)
+# Retention limits of request logs; unbounded by default.
+DEFAULT_MAX_REQUESTS = int(os.environ.get('MOCKSERVER_MAX_REQUESTS', 0)) or None
+DEFAULT_MAX_REQUEST_BYTES = int(os.environ.get('MOCKSERVER_MAX_REQUEST_BYTES', 0)) or None
+DEFAULT_STATIC_CACHE = os.environ.get('MOCKSERVER_STATIC_CACHE', '0').lower() not in ['0', 'false']
+# Files of at least this size are sent from memory-mapped buffers; disabled by default.
+DEFAULT_ZERO_COPY_THRESHOLD = int(os.environ.get('MOCKSERVER_ZERO_COPY_THRESHOLD', 0)) or None
+# Added to explicitly requested ports, so that parallel test workers (see `common.runner`) do not collide.
+PORT_OFFSET = int(os.environ.get('MOCKSERVER_PORT_OFFSET', 0))
+# Persistent (HTTP/1.1 keep-alive) connections, closed after being idle for KEEP_ALIVE_TIMEOUT seconds.
+DEFAULT_KEEP_ALIVE = os.environ.get('MOCKSERVER_KEEP_ALIVE', '1').lower() not in ['0', 'false']
+KEEP_ALIVE_TIMEOUT = float(os.environ.get('MOCKSERVER_KEEP_ALIVE_TIMEOUT', 30))
+# TLS 1.3 session tickets issued after a full handshake, so that the browser can resume sessions; 0 disables them.
+TLS_SESSION_TICKETS = int(os.environ.get('MOCKSERVER_TLS_SESSION_TICKETS', 2))
+# Only every n-th request is logged (at INFO level), e.g. to keep logs of benchmarks with many beacons small.
+REQUEST_LOG_EVERY = max(1, int(os.environ.get('MOCKSERVER_REQUEST_LOG_EVERY', 1)))
+LOCALHOST_PORT = re.compile(rb'(//localhost:)(\d+)')
+# content types of responses in which `localhost` origins are shifted (see `offset_localhost_ports`)
+TEXT_TYPES = ('text/', 'application/javascript', 'application/json')
+
+# served by every server, e.g. for a page of a buyer's origin to join interest groups from
+BLANK_PAGE_PATH = '/__mockserver/blank.html'
+BLANK_PAGE_BODY = '<!DOCTYPE html><title>blank</title>'
+
+FLEDGE_HEADERS = (
+    ('X-Allow-FLEDGE', 'true'),
+    ('Access-Control-Allow-Origin', '*'),
+    ('Supports-Loading-Mode', 'fenced-frame'),
+)
+
 
-@dataclass(init=True, repr=True, eq=False, frozen=True)
 class Request:
-    path: str
-    params: Dict[str, List[str]]
-    timestamp: float
-    body: Optional[bytes] = None
+    """
+    A received request, kept in request logs: its query string and body are stored raw, and `params` (as parsed
+    by `parse_qs`) and JSON params are parsed on first use and memoized, so that requests nobody looks at (e.g.
+    most report beacons of a benchmark) cost no parsing. Values returned by `get_first_json_param` are shared
+    between calls and should not be modified.
+    """
+    __slots__ = ('path', 'query', 'timestamp', 'body', '_params', '_json_params')
+
+    def __init__(self, path: str, query: str = '', timestamp: float = None, body: Optional[bytes] = None):
+        set_attribute = object.__setattr__
+        set_attribute(self, 'path', path)
+        set_attribute(self, 'query', query)
+        set_attribute(self, 'timestamp', time.time() if timestamp is None else timestamp)
+        set_attribute(self, 'body', body)
+        set_attribute(self, '_params', None)
+        set_attribute(self, '_json_params', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"cannot assign to field {name!r} of a Request")
+
+    def __repr__(self):
+        return f'Request(path={self.path!r}, query={self.query!r}, timestamp={self.timestamp!r}, body={self.body!r})'
+
+    @property
+    def params(self) -> Dict[str, List[str]]:
+        if self._params is None:
+            # parsing twice in a race is harmless
+            object.__setattr__(self, '_params', parse_qs(self.query))
+        return self._params
 
     def get_params(self, key):
         return self.params[key]
@@ -31,7 +102,11 @@ class Request:
         return self.get_params(key)[0]
 
     def get_first_json_param(self, key):
-        return json.loads(self.get_first_param(key))
+        if self._json_params is None:
+            object.__setattr__(self, '_json_params', {})
+        if key not in self._json_params:
+            self._json_params[key] = json.loads(self.get_first_param(key))
+        return self._json_params[key]
 
 
 @dataclass
@@ -41,43 +116,368 @@ class Response:
     body: Union[None, str, bytes]
 
 
+def request_size(request: Request) -> int:
+    """Approximate memory footprint of a request, used by the `max_bytes` retention policy."""
+    return len(request.path) + len(request.query) + len(request.body or b'')
+
+
+class RequestLog:
+    """
+    Thread-safe request store indexed by path: first/last request and count for a path are O(1).
+    Waiting threads are woken up through a condition variable as soon as a request is appended.
+
+    The oldest requests are evicted once the log holds more than `max_requests` requests or more than
+    `max_bytes` bytes (see `request_size`). Counts include evicted requests.
+    """
+
+    def __init__(self, max_requests: int = None, max_bytes: int = None):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.requests = deque()
+        self.requests_by_path: Dict[str, deque] = defaultdict(deque)
+        self.counts_by_path: Dict[str, int] = defaultdict(int)
+        self.bytes = 0
+        self.evicted = 0
+
+    def append(self, request: Request):
+        size = request_size(request)
+        with self.condition:
+            self.requests.append((request, size))
+            self.requests_by_path[request.path].append(request)
+            self.counts_by_path[request.path] += 1
+            self.bytes += size
+            while self.requests and (
+                    (self.max_requests and len(self.requests) > self.max_requests) or
+                    (self.max_bytes and self.bytes > self.max_bytes)):
+                self.evict_oldest()
+            self.condition.notify_all()
+
+    def evict_oldest(self):
+        request, size = self.requests.popleft()
+        same_path_requests = self.requests_by_path[request.path]
+        same_path_requests.popleft()
+        if not same_path_requests:
+            del self.requests_by_path[request.path]
+        self.bytes -= size
+        self.evicted += 1
+
+    def __len__(self):
+        return len(self.requests)
+
+    def all(self) -> List[Request]:
+        with self.condition:
+            return [request for request, _ in self.requests]
+
+    def get(self, path) -> List[Request]:
+        with self.condition:
+            return list(self.requests_by_path.get(path, ()))
+
+    def first(self, path) -> Optional[Request]:
+        with self.condition:
+            same_path_requests = self.requests_by_path.get(path)
+            return same_path_requests[0] if same_path_requests else None
+
+    def last(self, path) -> Optional[Request]:
+        with self.condition:
+            same_path_requests = self.requests_by_path.get(path)
+            return same_path_requests[-1] if same_path_requests else None
+
+    def count(self, path) -> int:
+        with self.condition:
+            return self.counts_by_path.get(path, 0)
+
+    def find_last(self, path, predicate: Callable[[Request], bool] = None, since: float = None) -> Optional[Request]:
+        with self.condition:
+            for request in reversed(self.requests_by_path.get(path, ())):
+                # handler threads append requests in no particular order of their timestamps
+                if since is not None and request.timestamp < since:
+                    continue
+                if predicate is None or predicate(request):
+                    return request
+            return None
+
+    def wait_for(self, path, predicate: Callable[[Request], bool] = None, since: float = None,
+                 timeout: float = None) -> Optional[Request]:
+        """Returns the latest matching request, waiting up to `timeout` seconds for one to arrive."""
+        with self.condition:
+            result = None
+
+            def found():
+                nonlocal result
+                result = self.find_last(path, predicate, since)
+                return result is not None
+
+            self.condition.wait_for(found, timeout)
+            return result
+
+
+class ConnectionStats:
+    """
+    Counters of a server's connections, requests and resumed TLS sessions; with keep-alive, connections are
+    reused by many requests. Open connections are tracked too, to be closed when the server stops.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.resumed_tls_sessions = 0
+        self.open_connections: Set[Any] = set()
+
+    def connection_opened(self, connection, tls_session_reused=False):
+        with self.lock:
+            self.connections += 1
+            self.resumed_tls_sessions += bool(tls_session_reused)
+            self.open_connections.add(connection)
+
+    def connection_closed(self, connection):
+        with self.lock:
+            self.open_connections.discard(connection)
+
+    def request_received(self):
+        with self.lock:
+            self.requests += 1
+
+    def take_open_connections(self) -> List[Any]:
+        with self.lock:
+            connections = list(self.open_connections)
+            self.open_connections.clear()
+            return connections
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(connections=self.connections, requests=self.requests,
+                        resumed_tls_sessions=self.resumed_tls_sessions,
+                        requests_per_connection=self.requests / self.connections if self.connections else None)
+
+
+def read_chunked(rfile) -> bytes:
+    """Reads a request body sent with `Transfer-Encoding: chunked` (trailers are skipped)."""
+    chunks = []
+    while True:
+        size = int(rfile.readline().split(b';')[0], 16)
+        if not size:
+            while rfile.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(rfile.read(size))
+        rfile.readline()
+
+
+_logged_requests = itertools.count()
+_logged_messages = itertools.count()
+
+
+def sample_log(counter) -> bool:
+    """Whether to log the next message counted by `counter`: every `REQUEST_LOG_EVERY`-th one, at INFO level."""
+    return logger.isEnabledFor(logging.INFO) and next(counter) % REQUEST_LOG_EVERY == 0
+
+
+def log_request(command, path, query):
+    """Logs every `REQUEST_LOG_EVERY`-th request; formatting is deferred until a handler emits the record."""
+    if sample_log(_logged_requests):
+        logger.info("%s request path: %s, query: %s", command, path, query)
+
+
+def resolve_response(response):
+    """
+    Response providers may be plain functions or coroutines (so that they can e.g. `await asyncio.sleep()`
+    without blocking the asyncio engine). In a handler thread a coroutine is simply run to completion.
+    """
+    if inspect.isawaitable(response):
+        return asyncio.run(response)
+    return response
+
+
+def chain_response_providers(*providers: Callable[[Request], Optional[Response]]):
+    """A response provider returning the first response given by one of `providers`."""
+    def chained(request: Request):
+        for provider in providers:
+            response = provider(request)
+            if response is not None:
+                return response
+        return None
+
+    return chained
+
+
+def offset_localhost_ports(content: bytes) -> bytes:
+    """
+    Shifts ports of `https://localhost:<port>` origins hard-coded in test resources by `PORT_OFFSET`,
+    matching the ports the servers actually listen on.
+    """
+    return LOCALHOST_PORT.sub(lambda match: match.group(1) + b'%d' % (int(match.group(2)) + PORT_OFFSET), content)
+
+
+def offset_response_ports(response: Optional[Response], path) -> Optional[Response]:
+    """
+    `offset_localhost_ports` applied to a response of a provider: to its header values (e.g. `Location`) and, if it
+    is text (by its `Content-Type`, or else by the request's `path`), to its body. Coroutines are wrapped.
+    """
+    if inspect.isawaitable(response):
+        async def offset_awaited():
+            return offset_response_ports(await response, path)
+        return offset_awaited()
+    if response is None:
+        return None
+    headers = [(key, offset_localhost_ports(str(value).encode('latin-1')).decode('latin-1'))
+               for key, value in response.headers]
+    content_type = next((value for key, value in headers if key.lower() == 'content-type'), None) or guess_type(path)
+    body = response.body
+    if body is not None and content_type.startswith(TEXT_TYPES):
+        body = offset_localhost_ports(body.encode()).decode() if isinstance(body, str) \
+            else offset_localhost_ports(bytes(body))
+    return Response(response.status, headers, body)
+
+
+def create_ssl_context() -> ssl.SSLContext:
+    """
+    A server context issuing session tickets (`TLS_SESSION_TICKETS`), so that connections opened by the browser
+    after the first one resume the TLS session instead of doing a full handshake.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile=common_dir + '/ssl/localhost.crt', keyfile=common_dir + '/ssl/localhost.key')
+    if TLS_SESSION_TICKETS:
+        context.options &= ~ssl.OP_NO_TICKET
+        context.num_tickets = TLS_SESSION_TICKETS
+    else:
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+    return context
+
+
+def guess_type(path) -> str:
+    """The same guess as SimpleHTTPRequestHandler.guess_type() makes, usable without a handler instance."""
+    ext = posixpath.splitext(path)[1].lower()
+    if ext in http.server.SimpleHTTPRequestHandler.extensions_map:
+        return http.server.SimpleHTTPRequestHandler.extensions_map[ext]
+    guess, _ = mimetypes.guess_type(path)
+    return guess or 'application/octet-stream'
+
+
+def translate_path(directory, path) -> str:
+    """The same translation as SimpleHTTPRequestHandler.translate_path() does, usable without a handler instance."""
+    trailing_slash = path.rstrip().endswith('/')
+    path = posixpath.normpath(unquote(path, errors='surrogatepass'))
+    result = directory
+    for word in filter(None, path.split('/')):
+        if os.path.dirname(word) or word in (os.curdir, os.pardir):
+            continue
+        result = os.path.join(result, word)
+    if trailing_slash:
+        result += '/'
+    return result
+
+
+def map_file(f) -> memoryview:
+    """
+    Read-only memory mapping of a (non-empty) file, to be handed to the socket without copying it into Python objects.
+    Note that Python's ssl module has no kTLS / SSL_sendfile() support, so over TLS this is as close to os.sendfile()
+    as we can get: the only copy left is the encryption itself.
+    """
+    return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
 class RequestHandler(http.server.SimpleHTTPRequestHandler):
     callback: Callable[[Request], Optional[Response]]
 
-    def __init__(self, *args, directory=None, callback=None, **kwargs):
+    def __init__(self, *args, directory=None, callback=None, static_cache=None, zero_copy_threshold=None,
+                 shaper: NetworkShaper = None, keep_alive=False, stats: ConnectionStats = None, **kwargs):
         self.callback = callback or (lambda request: None)
+        self.static_cache = static_cache
+        self.zero_copy_threshold = zero_copy_threshold
+        self.shaper = shaper
+        self.stats = stats or ConnectionStats()
+        if keep_alive:
+            # responses must then always carry their length (or be chunked), which they all do
+            self.protocol_version = 'HTTP/1.1'
+            self.timeout = KEEP_ALIVE_TIMEOUT
         super().__init__(*args, directory=directory, **kwargs)
 
+    def setup(self):
+        super().setup()
+        # headers and body are separate writes, which Nagle's algorithm would delay on kept-alive connections
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.unshaped_wfile = self.wfile
+        self.stats.connection_opened(self.connection, getattr(self.connection, 'session_reused', False))
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.stats.connection_closed(self.connection)
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if isinstance(self.wfile, ShapedWriter) and self.wfile.aborted:
+            self.close_connection = True
+
     def end_headers(self) -> None:
-        self.send_header('X-Allow-FLEDGE', 'true')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Supports-Loading-Mode', 'fenced-frame')
+        for key, value in FLEDGE_HEADERS:
+            self.send_header(key, value)
         return super().end_headers()
 
     def address_string(self):
         return f'{self.client_address[0]} -> :{self.server.server_port}'
 
+    def log_message(self, format, *args):
+        # access and error lines of http.server (written to stderr by default) are sampled like requests
+        if sample_log(_logged_messages):
+            logger.info('%s - ' + format, self.address_string(), *args)
+
     def parse_request(self) -> bool:
         if not super().parse_request():
             return False
-        self.path, query = urlsplit(self.path)[2:4]
-        self.query_params = parse_qs(query)
+        self.path, self.query = urlsplit(self.path)[2:4]
         self.timestamp = time.time()
-        logger.info(
-            f"{self.command} request path: {self.path}, query params: {self.query_params}")
+        self.stats.request_received()
+        log_request(self.command, self.path, self.query)
+        plan = self.shaper and self.shaper.plan(self.path)
+        self.wfile = ShapedWriter(self.unshaped_wfile, plan, self.connection) if plan else self.unshaped_wfile
         return True
 
     def do_GET(self):
-        response = self.callback(Request(self.path, self.query_params, self.timestamp))
+        response = resolve_response(self.callback(Request(self.path, self.query, self.timestamp)))
         if response is None:
-            return super().do_GET()
+            if not self.send_cached_file():
+                super().do_GET()
+            return
+        self.send_callback_response(response)
+
+    def do_HEAD(self):
+        if not self.send_cached_file(head_only=True):
+            super().do_HEAD()
+
+    def copyfile(self, source, outputfile):
+        if self.zero_copy_threshold and os.fstat(source.fileno()).st_size >= self.zero_copy_threshold:
+            with map_file(source) as view:
+                outputfile.write(view)
+        else:
+            super().copyfile(source, outputfile)
+
+    def send_cached_file(self, head_only=False) -> bool:
+        cached_file = self.static_cache and self.static_cache.lookup(self.path)
+        if not cached_file:
+            return False
+        status, headers, body = cached_file.response(
+            self.headers.get('Accept-Encoding'), self.headers.get('If-None-Match'), head_only)
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def send_callback_response(self, response: Response):
         self.send_response(response.status)
-        content_type_sent = False
+        header_names = set()
         for key, value in response.headers:
             self.send_header(key, value)
-            if key.lower() == 'content-type':
-                content_type_sent = True
+            header_names.add(key.lower())
         if response.body is None:
+            if 'content-length' not in header_names:
+                self.send_header("Content-Length", "0")
             self.end_headers()
         else:
             body: bytes
@@ -85,69 +485,244 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
                 body = response.body.encode()
             else:
                 body = response.body
-            if not content_type_sent:
+            if 'content-type' not in header_names:
                 self.send_header("Content-Type", self.guess_type(self.path))
             self.send_header("Content-Length", str(len(body)))
             self.end_headers()
             self.wfile.write(body)
 
+    def read_body(self) -> bytes:
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return read_chunked(self.rfile)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
     def do_POST(self):
-        body = self.rfile.read(int(self.headers['Content-Length']))
-        response = self.callback(Request(self.path, self.query_params, self.timestamp, body))
+        body = self.read_body()
+        response = resolve_response(self.callback(Request(self.path, self.query, self.timestamp, body)))
         if not response:
             self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Length", "0")
             self.end_headers()
+        else:
+            self.send_callback_response(response)
+
+
+class ThreadingEngine:
+    """The original engine: `http.server.ThreadingHTTPServer`, i.e. one thread per connection."""
+
+    def __init__(self, name, port, directory, callback, ssl_context: ssl.SSLContext, static_cache=None,
+                 zero_copy_threshold=None, shaper: NetworkShaper = None, keep_alive=False):
+        self.stats = ConnectionStats()
+        self.http_server = http.server.ThreadingHTTPServer(
+            (name, port),
+            partial(RequestHandler, directory=directory, callback=callback, static_cache=static_cache,
+                    zero_copy_threshold=zero_copy_threshold, shaper=shaper, keep_alive=keep_alive,
+                    stats=self.stats))
+        self.server_name = self.http_server.server_name
+        self.server_port = self.http_server.server_port
+        self.http_server.socket = ssl_context.wrap_socket(self.http_server.socket, server_side=True)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, args=())
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        self.http_server.serve_forever()
+
+    def stop(self):
+        self.http_server.socket.close()
+        self.http_server.shutdown()
+        # idle keep-alive connections would otherwise go on serving requests (e.g. of a next test using the port)
+        for connection in self.stats.take_open_connections():
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+# engine name -> module (relative to this package) and class, imported on first use, so that optional dependencies
+# of an engine (e.g. h2) are only required by servers using it
+ENGINE_CLASSES = {
+    THREADING_ENGINE: ('.', 'ThreadingEngine'),
+    ASYNCIO_ENGINE: ('.aio', 'AsyncioEngine'),
+    HTTP2_ENGINE: ('.http2', 'Http2Engine'),
+}
+# engines that can run in the event loop of a `MockServerPool`
+POOLED_ENGINES = (ASYNCIO_ENGINE, HTTP2_ENGINE)
+
+
+def get_engine_class(engine_name) -> type:
+    if engine_name not in ENGINE_CLASSES:
+        raise ValueError(f"unknown engine {engine_name}, expected one of {ENGINES}")
+    module_name, class_name = ENGINE_CLASSES[engine_name]
+    return getattr(importlib.import_module(module_name, __name__), class_name)
 
 
 class MockServer:
+    # addresses of servers started by this process, e.g. for a browser's state to be cleared between tests
+    started_addresses: Set[str] = set()
+
     def __init__(self, port=0, directory='.', name='localhost',
-                 response_provider: Callable[[Request], Optional[Response]] = None):
+                 response_provider: Callable[[Request], Optional[Response]] = None,
+                 engine: str = None, pool: 'MockServerPool' = None,
+                 max_requests: int = DEFAULT_MAX_REQUESTS, max_bytes: int = DEFAULT_MAX_REQUEST_BYTES,
+                 static_cache=DEFAULT_STATIC_CACHE, zero_copy_threshold: int = DEFAULT_ZERO_COPY_THRESHOLD,
+                 shaper: NetworkShaper = None, keep_alive: bool = DEFAULT_KEEP_ALIVE):
+        """
+        :param static_cache: True to serve files from a preloaded in-memory `StaticFileCache`, or a configured
+            `StaticFileCache` instance (e.g. with compressed variants); by default files are read on every request.
+        :param zero_copy_threshold: files of at least this many bytes are sent straight from memory-mapped buffers
+            (see `map_file`) instead of being read and copied in chunks.
+        :param shaper: latency, bandwidth, stalls and resets to apply to responses (see `common.mockserver.shaping`);
+            shaped servers run on the asyncio engine, unless `engine` is given.
+        :param keep_alive: keep connections open between requests (HTTP/1.1); see `stats` for how they are reused.
+
+        Nonzero ports are shifted by `MOCKSERVER_PORT_OFFSET`, if set. `localhost` origins that responses refer to
+        are then shifted accordingly (see `offset_localhost_ports`): static files are served from the cache (which
+        shifts them when loading text files), and responses of `response_provider` are shifted as they are returned.
+        """
         self.server_directory = directory
-        self.requests = []
+        offset_ports = bool(port and PORT_OFFSET)
+        if offset_ports:
+            port += PORT_OFFSET
+            from .static import StaticFileCache
+            if isinstance(static_cache, StaticFileCache):
+                static_cache.add_transform(offset_localhost_ports)
+            else:
+                static_cache = StaticFileCache(self.server_directory, zero_copy_threshold=zero_copy_threshold,
+                                               transform=offset_localhost_ports)
+        self.requests = RequestLog(max_requests=max_requests, max_bytes=max_bytes)
 
         def callback(request: Request):
             self.requests.append(request)
+            if request.path == BLANK_PAGE_PATH:
+                return Response(HTTPStatus.OK, [('Content-Type', 'text/html')], BLANK_PAGE_BODY)
             if response_provider:
-                return response_provider(request)
+                response = response_provider(request)
+                return offset_response_ports(response, request.path) if offset_ports else response
 
-        self.http_server = http.server.ThreadingHTTPServer(
-            (name, port),
-            partial(RequestHandler, directory=self.server_directory, callback=callback))
-        self.server_name = name or self.http_server.server_name
-        self.server_port = port or self.http_server.server_port
-        self.http_server.socket = ssl.wrap_socket(
-            self.http_server.socket,
-            server_side=True,
-            certfile=common_dir + '/ssl/localhost.crt',
-            keyfile=common_dir + '/ssl/localhost.key',
-            ssl_version=ssl.PROTOCOL_TLS)
-        logger.info(f"server {self.address} for {self.server_directory} initialized")
+        if static_cache is True:
+            from .static import StaticFileCache
+            static_cache = StaticFileCache(self.server_directory, zero_copy_threshold=zero_copy_threshold)
+        self.static_cache = static_cache or None
+
+        self.engine_name = engine or (ASYNCIO_ENGINE if pool else DEFAULT_ENGINE)
+        if shaper and not engine and self.engine_name == THREADING_ENGINE:
+            # delays are awaited by the event loop rather than slept in handler threads
+            self.engine_name = ASYNCIO_ENGINE
+        engine_class = get_engine_class(self.engine_name)
+        engine_kwargs = dict(static_cache=self.static_cache, zero_copy_threshold=zero_copy_threshold,
+                             shaper=shaper, keep_alive=keep_alive)
+        if pool:
+            if self.engine_name not in POOLED_ENGINES:
+                raise ValueError(f"pooled servers require one of engines {POOLED_ENGINES}")
+            engine_kwargs['loop_thread'] = pool.loop_thread
+        # the http2 engine offers HTTP/2 (ALPN) on its context, which is why it does not share the pool's one
+        shared_context = pool and self.engine_name != HTTP2_ENGINE
+        ssl_context = pool.ssl_context if shared_context else create_ssl_context()
+        self.engine = engine_class(name, port, self.server_directory, callback, ssl_context, **engine_kwargs)
+        self.server_name = name or self.engine.server_name
+        self.server_port = port or self.engine.server_port
+        logger.info(f"server {self.address} for {self.server_directory} initialized ({self.engine_name} engine)")
 
     @property
     def address(self):
         return f'https://{self.server_name}:{self.server_port}'
 
+    @property
+    def blank_page_address(self):
+        return self.address + BLANK_PAGE_PATH
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Numbers of connections, requests and resumed TLS sessions so far."""
+        return self.engine.stats.as_dict()
+
     def __enter__(self):
         logger.debug(f"server {self.address} starting")
-        thread = threading.Thread(target=self.run, args=())
-        thread.daemon = True
-        thread.start()
+        self.engine.start()
+        MockServer.started_addresses.add(self.address)
         return self
 
     def run(self):
-        self.http_server.serve_forever()
+        self.engine.run()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.http_server.socket.close()
-        self.http_server.shutdown()
-        logger.debug(f"server {self.address} stopped")
+        self.engine.stop()
+        logger.debug(f"server {self.address} stopped, {self.stats}")
 
-    def get_requests(self):
-        return self.requests
+    def get_requests(self, path=None) -> List[Request]:
+        return self.requests.all() if path is None else self.requests.get(path)
+
+    def get_first_request(self, path) -> Optional[Request]:
+        return self.requests.first(path)
 
     def get_last_request(self, path) -> Optional[Request]:
-        result = None
-        for request in self.get_requests():
-            if request.path == path:
-                result = request
-        return result
+        return self.requests.last(path)
+
+    def count_requests(self, path) -> int:
+        return self.requests.count(path)
+
+    def wait_for_request(self, path, predicate: Callable[[Request], bool] = None, timeout: float = 5,
+                         since: float = None) -> Request:
+        """
+        Returns the latest request for `path` (accepted by `predicate` and received at or after `since`, if given),
+        waiting up to `timeout` seconds for it to arrive. Raises TimeoutError if it does not.
+        """
+        request = self.requests.wait_for(path, predicate, since, timeout)
+        if request is None:
+            raise TimeoutError(f"Failed to receive request {path} at {self.address} in given time {timeout} seconds.")
+        return request
+
+    def assert_no_request(self, path, predicate: Callable[[Request], bool] = None, within: float = 1,
+                          since: float = None):
+        """
+        Asserts that no request for `path` (accepted by `predicate` and received at or after `since`, if given)
+        arrives within `within` seconds. Fails as soon as one does.
+        """
+        request = self.requests.wait_for(path, predicate, since, within)
+        if request is not None:
+            raise AssertionError(f"Unexpected request {path} at {self.address}: {request}")
+
+
+class MockServerPool:
+    """
+    Hosts many mock servers (origins) in a single event loop thread sharing one TLS context, which keeps
+    scenarios with hundreds of buyers cheap to set up and tear down. Each server still has its own port,
+    directory and request log. By default servers get ephemeral ports, so parallel runs do not collide.
+
+        with MockServerPool() as pool:
+            buyer_servers = [pool.add(directory='resources/buyer') for _ in range(32)]
+    """
+
+    def __init__(self, name='localhost'):
+        from .aio import EventLoopThread
+        self.name = name
+        self.ssl_context = create_ssl_context()
+        self.loop_thread = EventLoopThread()
+        self.servers: List[MockServer] = []
+        self.closed = False
+
+    def add(self, port=0, directory='.',
+            response_provider: Callable[[Request], Optional[Response]] = None, **kwargs) -> MockServer:
+        """Creates a started server listening on given port (ephemeral, if 0)."""
+        server = MockServer(port=port, directory=directory, name=self.name,
+                            response_provider=response_provider, pool=self, **kwargs)
+        self.servers.append(server.__enter__())
+        return server
+
+    def __enter__(self):
+        return self
+
+    def close(self):
+        if self.closed:
+            return
+        for server in self.servers:
+            server.__exit__(None, None, None)
+        self.loop_thread.stop()
+        self.closed = True
+        logger.debug(f"server pool of {len(self.servers)} servers stopped")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
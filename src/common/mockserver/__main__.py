@@ -1,4 +1,4 @@
-from . import MockServer
+from . import ENGINES, MockServer
 
 from argparse import ArgumentParser
 
@@ -7,6 +7,13 @@ if __name__ == '__main__':
     argument_parser = ArgumentParser()
     argument_parser.add_argument('--port', '-p', type=int, required=True)
     argument_parser.add_argument('--directory', '-d', required=True)
+    argument_parser.add_argument('--engine', '-e', choices=ENGINES)
+    argument_parser.add_argument('--static-cache', action='store_true', default=None,
+                                 help="serve files from a preloaded in-memory cache")
+    argument_parser.add_argument('--zero-copy-threshold', type=int,
+                                 help="send files of at least this many bytes from memory-mapped buffers")
+    argument_parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false', default=None,
+                                 help="close connections after every response (HTTP/1.0)")
     arguments = argument_parser.parse_args()
-    server = MockServer(**vars(arguments))
+    server = MockServer(**{k: v for k, v in vars(arguments).items() if v is not None})
     server.run()
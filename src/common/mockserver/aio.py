@@ -0,0 +1,291 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+import asyncio
+import email.utils
+import html
+import http.client
+import inspect
+import io
+import logging
+import os
+import socket
+import ssl
+import struct
+import threading
+import time
+from http import HTTPStatus
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+from . import FLEDGE_HEADERS, KEEP_ALIVE_TIMEOUT, ConnectionStats, Request, Response, guess_type, log_request, \
+    map_file, translate_path
+from .shaping import NetworkShaper, ShapingPlan
+
+logger = logging.getLogger(__file__)
+
+SERVER_VERSION = 'MockServer/asyncio'
+MAX_HEADERS_SIZE = 64 * 1024
+
+
+class EventLoopThread:
+    """An asyncio event loop running forever in a daemon thread; it may be shared by many engines."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, args=(), daemon=True)
+        self.thread.start()
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def join(self):
+        self.thread.join()
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+
+class AsyncioEngine:
+    """
+    Single-threaded engine: all connections (including TLS handshakes) are handled by one asyncio event loop
+    running in a background thread, so no thread is spawned per connection. Many engines can share the same
+    loop thread (see `MockServerPool`).
+
+    Note that response providers are called on the event loop; they should not block (a provider may return
+    a coroutine instead, e.g. to `await asyncio.sleep()`). Delays of a `NetworkShaper` are awaited, not slept.
+    """
+
+    def __init__(self, name, port, directory, callback: Callable[[Request], Optional[Response]],
+                 ssl_context: ssl.SSLContext, static_cache=None, zero_copy_threshold=None,
+                 shaper: NetworkShaper = None, keep_alive=False, loop_thread: EventLoopThread = None):
+        self.directory = directory
+        self.keep_alive = keep_alive
+        self.stats = ConnectionStats()
+        self.handlers = set()  # tasks handling connections
+        self.shaper = shaper
+        self.callback = callback
+        self.static_cache = static_cache
+        self.zero_copy_threshold = zero_copy_threshold
+        self.owns_loop_thread = loop_thread is None
+        self.loop_thread = loop_thread or EventLoopThread()
+        self.server = self.loop_thread.call(
+            asyncio.start_server(self.handle_connection, name, port, ssl=ssl_context,
+                                 limit=MAX_HEADERS_SIZE, start_serving=False))
+        self.server_name, self.server_port = self.server.sockets[0].getsockname()[:2]
+
+    def start(self):
+        self.loop_thread.call(self.server.start_serving())
+
+    def run(self):
+        self.start()
+        self.loop_thread.join()
+
+    def stop(self):
+        async def close():
+            self.server.close()
+            # idle keep-alive connections would otherwise go on serving requests
+            for writer in self.stats.take_open_connections():
+                writer.transport.abort()
+            if self.handlers:
+                _, pending = await asyncio.wait(self.handlers, timeout=1)
+                for handler in pending:
+                    handler.cancel()
+            await self.server.wait_closed()
+
+        self.loop_thread.call(close())
+        if self.owns_loop_thread:
+            self.loop_thread.stop()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        ssl_object = writer.get_extra_info('ssl_object')
+        self.stats.connection_opened(writer, ssl_object is not None and ssl_object.session_reused)
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            while await self.handle_request(reader, writer):
+                pass
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                logger.debug(f"connection from {writer.get_extra_info('peername')} dropped: {e!r}")
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.TimeoutError, ssl.SSLError) as e:
+            logger.debug(f"connection from {writer.get_extra_info('peername')} dropped: {e!r}")
+        finally:
+            self.stats.connection_closed(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+            self.handlers.discard(handler)
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Handles a request of a connection; returns whether the connection is to be kept open for more."""
+        # an idle kept-alive connection is closed after a timeout, as is a client sending its request too slowly
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+        request_line, _, raw_headers = head.partition(b'\r\n')
+        words = request_line.decode('iso-8859-1').split()
+        if len(words) != 3:
+            await self.write_response(
+                writer, *self.error_response(HTTPStatus.BAD_REQUEST, f"Bad request syntax ({request_line!r})"))
+            return False
+        command, target, version = words
+        headers = http.client.parse_headers(io.BytesIO(raw_headers))
+        self.stats.request_received()
+        connection = headers.get('Connection', '').lower()
+        keep_alive = self.keep_alive and (connection == 'keep-alive' or
+                                          version == 'HTTP/1.1' and connection != 'close')
+
+        path = urlsplit(target).path
+        body = await read_body(reader, headers) if command == 'POST' else None
+        status, response_headers, body = await self.respond(command, target, headers, body)
+        if ('Connection', 'close') in response_headers:
+            keep_alive = False
+        elif self.keep_alive:
+            response_headers = [*response_headers, ('Connection', 'keep-alive' if keep_alive else 'close')]
+        sent = await self.write_response(writer, status, response_headers, body,
+                                         plan=self.shaper.plan(path) if self.shaper else None)
+        return keep_alive and sent
+
+    async def respond(self, command, target, headers, body: Optional[bytes] = None):
+        """Status, headers and body of the response to a request (of a POST request, with its body)."""
+        path, query = urlsplit(target)[2:4]
+        timestamp = time.time()
+        log_request(command, path, query)
+
+        if command == 'GET':
+            response = await resolve_response(self.callback(Request(path, query, timestamp)))
+            if response is None:
+                return self.static_response(path, headers)
+            return self.callback_response(response, path)
+        elif command == 'HEAD':
+            return self.static_response(path, headers, head_only=True)
+        elif command == 'POST':
+            response = await resolve_response(self.callback(Request(path, query, timestamp, body)))
+            if not response:
+                return HTTPStatus.OK, [('Content-Length', '0')], b''
+            return self.callback_response(response, path)
+        return self.error_response(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({command!r})")
+
+    async def write_response(self, writer: asyncio.StreamWriter, status: HTTPStatus, headers, body,
+                             plan: ShapingPlan = None) -> bool:
+        """Writes a response; returns False if the connection was reset instead."""
+        if plan is None:
+            writer.write(self.render_head(status, headers))
+            writer.write(body)
+            await writer.drain()
+            return True
+
+        await asyncio.sleep(plan.ttfb)
+        if plan.reset:
+            abort_connection(writer)
+            return False
+        writer.write(self.render_head(status, headers))
+        await writer.drain()
+        await asyncio.sleep(plan.body_delay)
+        start = time.monotonic()
+        for offset, chunk, pause in plan.chunks(body):
+            if pause:
+                await asyncio.sleep(pause)
+            writer.write(chunk)
+            await writer.drain()
+            if plan.bandwidth:
+                await asyncio.sleep(max(0.0, start + (offset + len(chunk)) / plan.bandwidth - time.monotonic()))
+        return True
+
+    def render_head(self, status: HTTPStatus, headers) -> bytes:
+        status = HTTPStatus(status)
+        lines = [f'{"HTTP/1.1" if self.keep_alive else "HTTP/1.0"} {status.value} {status.phrase}',
+                 f'Server: {SERVER_VERSION}',
+                 f'Date: {email.utils.formatdate(usegmt=True)}']
+        lines.extend(f'{key}: {value}' for key, value in headers)
+        lines.extend(f'{key}: {value}' for key, value in FLEDGE_HEADERS)
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'strict')
+
+    def callback_response(self, response: Response, path):
+        headers = list(response.headers)
+        if response.body is None:
+            if not any(key.lower() == 'content-length' for key, _ in headers):
+                headers.append(('Content-Length', '0'))
+            return response.status, headers, b''
+        body = response.body.encode() if isinstance(response.body, str) else response.body
+        if not any(key.lower() == 'content-type' for key, _ in headers):
+            headers.append(('Content-Type', guess_type(path)))
+        headers.append(('Content-Length', str(len(body))))
+        return response.status, headers, body
+
+    def error_response(self, status: HTTPStatus, message=None):
+        status = HTTPStatus(status)
+        body = (f'<html><head><title>Error response</title></head><body><h1>{status.value} {status.phrase}</h1>'
+                f'<p>{html.escape(message or status.description)}</p></body></html>').encode()
+        return status, [('Content-Type', 'text/html;charset=utf-8'),
+                        ('Content-Length', str(len(body))),
+                        ('Connection', 'close')], body
+
+    def static_response(self, path, request_headers, head_only=False):
+        cached_file = self.static_cache and self.static_cache.lookup(path)
+        if cached_file:
+            return cached_file.response(
+                request_headers.get('Accept-Encoding'), request_headers.get('If-None-Match'), head_only)
+
+        file_path = translate_path(self.directory, path)
+        if os.path.isdir(file_path):
+            if not path.endswith('/'):
+                return HTTPStatus.MOVED_PERMANENTLY, [('Location', path + '/'), ('Content-Length', '0')], b''
+            for index in ('index.html', 'index.htm'):
+                if os.path.isfile(os.path.join(file_path, index)):
+                    file_path = os.path.join(file_path, index)
+                    break
+            else:
+                return self.error_response(HTTPStatus.NOT_FOUND, "Directory listing not supported")
+        if file_path.endswith('/'):
+            return self.error_response(HTTPStatus.NOT_FOUND, "File not found")
+        try:
+            with open(file_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if head_only:
+                    body = b''
+                elif self.zero_copy_threshold and stat.st_size >= self.zero_copy_threshold:
+                    # the transport keeps a reference to the mapped buffer until it has been sent
+                    body = map_file(f)
+                else:
+                    body = f.read()
+        except OSError:
+            return self.error_response(HTTPStatus.NOT_FOUND, "File not found")
+        return HTTPStatus.OK, [
+            ('Content-type', guess_type(file_path)),
+            ('Content-Length', str(stat.st_size)),
+            ('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True)),
+        ], body
+
+
+def abort_connection(writer: asyncio.StreamWriter):
+    """Closes the connection with a TCP RST instead of sending a response."""
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    writer.transport.abort()
+
+
+async def read_body(reader: asyncio.StreamReader, headers) -> bytes:
+    """Reads a request body of given Content-Length, or sent with `Transfer-Encoding: chunked`."""
+    if 'chunked' not in headers.get('Transfer-Encoding', '').lower():
+        return await reader.readexactly(int(headers.get('Content-Length', 0)))
+    chunks = []
+    while True:
+        size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+        if not size:
+            # trailers
+            while await reader.readuntil(b'\r\n') != b'\r\n':
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+async def resolve_response(response):
+    if inspect.isawaitable(response):
+        return await response
+    return response
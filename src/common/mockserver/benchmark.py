@@ -0,0 +1,361 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Benchmarks MockServer engines and options without a browser: the server runs in a separate process (so that it
+does not share the GIL with the client) and is hammered by a pool of client processes, each making sequential
+HTTPS requests (HTTP/2 ones, over connections negotiating `h2`, to the http2 engine). Every scenario (static files
+of various sizes, a response provider, POST report beacons) is run at every concurrency level, reporting the
+negotiated protocol, requests per second, latency percentiles and the server's CPU time per request.
+
+Usage (from the src directory):
+    python3 -m common.mockserver.benchmark [--engine threading --engine asyncio] [--requests 2000] \\
+        [--concurrency 1 8 32] [--scenario static-1k --scenario provider ...] [--json results.json]
+
+Throughput of large worklet scripts, e.g. the ~2 MB buyer.js of the performance tests, with and without zero-copy:
+    python3 -m common.mockserver.benchmark --file tests_performance/resources/buyer/buyer.js --scenario file -n 500
+    python3 -m common.mockserver.benchmark --file tests_performance/resources/buyer/buyer.js --scenario file -n 500 \\
+        --zero-copy-threshold 65536
+
+By default every request is made on a new connection (a full TLS handshake each time); with `--keep-alive` every
+client reuses a single persistent connection, like a browser does:
+    python3 -m common.mockserver.benchmark --keep-alive
+
+With BENCHMARK_RESULTS_DIR set, latencies and CPU times are saved with benchmark results (see `common.results`),
+so that runs (e.g. of different engines or options) can be compared statistically.
+"""
+import http.client
+import json
+import logging
+import os
+import pathlib
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS, ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from http import HTTPStatus
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import psutil
+
+from . import ENGINES, HTTP2_ENGINE, MockServer, Response, common_dir
+
+logger = logging.getLogger(__file__)
+
+src_dir = str(pathlib.Path(common_dir).parent)
+CA_CERT = common_dir + '/ssl/ca/ca.crt'
+STATIC_SIZES = {'1k': 1 << 10, '64k': 64 << 10, '1m': 1 << 20}
+PROVIDER_PATH = '/provider'
+BEACON_PATH = '/report'
+BEACON_BODY = json.dumps(dict(browserSignals=dict(bid=42, renderUrl='https://localhost/ad.html'), padding='x' * 900))
+FILE_SCENARIO = 'file'
+HTTP1 = 'http/1.1'
+HTTP2 = 'h2'
+# protocols the client negotiates (ALPN) with servers of the engines, HTTP/1.1 with the others
+ENGINE_PROTOCOLS = {HTTP2_ENGINE: HTTP2}
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    body: Optional[bytes] = None
+
+
+def scenarios(file_name: str = None) -> Dict[str, Scenario]:
+    result = {f'static-{size}': Scenario(f'static-{size}', 'GET', f'/static-{size}.js') for size in STATIC_SIZES}
+    result['provider'] = Scenario('provider', 'GET', PROVIDER_PATH + '?hostname=localhost&keys=key1,key2')
+    result['beacon'] = Scenario('beacon', 'POST', BEACON_PATH + '?signals=%7B%7D', BEACON_BODY.encode())
+    if file_name:
+        result[FILE_SCENARIO] = Scenario(FILE_SCENARIO, 'GET', '/' + file_name)
+    return result
+
+
+def create_directory(directory, file=None):
+    """Static files of `STATIC_SIZES` (and a copy of `file`, if given) to be served."""
+    for size_name, size in STATIC_SIZES.items():
+        with open(os.path.join(directory, f'static-{size_name}.js'), 'wb') as f:
+            f.write(b'var x = "' + b'a' * (size - 11) + b'";')
+    if file:
+        shutil.copy(file, directory)
+
+
+def benchmark_provider(request):
+    """A response provider answering like a trusted signals server; beacons get the default empty response."""
+    if request.path == PROVIDER_PATH:
+        keys = ','.join(request.params.get('keys', [])).split(',')
+        return Response(HTTPStatus.OK, [('Content-Type', 'application/json')],
+                        json.dumps(dict(keys={key: len(key) for key in keys if key})))
+    return None
+
+
+def available_engines():
+    from .http2 import h2
+    return [engine for engine in ENGINES if engine != HTTP2_ENGINE or h2 is not None]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(('localhost', port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+class ServerProcess:
+    def __init__(self, engine, directory, extra_args=()):
+        self.engine = engine
+        self.directory = directory
+        self.extra_args = list(extra_args)
+        self.port = free_port()
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'common.mockserver.benchmark', '--serve',
+             '--port', str(self.port), '--directory', self.directory, '--engine', self.engine] + self.extra_args,
+            cwd=src_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(self.port)
+        return self
+
+    def cpu_time(self) -> float:
+        cpu_times = psutil.Process(self.process.pid).cpu_times()
+        return cpu_times.user + cpu_times.system
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.process.terminate()
+        self.process.wait()
+
+
+def serve(port, directory, engine, static_cache=False, zero_copy_threshold=None, keep_alive=True):
+    """Runs a server (in a `ServerProcess`) with the provider of the provider and beacon scenarios."""
+    server = MockServer(port=port, directory=directory, engine=engine, response_provider=benchmark_provider,
+                        static_cache=static_cache, zero_copy_threshold=zero_copy_threshold, keep_alive=keep_alive)
+    server.run()
+
+
+class Http1Connection:
+    """An HTTP/1.1 client connection (`http.client`), negotiating `http/1.1` with ALPN."""
+
+    def __init__(self, port, context: ssl.SSLContext):
+        self.connection = http.client.HTTPSConnection('localhost', port, context=context)
+        self.connection.connect()
+        # servers not taking part in ALPN (the threading and asyncio engines) speak HTTP/1.1
+        self.protocol = self.connection.sock.selected_alpn_protocol() or HTTP1
+        self.will_close = False
+
+    def request(self, method, path, body=None) -> Tuple[int, int]:
+        """Status and body size of the response."""
+        self.connection.request(method, path, body=body)
+        response = self.connection.getresponse()
+        received = len(response.read())
+        self.will_close = response.will_close
+        return response.status, received
+
+    def close(self):
+        self.connection.close()
+
+
+class Http2Connection:
+    """An HTTP/2 client connection (of the `h2` package) making one request at a time, negotiating `h2` with ALPN."""
+
+    def __init__(self, port, context: ssl.SSLContext):
+        import h2.config
+        import h2.connection
+        self.authority = f'localhost:{port}'
+        self.sock = context.wrap_socket(socket.create_connection(('localhost', port)), server_hostname='localhost')
+        self.protocol = self.sock.selected_alpn_protocol()
+        self.connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+        self.connection.initiate_connection()
+        self.sock.sendall(self.connection.data_to_send())
+        self.will_close = False
+
+    def request(self, method, path, body=None) -> Tuple[int, int]:
+        """Status and body size of the response."""
+        import h2.events
+        stream_id = self.connection.get_next_available_stream_id()
+        headers = [(':method', method), (':scheme', 'https'), (':authority', self.authority), (':path', path)]
+        if body:
+            headers.append(('content-length', str(len(body))))
+        self.connection.send_headers(stream_id, headers, end_stream=not body)
+        if body:
+            self.connection.send_data(stream_id, body, end_stream=True)
+        self.sock.sendall(self.connection.data_to_send())
+        status, received, ended = None, 0, False
+        while not ended:
+            data = self.sock.recv(1 << 16)
+            if not data:
+                raise ConnectionError(f"connection closed while waiting for {path}")
+            for event in self.connection.receive_data(data):
+                if isinstance(event, h2.events.ResponseReceived) and event.stream_id == stream_id:
+                    status = int(dict(event.headers)[b':status'])
+                elif isinstance(event, h2.events.DataReceived):
+                    received += len(event.data)
+                    self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded) and event.stream_id == stream_id:
+                    ended = True
+                elif isinstance(event, h2.events.StreamReset) and event.stream_id == stream_id:
+                    raise ConnectionError(f"stream of {path} reset with {event.error_code!r}")
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    self.will_close = True
+            self.sock.sendall(self.connection.data_to_send())
+        return status, received
+
+    def close(self):
+        try:
+            self.connection.close_connection()
+            self.sock.sendall(self.connection.data_to_send())
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def client_worker(port, scenario: Scenario, count, keep_alive=False, protocol=HTTP1):
+    context = ssl.create_default_context(cafile=CA_CERT)
+    context.set_alpn_protocols([protocol])
+    connection_class = Http2Connection if protocol == HTTP2 else Http1Connection
+    latencies = []
+    received = 0
+    protocols = set()
+    connection = None
+    for _ in range(count):
+        start = time.perf_counter()
+        if connection is None:
+            connection = connection_class(port, context)
+            protocols.add(connection.protocol)
+        status, response_size = connection.request(scenario.method, scenario.path, body=scenario.body)
+        received += response_size
+        if not keep_alive or connection.will_close:
+            connection.close()
+            connection = None
+        assert status == 200, f"unexpected status {status} for {scenario.path}"
+        latencies.append(time.perf_counter() - start)
+    if connection is not None:
+        connection.close()
+    return latencies, received, protocols
+
+
+def run_benchmark(server: ServerProcess, scenario: Scenario, requests, concurrency, keep_alive=False):
+    """Results of a scenario run at a concurrency level, and latencies (ms) of all its requests."""
+    protocol = ENGINE_PROTOCOLS.get(server.engine, HTTP1)
+    with ProcessPoolExecutor(concurrency) as pool:
+        # warm-up: make sure every client process is spawned and the server is hot
+        list(pool.map(client_worker, [server.port] * concurrency, [scenario] * concurrency, [1] * concurrency,
+                      [False] * concurrency, [protocol] * concurrency))
+        per_worker = max(1, requests // concurrency)
+        cpu_start = server.cpu_time()
+        start = time.perf_counter()
+        results = list(pool.map(client_worker, [server.port] * concurrency, [scenario] * concurrency,
+                                [per_worker] * concurrency, [keep_alive] * concurrency, [protocol] * concurrency))
+        elapsed = time.perf_counter() - start
+        cpu = server.cpu_time() - cpu_start
+    negotiated = set().union(*(worker_protocols for _, _, worker_protocols in results))
+    assert negotiated == {protocol}, f"{server.engine} engine negotiated {sorted(map(str, negotiated))}, not {protocol}"
+    latencies_ms = np.asarray([latency for worker_latencies, _, _ in results for latency in worker_latencies]) * 1000
+    received = sum(worker_received for _, worker_received, _ in results)
+    p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+    return dict(
+        engine=server.engine,
+        protocol=protocol,
+        scenario=scenario.name,
+        concurrency=concurrency,
+        requests=len(latencies_ms),
+        rps=len(latencies_ms) / elapsed,
+        mbps=received / elapsed / 2 ** 20,
+        p50_ms=float(p50),
+        p90_ms=float(p90),
+        p99_ms=float(p99),
+        cpu_ms_per_request=cpu * 1000 / len(latencies_ms),
+    ), latencies_ms
+
+
+def save_benchmark_results(result, latencies_ms, flags):
+    from common.results import save_results
+    save_results(f"mockserver.{result['engine']}.{result['scenario']}.c{result['concurrency']}",
+                 dict(latency_ms=latencies_ms.tolist(), cpu_ms_per_request=[result['cpu_ms_per_request']]),
+                 flags=flags)
+
+
+def main():
+    argument_parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    argument_parser.add_argument('--engine', '-e', choices=ENGINES, action='append')
+    argument_parser.add_argument('--scenario', '-s', action='append',
+                                 help=f"one of {list(scenarios(FILE_SCENARIO))}; all but `file` by default")
+    argument_parser.add_argument('--file', help="a file to be served in the `file` scenario")
+    argument_parser.add_argument('--requests', '-n', type=int, default=2000)
+    argument_parser.add_argument('--concurrency', '-c', type=int, nargs='+', default=[1, 8, 32])
+    argument_parser.add_argument('--static-cache', action='store_true')
+    argument_parser.add_argument('--zero-copy-threshold', type=int)
+    argument_parser.add_argument('--keep-alive', action='store_true', help="reuse connections between requests")
+    argument_parser.add_argument('--no-server-keep-alive', action='store_true',
+                                 help="make the server close connections after every response")
+    argument_parser.add_argument('--json', help="save options and results as JSON")
+    # options of the server process
+    argument_parser.add_argument('--serve', action='store_true', help=SUPPRESS)
+    argument_parser.add_argument('--port', type=int, help=SUPPRESS)
+    argument_parser.add_argument('--directory', help=SUPPRESS)
+    arguments = argument_parser.parse_args()
+
+    if arguments.serve:
+        return serve(arguments.port, arguments.directory, arguments.engine[0], arguments.static_cache,
+                     arguments.zero_copy_threshold, not arguments.no_server_keep_alive)
+
+    all_scenarios = scenarios(arguments.file and os.path.basename(arguments.file))
+    names = arguments.scenario or [name for name in all_scenarios if name != FILE_SCENARIO]
+    unknown = set(names) - set(all_scenarios)
+    if unknown:
+        argument_parser.error(f"unknown scenarios {sorted(unknown)} (the file scenario requires --file)")
+
+    server_args = []
+    if arguments.static_cache:
+        server_args.append('--static-cache')
+    if arguments.zero_copy_threshold:
+        server_args.extend(['--zero-copy-threshold', str(arguments.zero_copy_threshold)])
+    if arguments.no_server_keep_alive:
+        server_args.append('--no-server-keep-alive')
+    flags = server_args + (['--keep-alive'] if arguments.keep_alive else [])
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    print(f"{'engine':<12}{'protocol':<10}{'scenario':<14}{'concurrency':>12}{'requests':>10}{'req/s':>10}{'MiB/s':>10}"
+          f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'CPU ms/req':>12}")
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        create_directory(directory, arguments.file)
+        for engine in arguments.engine or available_engines():
+            with ServerProcess(engine, directory, server_args) as server:
+                for name in names:
+                    for concurrency in arguments.concurrency:
+                        result, latencies_ms = run_benchmark(server, all_scenarios[name], arguments.requests,
+                                                             concurrency, arguments.keep_alive)
+                        results.append(result)
+                        save_benchmark_results(result, latencies_ms, flags)
+                        print(f"{result['engine']:<12}{result['protocol']:<10}{result['scenario']:<14}"
+                              f"{result['concurrency']:>12}{result['requests']:>10}{result['rps']:>10.1f}{result['mbps']:>10.1f}"
+                              f"{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+                              f"{result['cpu_ms_per_request']:>12.3f}", flush=True)
+    if arguments.json:
+        with open(arguments.json, 'w') as f:
+            json.dump(dict(options=flags, results=results,
+                           scenarios={name: dict(asdict(all_scenarios[name]), body=None) for name in names}),
+                      f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
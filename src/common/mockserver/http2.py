@@ -0,0 +1,214 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+HTTP/2 engine: the asyncio engine with connections negotiating `h2` (ALPN) served by the `h2` package, many
+requests being multiplexed on a single connection as streams. Connections negotiating `http/1.1` are served
+as by the asyncio engine. Requires the `h2` package (`pip install h2`).
+"""
+import asyncio
+import email.utils
+import http.client
+import logging
+import ssl
+from typing import Dict, List, Tuple
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    h2 = None
+
+from . import FLEDGE_HEADERS
+from .aio import SERVER_VERSION, AsyncioEngine, EventLoopThread
+from .shaping import NetworkShaper, ShapingPlan
+
+logger = logging.getLogger(__file__)
+
+ALPN_PROTOCOLS = ['h2', 'http/1.1']
+READ_SIZE = 64 * 1024
+# not allowed in HTTP/2 responses
+CONNECTION_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+
+class Http2Connection:
+    """State of a single HTTP/2 connection: streams being received and flow control windows being waited for."""
+
+    def __init__(self, engine: 'Http2Engine', writer: asyncio.StreamWriter):
+        self.engine = engine
+        self.writer = writer
+        self.connection = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        self.requests: Dict[int, Tuple[List[Tuple[str, str]], bytearray]] = {}
+        self.window_updated: Dict[int, asyncio.Event] = {}
+        self.streams = set()  # tasks responding to requests
+
+    def flush(self):
+        data = self.connection.data_to_send()
+        if data:
+            self.writer.write(data)
+
+    async def serve(self, reader: asyncio.StreamReader):
+        self.connection.initiate_connection()
+        self.flush()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    return
+                for event in self.connection.receive_data(data):
+                    if not self.handle_event(event):
+                        return
+                self.flush()
+                await self.writer.drain()
+        finally:
+            for stream in self.streams:
+                stream.cancel()
+
+    def handle_event(self, event) -> bool:
+        """Handles a connection event; returns False if the connection was terminated."""
+        if isinstance(event, h2.events.RequestReceived):
+            self.requests[event.stream_id] = (event.headers, bytearray())
+            if event.stream_ended:
+                self.start_response(event.stream_id)
+        elif isinstance(event, h2.events.DataReceived):
+            if event.stream_id in self.requests:
+                self.requests[event.stream_id][1].extend(event.data)
+            self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, h2.events.StreamEnded):
+            if event.stream_id in self.requests:
+                self.start_response(event.stream_id)
+        elif isinstance(event, h2.events.WindowUpdated):
+            for stream_id, window_updated in self.window_updated.items():
+                if event.stream_id in (0, stream_id):
+                    window_updated.set()
+        elif isinstance(event, h2.events.StreamReset):
+            self.requests.pop(event.stream_id, None)
+            window_updated = self.window_updated.get(event.stream_id)
+            if window_updated:
+                window_updated.set()
+        elif isinstance(event, h2.events.ConnectionTerminated):
+            return False
+        return True
+
+    def start_response(self, stream_id):
+        headers, body = self.requests.pop(stream_id)
+        stream = asyncio.get_running_loop().create_task(self.respond(stream_id, headers, bytes(body)))
+        self.streams.add(stream)
+        stream.add_done_callback(self.streams.discard)
+
+    async def respond(self, stream_id, headers: List[Tuple[str, str]], body: bytes):
+        self.engine.stats.request_received()
+        pseudo_headers = {key: value for key, value in headers if key.startswith(':')}
+        request_headers = http.client.HTTPMessage()
+        for key, value in headers:
+            if not key.startswith(':'):
+                request_headers[key] = value
+        command, target = pseudo_headers[':method'], pseudo_headers[':path']
+        try:
+            status, response_headers, response_body = await self.engine.respond(
+                command, target, request_headers, body if command == 'POST' else None)
+            path = target.split('?', 1)[0]
+            plan = self.engine.shaper.plan(path) if self.engine.shaper else None
+            await self.send_response(stream_id, status, response_headers, response_body, plan)
+        except h2.exceptions.StreamClosedError:
+            logger.debug(f"stream {stream_id} closed by the client")
+        except Exception:
+            logger.exception(f"failed to respond to {command} {target}")
+            try:
+                self.connection.reset_stream(stream_id, h2.errors.ErrorCodes.INTERNAL_ERROR)
+                self.flush()
+            except h2.exceptions.StreamClosedError:
+                pass
+
+    async def send_response(self, stream_id, status, headers, body, plan: ShapingPlan = None):
+        if plan:
+            await asyncio.sleep(plan.ttfb)
+            if plan.reset:
+                # a stream is reset rather than the whole connection, which carries other requests too
+                self.connection.reset_stream(stream_id)
+                return self.flush()
+        self.connection.send_headers(stream_id, self.render_headers(status, headers), end_stream=not len(body))
+        self.flush()
+        if not len(body):
+            return
+        if plan is None:
+            return await self.send_data(stream_id, memoryview(body))
+        await asyncio.sleep(plan.body_delay)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for offset, chunk, pause in plan.chunks(body):
+            if pause:
+                await asyncio.sleep(pause)
+            await self.send_data(stream_id, chunk, end_stream=False)
+            if plan.bandwidth:
+                await asyncio.sleep(max(0.0, start + (offset + len(chunk)) / plan.bandwidth - loop.time()))
+        self.connection.end_stream(stream_id)
+        self.flush()
+
+    async def send_data(self, stream_id, data: memoryview, end_stream=True):
+        """Sends data as flow control windows allow."""
+        while len(data):
+            size = min(len(data), self.connection.local_flow_control_window(stream_id),
+                       self.connection.max_outbound_frame_size)
+            if size <= 0:
+                window_updated = self.window_updated.setdefault(stream_id, asyncio.Event())
+                window_updated.clear()
+                await window_updated.wait()
+                continue
+            self.connection.send_data(stream_id, data[:size].tobytes())
+            data = data[size:]
+            self.flush()
+            await self.writer.drain()
+        self.window_updated.pop(stream_id, None)
+        if end_stream:
+            self.connection.end_stream(stream_id)
+            self.flush()
+
+    @staticmethod
+    def render_headers(status, headers) -> List[Tuple[str, str]]:
+        return [(':status', str(int(status))),
+                ('server', SERVER_VERSION),
+                ('date', email.utils.formatdate(usegmt=True)),
+                *((key.lower(), str(value)) for key, value in headers if key.lower() not in CONNECTION_HEADERS),
+                *((key.lower(), value) for key, value in FLEDGE_HEADERS)]
+
+
+class Http2Engine(AsyncioEngine):
+    """
+    Serves HTTP/2 to clients negotiating it with ALPN (browsers do), HTTP/1.1 to others; the ssl context
+    passed in is configured to offer both protocols, so it should not be shared with other engines.
+    """
+
+    def __init__(self, name, port, directory, callback, ssl_context: ssl.SSLContext, static_cache=None,
+                 zero_copy_threshold=None, shaper: NetworkShaper = None, keep_alive=True,
+                 loop_thread: EventLoopThread = None):
+        if h2 is None:
+            raise ImportError("the http2 MockServer engine requires the h2 package (pip install h2)")
+        ssl_context.set_alpn_protocols(ALPN_PROTOCOLS)
+        super().__init__(name, port, directory, callback, ssl_context, static_cache=static_cache,
+                         zero_copy_threshold=zero_copy_threshold, shaper=shaper, keep_alive=keep_alive,
+                         loop_thread=loop_thread)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        ssl_object = writer.get_extra_info('ssl_object')
+        if ssl_object is None or ssl_object.selected_alpn_protocol() != 'h2':
+            return await super().handle_connection(reader, writer)
+
+        self.stats.connection_opened(writer, ssl_object.session_reused)
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            await Http2Connection(self, writer).serve(reader)
+        except (ConnectionError, ssl.SSLError, h2.exceptions.ProtocolError) as e:
+            logger.debug(f"connection from {writer.get_extra_info('peername')} dropped: {e!r}")
+        finally:
+            self.stats.connection_closed(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+            self.handlers.discard(handler)
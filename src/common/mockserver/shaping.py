@@ -0,0 +1,200 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Declarative network shaping for mock servers: per-path latency distributions, bandwidth caps, stalls and resets.
+
+    shaper = NetworkShaper() \
+        .add('/igslow/.*', ttfb=Fixed(0.75)) \
+        .add('/buyer.js', ttfb=LogNormal(median=0.05, sigma=0.5), bandwidth=512 * 1024)
+    with MockServer(port=8081, directory='resources/buyer', shaper=shaper) as buyer_server:
+        ...
+
+Shaping is non-blocking with the asyncio (and http2) engine, which awaits all delays on its event loop; servers
+with a shaper use it unless an engine is given explicitly. The threading engine, if requested, applies plans with
+`ShapedWriter`, which blocks the connection's handler thread with `time.sleep` for every delay.
+"""
+import logging
+import math
+import random
+import re
+import socket
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__file__)
+
+CONTENT_LENGTH = re.compile(rb'\r\ncontent-length:\s*(\d+)', re.IGNORECASE)
+
+
+@dataclass
+class Fixed:
+    seconds: float
+
+    def sample(self, rng: random.Random) -> float:
+        return self.seconds
+
+
+@dataclass
+class Uniform:
+    low: float
+    high: float
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.uniform(self.low, self.high)
+
+
+@dataclass
+class LogNormal:
+    """Log-normal latency with given median (in seconds) and shape; heavy-tailed like real-world server latencies."""
+    median: float
+    sigma: float
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.lognormvariate(math.log(self.median), self.sigma)
+
+
+Latency = Union[Fixed, Uniform, LogNormal]
+
+
+@dataclass
+class ShapingRule:
+    """
+    :param path: regular expression a request path has to (fully) match
+    :param ttfb: delay before the status line is sent (time to first byte)
+    :param body_delay: delay between the headers and the body
+    :param bandwidth: body is trickled in `chunk_size` chunks at this many bytes per second
+    :param stall: pause injected in the middle of the body, with `stall_probability`
+    :param reset_probability: probability of resetting the connection (TCP RST) instead of responding
+    """
+    path: str
+    ttfb: Optional[Latency] = None
+    body_delay: Optional[Latency] = None
+    bandwidth: Optional[int] = None
+    chunk_size: int = 16 * 1024
+    stall: Optional[Latency] = None
+    stall_probability: float = 1.0
+    reset_probability: float = 0.0
+    pattern: re.Pattern = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.pattern = re.compile(self.path)
+
+
+@dataclass
+class ShapingPlan:
+    """Concrete delays sampled from a rule for a single response."""
+    ttfb: float = 0.0
+    body_delay: float = 0.0
+    bandwidth: Optional[int] = None
+    chunk_size: int = 16 * 1024
+    stall_at: Optional[float] = None  # position of the stall as a fraction of the body size
+    stall: float = 0.0
+    reset: bool = False
+
+    def chunks(self, body, offset=0, total=None) -> Iterator[Tuple[int, memoryview, float]]:
+        """
+        Splits a piece of the body, starting at `offset` of the `total` bytes, into
+        (offset, chunk, pause before the chunk) triples.
+        """
+        view = memoryview(body)
+        total = offset + len(view) if total is None else total
+        stall_offset = int(self.stall_at * total) - offset if self.stall_at is not None else -1
+        size = self.chunk_size if self.bandwidth else max(len(view), 1)
+        position = 0
+        while position < len(view):
+            end = min(position + size, len(view))
+            if position < stall_offset < end:
+                end = stall_offset
+            yield offset + position, view[position:end], self.stall if position == stall_offset else 0.0
+            position = end
+
+
+class NetworkShaper:
+    """Ordered list of shaping rules; the first rule matching a request path applies."""
+
+    def __init__(self, rules: List[ShapingRule] = (), seed=None):
+        self.rules = list(rules)
+        self.rng = random.Random(seed)
+
+    def add(self, path, **kwargs) -> 'NetworkShaper':
+        self.rules.append(ShapingRule(path, **kwargs))
+        return self
+
+    def rule(self, path) -> Optional[ShapingRule]:
+        for rule in self.rules:
+            if rule.pattern.fullmatch(path):
+                return rule
+        return None
+
+    def plan(self, path) -> Optional[ShapingPlan]:
+        rule = self.rule(path)
+        if rule is None:
+            return None
+        plan = ShapingPlan(
+            ttfb=rule.ttfb.sample(self.rng) if rule.ttfb else 0.0,
+            body_delay=rule.body_delay.sample(self.rng) if rule.body_delay else 0.0,
+            bandwidth=rule.bandwidth,
+            chunk_size=rule.chunk_size,
+            reset=self.rng.random() < rule.reset_probability)
+        if rule.stall and self.rng.random() < rule.stall_probability:
+            plan.stall = rule.stall.sample(self.rng)
+            plan.stall_at = self.rng.random()
+        logger.debug(f"shaping {path}: {plan}")
+        return plan
+
+
+class ShapedWriter:
+    """
+    Applies a shaping plan to a response written by a handler thread of the threading engine
+    (`RequestHandler.wfile`); the first write is expected to be the header block. Delays are slept, so the
+    handler thread is blocked for their duration.
+    """
+
+    def __init__(self, wfile, plan: ShapingPlan, connection: socket.socket):
+        self.wfile = wfile
+        self.plan = plan
+        self.connection = connection
+        self.headers_sent = False
+        self.aborted = False
+        self.offset = 0
+        self.total = None
+        self.start = None
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
+
+    def write(self, data):
+        if self.aborted:
+            return len(data)
+        if not self.headers_sent:
+            return self.write_headers(data)
+        for offset, chunk, pause in self.plan.chunks(data, self.offset, self.total):
+            if pause:
+                time.sleep(pause)
+            self.wfile.write(chunk)
+            if self.plan.bandwidth:
+                time.sleep(max(0.0, self.start + (offset + len(chunk)) / self.plan.bandwidth - time.monotonic()))
+        self.offset += len(data)
+        return len(data)
+
+    def write_headers(self, data):
+        time.sleep(self.plan.ttfb)
+        if self.plan.reset:
+            # the handler carries on writing into the void, the client just sees the connection reset
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+            self.aborted = True
+            return len(data)
+        self.headers_sent = True
+        content_length = CONTENT_LENGTH.search(bytes(data))
+        self.total = int(content_length.group(1)) if content_length else None
+        written = self.wfile.write(data)
+        time.sleep(self.plan.body_delay)
+        self.start = time.monotonic()
+        return written
+
+    def flush(self):
+        if not self.aborted:
+            self.wfile.flush()
@@ -0,0 +1,179 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Dynamic trusted bidding / scoring signals (a key-value server) to be used as a mock server's response provider:
+
+    signals = TrustedSignalsProvider(KeyValueIndex.load('resources/signals.csv'), default_latency=Fixed(0.02))
+    with MockServer(port=8081, directory='resources/buyer', response_provider=signals) as buyer_server:
+        ...
+    logger.info(f"trusted signals: {signals.summary()}")
+
+Requests are answered according to the FLEDGE key-value server protocol (version 2):
+* bidding signals: `?hostname=...&keys=k1,k2&interestGroupNames=ig1,ig2` =>
+  `{"keys": {"k1": ..., "k2": ...}, "perInterestGroupData": {"ig1": ...}}`
+* scoring signals: `?hostname=...&renderUrls=u1,u2&adComponentRenderUrls=u3` =>
+  `{"renderUrls": {"u1": ..., "u2": ...}, "adComponentRenderUrls": {"u3": ...}}`
+
+A batched fetch is as slow as its slowest key (see `key_latency` and `default_latency`).
+"""
+import asyncio
+import csv
+import json
+import logging
+import random
+import re
+import statistics
+import threading
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional
+
+from . import Request, Response
+from .shaping import Latency
+
+logger = logging.getLogger(__file__)
+
+SIGNALS_HEADERS = (
+    ('Content-Type', 'application/json'),
+    ('Ad-Auction-Allowed', 'true'),
+    ('X-fledge-bidding-signals-format-version', '2'),
+)
+
+
+class KeyValueIndex:
+    """In-memory key-value index with batched lookups."""
+
+    def __init__(self, values: Dict[str, Any] = None):
+        self.values = dict(values or {})
+
+    @classmethod
+    def load(cls, path) -> 'KeyValueIndex':
+        """
+        Loads a JSON object (`{"key": value, ...}`) or, for `.csv` files, `key,value` rows
+        (values are parsed as JSON where possible, a header row `key,value` is skipped).
+        """
+        if str(path).endswith('.csv'):
+            return cls.from_csv(path)
+        with open(path) as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_csv(cls, path) -> 'KeyValueIndex':
+        values = {}
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if not row or row == ['key', 'value']:
+                    continue
+                key, value = row[0], ','.join(row[1:])
+                try:
+                    values[key] = json.loads(value)
+                except ValueError:
+                    values[key] = value
+        return cls(values)
+
+    def lookup(self, keys: List[str]) -> Dict[str, Any]:
+        """Values of the keys present in the index; missing keys are left out, like a real KV server does."""
+        return {key: self.values[key] for key in keys if key in self.values}
+
+    def __len__(self):
+        return len(self.values)
+
+
+@dataclass
+class SignalsFetch:
+    """A single (batched) signals request, as seen by the server."""
+    timestamp: float
+    hostname: Optional[str]
+    keys: List[str]
+    interest_group_names: List[str]
+    missing_keys: List[str]
+    latency: float
+
+
+def split_param(request: Request, key) -> List[str]:
+    return [value for values in request.params.get(key, ()) for value in values.split(',') if value]
+
+
+class TrustedSignalsProvider:
+    """
+    Response provider answering trusted bidding and scoring signals requests for paths matching `path`
+    (a regular expression) from a `KeyValueIndex`; other requests are left to the server (`None`).
+
+    :param per_interest_group_data: `perInterestGroupData` entries (e.g. priority vectors) by interest group name
+    :param key_latency: lookup latency of particular keys
+    :param default_latency: lookup latency of other keys
+    """
+
+    def __init__(self, index: KeyValueIndex, path=r'.*trusted_(bidding|scoring)_signals.*',
+                 per_interest_group_data: Dict[str, Any] = None,
+                 key_latency: Dict[str, Latency] = None, default_latency: Latency = None, seed=None):
+        self.index = index
+        self.pattern = re.compile(path)
+        self.per_interest_group_data = per_interest_group_data or {}
+        self.key_latency = key_latency or {}
+        self.default_latency = default_latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.fetches: List[SignalsFetch] = []
+
+    def __call__(self, request: Request):
+        if not self.pattern.fullmatch(request.path):
+            return None
+        if 'renderUrls' in request.params or 'adComponentRenderUrls' in request.params:
+            keys = split_param(request, 'renderUrls') + split_param(request, 'adComponentRenderUrls')
+            body = {
+                'renderUrls': self.index.lookup(split_param(request, 'renderUrls')),
+                'adComponentRenderUrls': self.index.lookup(split_param(request, 'adComponentRenderUrls')),
+            }
+            interest_group_names = []
+        else:
+            keys = split_param(request, 'keys')
+            interest_group_names = split_param(request, 'interestGroupNames')
+            body = {
+                'keys': self.index.lookup(keys),
+                'perInterestGroupData': {name: self.per_interest_group_data[name]
+                                         for name in interest_group_names if name in self.per_interest_group_data},
+            }
+
+        latency = max((self.sample_latency(key) for key in keys), default=0.0)
+        fetch = SignalsFetch(
+            timestamp=request.timestamp,
+            hostname=request.params.get('hostname', [None])[0],
+            keys=keys,
+            interest_group_names=interest_group_names,
+            missing_keys=[key for key in keys if key not in self.index.values],
+            latency=latency)
+        with self.lock:
+            self.fetches.append(fetch)
+        logger.debug("trusted signals request %s: %d keys, latency %.3f s", request.path, len(keys), latency)
+
+        response = Response(HTTPStatus.OK, SIGNALS_HEADERS, json.dumps(body))
+        if not latency:
+            return response
+        return self.delayed(response, latency)
+
+    def sample_latency(self, key) -> float:
+        latency = self.key_latency.get(key, self.default_latency)
+        return latency.sample(self.rng) if latency else 0.0
+
+    @staticmethod
+    async def delayed(response: Response, latency: float) -> Response:
+        await asyncio.sleep(latency)
+        return response
+
+    def keys_per_fetch(self) -> List[int]:
+        with self.lock:
+            return [len(fetch.keys) for fetch in self.fetches]
+
+    def summary(self) -> Dict[str, float]:
+        with self.lock:
+            fetches = list(self.fetches)
+        keys_per_fetch = [len(fetch.keys) for fetch in fetches]
+        return dict(
+            fetches=len(fetches),
+            keys=sum(keys_per_fetch),
+            keys_per_fetch_mean=statistics.mean(keys_per_fetch) if fetches else 0.0,
+            keys_per_fetch_max=max(keys_per_fetch, default=0),
+            missing_keys=sum(len(fetch.missing_keys) for fetch in fetches),
+            latency_mean=statistics.mean(fetch.latency for fetch in fetches) if fetches else 0.0,
+        )
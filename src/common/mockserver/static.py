@@ -0,0 +1,163 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+import email.utils
+import gzip
+import hashlib
+import logging
+import os
+import stat
+import threading
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from . import guess_type, map_file, translate_path
+
+logger = logging.getLogger(__file__)
+
+GZIP = 'gzip'
+BROTLI = 'br'
+COMPRESSORS = {
+    GZIP: lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+}
+if brotli:
+    COMPRESSORS[BROTLI] = lambda data: brotli.compress(data)
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/wasm')
+
+
+@dataclass
+class CachedFile:
+    path: str
+    mtime_ns: int
+    size: int
+    content_type: str
+    body: Union[bytes, memoryview]
+    etag: str
+    last_modified: str
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or self.etag in tags or f'W/{self.etag}' in tags
+
+    def response(self, accept_encoding: Optional[str] = None, if_none_match: Optional[str] = None,
+                 head_only=False) -> Tuple[HTTPStatus, List[Tuple[str, str]], Union[bytes, memoryview]]:
+        """Status, headers and body to be sent for a (possibly conditional) GET or HEAD request."""
+        headers = [('ETag', self.etag), ('Last-Modified', self.last_modified)]
+        if self.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if self.matches(if_none_match):
+            return HTTPStatus.NOT_MODIFIED, headers, b''
+        body = self.body
+        encoding = self.choose_encoding(accept_encoding)
+        if encoding:
+            body = self.variants[encoding]
+            headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Type', self.content_type))
+        headers.append(('Content-Length', str(len(body))))
+        return HTTPStatus.OK, headers, b'' if head_only else body
+
+    def choose_encoding(self, accept_encoding: Optional[str]) -> Optional[str]:
+        if not self.variants or not accept_encoding:
+            return None
+        accepted = {coding.split(';')[0].strip() for coding in accept_encoding.split(',')}
+        for encoding in (BROTLI, GZIP):
+            if encoding in accepted and encoding in self.variants:
+                return encoding
+        return None
+
+
+class StaticFileCache:
+    """
+    In-memory cache of the files served from a directory, with content type, ETag and Last-Modified precomputed
+    (and optionally compressed variants of compressible files). Every lookup costs a single `stat()`; an entry is
+    reloaded when the file's mtime or size changes. Files of at least `zero_copy_threshold` bytes are kept as
+    memory-mapped buffers rather than copied into the Python heap.
+
+    Only regular files are cached; everything else (directories, missing files) is left to the regular handler.
+
+    :param transform: applied to the content of compressible (text) files when they are loaded
+    """
+
+    def __init__(self, directory, encodings: Iterable[str] = (), preload=True, zero_copy_threshold: int = None,
+                 transform: Callable[[bytes], bytes] = None):
+        self.directory = os.path.abspath(directory)
+        self.zero_copy_threshold = zero_copy_threshold
+        self.transform = transform
+        self.encodings = [encoding for encoding in encodings if encoding in COMPRESSORS]
+        for encoding in set(encodings) - set(self.encodings):
+            logger.warning(f"{encoding} compression is not available, skipping it")
+        self.entries: Dict[str, CachedFile] = {}
+        self.lock = threading.Lock()
+        if preload:
+            self.preload()
+
+    def preload(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                self.load(os.path.join(root, name))
+        logger.info(f"static cache for {self.directory}: {len(self.entries)} files, "
+                    f"{sum(entry.size for entry in self.entries.values())} bytes")
+
+    def load(self, file_path) -> Optional[CachedFile]:
+        try:
+            with open(file_path, 'rb') as f:
+                file_stat = os.fstat(f.fileno())
+                if self.zero_copy_threshold and file_stat.st_size >= self.zero_copy_threshold:
+                    body = map_file(f)
+                else:
+                    body = f.read()
+        except OSError:
+            return None
+        content_type = guess_type(file_path)
+        if self.transform and content_type.startswith(COMPRESSIBLE_TYPES):
+            body = self.transform(bytes(body))
+        entry = CachedFile(
+            path=file_path,
+            mtime_ns=file_stat.st_mtime_ns,
+            size=file_stat.st_size,
+            content_type=content_type,
+            body=body,
+            etag='"' + hashlib.sha1(body).hexdigest() + '"',
+            last_modified=email.utils.formatdate(file_stat.st_mtime, usegmt=True))
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            for encoding in self.encodings:
+                compressed = COMPRESSORS[encoding](body)
+                if len(compressed) < len(body):
+                    entry.variants[encoding] = compressed
+        with self.lock:
+            self.entries[file_path] = entry
+        return entry
+
+    def add_transform(self, transform: Callable[[bytes], bytes]):
+        """Applies `transform` (after the current one, if any) to text files, reloading the ones loaded already."""
+        previous = self.transform
+        self.transform = transform if previous is None else lambda content: transform(previous(content))
+        with self.lock:
+            paths = list(self.entries)
+            self.entries.clear()
+        for file_path in paths:
+            self.load(file_path)
+
+    def lookup(self, url_path) -> Optional[CachedFile]:
+        file_path = translate_path(self.directory, url_path)
+        if file_path.endswith('/'):
+            file_path += 'index.html'
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        entry = self.entries.get(file_path)
+        if entry is not None and entry.mtime_ns == file_stat.st_mtime_ns and entry.size == file_stat.st_size:
+            return entry
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        return self.load(file_path)
@@ -0,0 +1,102 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+"Golden" browser profiles (see `PROFILE_SNAPSHOTS` in `common.base_test`): a profile initialised once per browser
+build (databases created, certificates and components in place) is cloned for every test instead of letting the
+browser build a profile from scratch.
+
+Snapshots are cached by the hash of the browser binary, so a snapshot is rebuilt only when the build changes.
+Clones are made with `cp --reflink=auto`, i.e. copy-on-write where the filesystem supports it (btrfs, xfs) and
+a regular copy elsewhere. Hard links are not an option: the browser modifies its databases in place.
+"""
+import fcntl
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__file__)
+
+# files left behind by a browser that was not shut down cleanly; they would make a clone look locked
+SINGLETON_FILES = ('SingletonLock', 'SingletonSocket', 'SingletonCookie')
+
+
+@functools.lru_cache()
+def binary_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_browser_binary(binary_location: Optional[str]) -> Optional[str]:
+    if binary_location:
+        return binary_location
+    for name in ('google-chrome', 'chromium', 'chromium-browser', 'chrome'):
+        path = shutil.which(name)
+        if path:
+            return os.path.realpath(path)
+    return None
+
+
+def clone_profile(snapshot_dir, profile_dir):
+    if os.path.exists(profile_dir):
+        shutil.rmtree(profile_dir)
+    try:
+        subprocess.run(['cp', '-a', '--reflink=auto', snapshot_dir, profile_dir], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.debug(f"cp --reflink failed ({e!r}), copying {snapshot_dir} with shutil")
+        if os.path.exists(profile_dir):
+            shutil.rmtree(profile_dir)
+        shutil.copytree(snapshot_dir, profile_dir, symlinks=True)
+
+
+class ProfileSnapshots:
+    """Snapshots of browser profiles in `cache_dir`, one per browser build."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def snapshot_dir(self, build_hash) -> str:
+        return os.path.join(self.cache_dir, build_hash[:16])
+
+    def get(self, binary_path, build: Callable[[str], None]) -> str:
+        """
+        The snapshot for given browser binary, built first if there is none: `build` is expected to initialise
+        a profile in the directory it is given. Parallel workers wait for the one building the snapshot.
+        """
+        snapshot_dir = self.snapshot_dir(binary_hash(binary_path))
+        if os.path.isdir(snapshot_dir):
+            return snapshot_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(snapshot_dir + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(snapshot_dir):
+                self.build(snapshot_dir, build, binary_path)
+        return snapshot_dir
+
+    def build(self, snapshot_dir, build: Callable[[str], None], binary_path):
+        start = time.perf_counter()
+        build_dir = tempfile.mkdtemp(prefix='building-', dir=self.cache_dir)
+        try:
+            profile_dir = os.path.join(build_dir, 'profile')
+            build(profile_dir)
+            for name in SINGLETON_FILES:
+                if os.path.lexists(os.path.join(profile_dir, name)):
+                    os.remove(os.path.join(profile_dir, name))
+            os.rename(profile_dir, snapshot_dir)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        logger.info(f"profile snapshot for {binary_path} built in {time.perf_counter() - start:.2f} s: {snapshot_dir}")
+
+    def clone(self, binary_path, build: Callable[[str], None], profile_dir):
+        start = time.perf_counter()
+        clone_profile(self.get(binary_path, build), profile_dir)
+        logger.debug(f"profile cloned into {profile_dir} in {time.perf_counter() - start:.3f} s")
@@ -0,0 +1,237 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Benchmark results kept between runs: every sample of every metric is appended (as one JSON line per test and
+metric) to `results.jsonl` in `BENCHMARK_RESULTS_DIR`, together with the browser version, its flags and
+the environment, so that runs against different browser builds can be compared statistically:
+
+    python3 -m common.results list
+    python3 -m common.results compare <baseline run id> <candidate run id>
+"""
+import fcntl
+import json
+import math
+import os
+import platform
+import re
+import socket
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+BENCHMARK_RESULTS_DIR = os.environ.get('BENCHMARK_RESULTS_DIR')
+RESULTS_FILE = 'results.jsonl'
+# environment variables affecting results, recorded with them
+RECORDED_ENV = ('CHROME_HEADLESS', 'MOCKSERVER_ENGINE', 'JOBS', 'BROWSER_SESSION_POOL', 'PROFILE_SNAPSHOTS')
+
+
+def new_run_id() -> str:
+    return time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+
+def current_run_id() -> str:
+    """
+    `BENCHMARK_RUN_ID`, generated when first needed and exported, so that all results of a process and of its
+    child processes (e.g. parallel workers, see `common.runner`) belong to the same run.
+    """
+    return os.environ.setdefault('BENCHMARK_RUN_ID', new_run_id())
+
+
+@dataclass(frozen=True)
+class MetricKind:
+    unit: str
+    higher_is_better: bool = False
+
+
+# kinds of metrics by (fully matching) metric name patterns, the first match applies; all metrics saved by tests
+# so far (durations, process counts, memory, CPU time) are better when lower
+METRIC_KINDS = [
+    (re.compile(r'max_processes\..*'), MetricKind('processes')),
+    (re.compile(r'max_threads\..*'), MetricKind('threads')),
+    (re.compile(r'peak_[pr]ss_mb\..*'), MetricKind('MiB')),
+    (re.compile(r'cpu_s\..*'), MetricKind('CPU s')),
+    (re.compile(r'.*(concurrency|_rps|_mbps)'), MetricKind('', higher_is_better=True)),
+    (re.compile(r'rtb_debug\..*|.*_ms'), MetricKind('ms')),
+    (re.compile(r'.*_s'), MetricKind('s')),
+]
+DEFAULT_METRIC_KIND = MetricKind('')
+
+
+def metric_kind(metric: str) -> MetricKind:
+    return next((kind for pattern, kind in METRIC_KINDS if pattern.fullmatch(metric)), DEFAULT_METRIC_KIND)
+
+
+@dataclass
+class BenchmarkRecord:
+    test: str
+    metric: str
+    samples: List[float]
+    run_id: str = field(default_factory=current_run_id)
+    unit: Optional[str] = None  # None in records saved before units were recorded, see `metric_kind`
+    higher_is_better: bool = False
+    browser_version: Optional[str] = None
+    flags: List[str] = field(default_factory=list)
+    environment: Dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+
+def environment_info() -> Dict[str, Any]:
+    return dict(
+        hostname=socket.gethostname(),
+        platform=platform.platform(),
+        python=platform.python_version(),
+        cpus=os.cpu_count(),
+        **{key: os.environ[key] for key in RECORDED_ENV if key in os.environ})
+
+
+def browser_version(driver) -> Optional[str]:
+    return driver.capabilities.get('browserVersion') if driver is not None else None
+
+
+class ResultsStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, RESULTS_FILE)
+
+    def append(self, records: Iterable[BenchmarkRecord]):
+        os.makedirs(self.directory, exist_ok=True)
+        lines = ''.join(json.dumps(asdict(record)) + '\n' for record in records)
+        with open(self.path, 'a') as f:
+            # parallel workers append to the same file
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(lines)
+
+    def records(self, run_id: str = None) -> List[BenchmarkRecord]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            records = [BenchmarkRecord(**json.loads(line)) for line in f if line.strip()]
+        return [record for record in records if run_id is None or record.run_id == run_id]
+
+    def samples(self, run_id) -> Dict[tuple, List[float]]:
+        """All samples of a run by (test, metric); a test run repeatedly within the run contributes all its samples."""
+        samples: Dict[tuple, List[float]] = {}
+        for record in self.records(run_id):
+            samples.setdefault((record.test, record.metric), []).extend(record.samples)
+        return samples
+
+    def kinds(self, run_id) -> Dict[tuple, MetricKind]:
+        """Kinds of metrics of a run by (test, metric), as recorded (or by their names, in older records)."""
+        return {(record.test, record.metric): metric_kind(record.metric) if record.unit is None
+                else MetricKind(record.unit, record.higher_is_better)
+                for record in self.records(run_id)}
+
+
+def save_results(test: str, results: Dict[str, List[float]], driver=None, flags: Iterable[str] = (),
+                 kinds: Dict[str, MetricKind] = None):
+    """
+    Appends samples of metrics of a test to the results store, if BENCHMARK_RESULTS_DIR is set. Units and
+    directions of metrics are recorded as given by `kinds` or else as found by `metric_kind`.
+    """
+    if not BENCHMARK_RESULTS_DIR or not results:
+        return
+    version = browser_version(driver)
+    environment = environment_info()
+    run_id = current_run_id()
+    kinds = kinds or {}
+    ResultsStore(BENCHMARK_RESULTS_DIR).append(
+        BenchmarkRecord(test=test, metric=metric, samples=[float(sample) for sample in samples], run_id=run_id,
+                        unit=kinds.get(metric, metric_kind(metric)).unit,
+                        higher_is_better=kinds.get(metric, metric_kind(metric)).higher_is_better,
+                        browser_version=version, flags=list(flags), environment=environment)
+        for metric, samples in results.items())
+
+
+def save_series(test: str, name, data):
+    """Saves a time series of a test (as `series/<run id>/<test>.<name>.json`), if BENCHMARK_RESULTS_DIR is set."""
+    if not BENCHMARK_RESULTS_DIR:
+        return
+    directory = os.path.join(BENCHMARK_RESULTS_DIR, 'series', current_run_id())
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f'{test}.{name}.json'), 'w') as f:
+        json.dump(data, f)
+
+
+def mann_whitney_u(x: Sequence[float], y: Sequence[float]) -> float:
+    """
+    Two-sided p-value of the Mann-Whitney U test (normal approximation with tie and continuity corrections,
+    which is adequate from ~8 samples per group; with fewer samples it is conservative at best).
+    """
+    n1, n2 = len(x), len(y)
+    if not n1 or not n2:
+        return 1.0
+    values = np.concatenate([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+    order = np.argsort(values, kind='mergesort')
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(1, len(values) + 1)
+    # average ranks of ties
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    ranks = (np.bincount(inverse, weights=ranks) / counts)[inverse]
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - np.sum(counts ** 3 - counts) / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+
+def bootstrap_ci(baseline: Sequence[float], candidate: Sequence[float], confidence=0.95, resamples=10000,
+                 seed=0) -> tuple:
+    """Bootstrap confidence interval of the relative change of the median, candidate vs. baseline."""
+    rng = np.random.default_rng(seed)
+    baseline = np.asarray(baseline, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    baseline_medians = np.median(rng.choice(baseline, (resamples, len(baseline))), axis=1)
+    candidate_medians = np.median(rng.choice(candidate, (resamples, len(candidate))), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        changes = candidate_medians / baseline_medians - 1
+    changes = changes[np.isfinite(changes)]
+    if not len(changes):
+        return math.nan, math.nan
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(changes, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+@dataclass
+class Comparison:
+    test: str
+    metric: str
+    baseline_median: float
+    candidate_median: float
+    change: float  # relative change of the median
+    ci_low: float
+    ci_high: float
+    p_value: float
+    regression: bool
+    improvement: bool
+    unit: str = ''
+
+
+def compare(baseline: Dict[tuple, List[float]], candidate: Dict[tuple, List[float]], alpha=0.05,
+            threshold=0.05, confidence=0.95, kinds: Dict[tuple, MetricKind] = None) -> List[Comparison]:
+    """
+    Compares metrics present in both runs. A change for the worse (an increase, or a decrease of metrics
+    whose `kinds` are better when higher; kinds are found by `metric_kind` if not given) is a regression; it is
+    flagged when the difference is significant (Mann-Whitney p-value below `alpha`) and the whole confidence
+    interval of the relative change lies beyond `threshold`.
+    """
+    comparisons = []
+    for key in sorted(baseline.keys() & candidate.keys()):
+        x, y = baseline[key], candidate[key]
+        kind = (kinds or {}).get(key) or metric_kind(key[1])
+        baseline_median, candidate_median = float(np.median(x)), float(np.median(y))
+        p_value = mann_whitney_u(x, y)
+        ci_low, ci_high = bootstrap_ci(x, y, confidence)
+        change = candidate_median / baseline_median - 1 if baseline_median else math.nan
+        increase, decrease = p_value < alpha and ci_low > threshold, p_value < alpha and ci_high < -threshold
+        comparisons.append(Comparison(
+            *key, baseline_median, candidate_median, change, ci_low, ci_high, p_value,
+            regression=decrease if kind.higher_is_better else increase,
+            improvement=increase if kind.higher_is_better else decrease,
+            unit=kind.unit))
+    return comparisons
@@ -0,0 +1,47 @@
+import sys
+from argparse import ArgumentParser
+
+from . import BENCHMARK_RESULTS_DIR, ResultsStore, compare
+
+if __name__ == '__main__':
+    argument_parser = ArgumentParser(description="Lists and compares benchmark runs.")
+    argument_parser.add_argument('--dir', '-d', default=BENCHMARK_RESULTS_DIR, required=not BENCHMARK_RESULTS_DIR,
+                                 help="results directory (BENCHMARK_RESULTS_DIR by default)")
+    subparsers = argument_parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="list runs")
+    compare_parser = subparsers.add_parser('compare', help="compare two runs; exits with 1 on regressions")
+    compare_parser.add_argument('baseline', help="run id")
+    compare_parser.add_argument('candidate', help="run id")
+    compare_parser.add_argument('--alpha', type=float, default=0.05, help="significance level")
+    compare_parser.add_argument('--threshold', type=float, default=0.05,
+                                help="minimal relative change for the worse (the nearer end of its confidence "
+                                     "interval) to report")
+    compare_parser.add_argument('--confidence', type=float, default=0.95)
+    arguments = argument_parser.parse_args()
+
+    store = ResultsStore(arguments.dir)
+    if arguments.command == 'list':
+        runs = {}
+        for record in store.records():
+            run = runs.setdefault(record.run_id, dict(version=record.browser_version, start=record.timestamp,
+                                                      tests=set(), samples=0))
+            run['tests'].add(record.test)
+            run['samples'] += len(record.samples)
+        print(f"{'run id':<28}{'browser version':<20}{'tests':>8}{'samples':>10}")
+        for run_id, run in sorted(runs.items(), key=lambda item: item[1]['start']):
+            print(f"{run_id:<28}{run['version'] or '-':<20}{len(run['tests']):>8}{run['samples']:>10}")
+        sys.exit(0)
+
+    comparisons = compare(store.samples(arguments.baseline), store.samples(arguments.candidate),
+                          arguments.alpha, arguments.threshold, arguments.confidence,
+                          kinds={**store.kinds(arguments.baseline), **store.kinds(arguments.candidate)})
+    if not comparisons:
+        sys.exit(f"no common metrics in runs {arguments.baseline} and {arguments.candidate}")
+    print(f"{'test / metric':<90}{'unit':>10}{'baseline':>12}{'candidate':>12}{'change':>9}{'CI':>20}{'p':>8}")
+    for c in comparisons:
+        flag = 'REGRESSION' if c.regression else 'improvement' if c.improvement else ''
+        print(f"{c.test + ' / ' + c.metric:<90}{c.unit or '-':>10}{c.baseline_median:>12.3f}{c.candidate_median:>12.3f}"
+              f"{c.change:>+9.1%}{f'[{c.ci_low:+.1%}, {c.ci_high:+.1%}]':>20}{c.p_value:>8.3f}  {flag}")
+    regressions = sum(c.regression for c in comparisons)
+    print(f"\n{len(comparisons)} metrics compared, {regressions} regressions")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,198 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Runs test cases in parallel: tests are sharded (dynamically, through a shared queue) across worker processes,
+each with its own browser profile directory, chromedriver log and mock server port range, and the results
+and timings of all workers are merged into a single report.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+import unittest
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from common.results import current_run_id
+
+logger = logging.getLogger(__file__)
+
+# Port ranges of workers are this far apart; it has to exceed the spread of ports hard-coded in tests.
+DEFAULT_PORT_STEP = 1000
+
+OK = 'ok'
+FAIL = 'FAIL'
+ERROR = 'ERROR'
+SKIPPED = 'skipped'
+
+
+@dataclass
+class TestOutcome:
+    test_id: str
+    worker: int
+    status: str
+    duration: float
+    details: Optional[str] = None
+
+
+@dataclass
+class Report:
+    workers: int
+    wall_time: float
+    outcomes: List[TestOutcome] = field(default_factory=list)
+
+    @property
+    def total_time(self) -> float:
+        """Sum of test durations, i.e. roughly the time a serial run would take."""
+        return sum(outcome.duration for outcome in self.outcomes)
+
+    def counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in (OK, FAIL, ERROR, SKIPPED)}
+        for outcome in self.outcomes:
+            counts[outcome.status] += 1
+        return counts
+
+    def was_successful(self) -> bool:
+        return not any(outcome.status in (FAIL, ERROR) for outcome in self.outcomes)
+
+    def to_json(self) -> dict:
+        return dict(workers=self.workers, wall_time=self.wall_time, total_time=self.total_time,
+                    counts=self.counts(), outcomes=[asdict(outcome) for outcome in self.outcomes])
+
+    def print(self, stream=sys.stdout):
+        print(f"\n{'test':<100}{'worker':>8}{'time [s]':>10}  status", file=stream)
+        for outcome in sorted(self.outcomes, key=lambda outcome: -outcome.duration):
+            print(f"{outcome.test_id:<100}{outcome.worker:>8}{outcome.duration:>10.2f}  {outcome.status}", file=stream)
+        for outcome in self.outcomes:
+            if outcome.details:
+                print(f"\n{'=' * 70}\n{outcome.status}: {outcome.test_id} (worker {outcome.worker})\n{'-' * 70}\n"
+                      f"{outcome.details}", file=stream)
+        speedup = self.total_time / self.wall_time if self.wall_time else 0.0
+        print(f"\n{'-' * 70}\nRan {len(self.outcomes)} tests in {self.wall_time:.2f} s with {self.workers} workers "
+              f"(tests took {self.total_time:.2f} s in total, speedup {speedup:.2f}x): "
+              f"{', '.join(f'{status}={count}' for status, count in self.counts().items())}", file=stream)
+        print("OK" if self.was_successful() else "FAILED", file=stream)
+
+
+def iterate_tests(suite: unittest.TestSuite) -> Iterable[unittest.TestCase]:
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iterate_tests(test)
+        else:
+            yield test
+
+
+def discover_test_ids(names: List[str] = (), start_dir='.') -> List[str]:
+    """Ids of test cases given by names (as accepted by `python -m unittest`), or of all tests found in start_dir."""
+    loader = unittest.TestLoader()
+    if names:
+        suite = loader.loadTestsFromNames(names)
+    else:
+        suite = loader.discover(start_dir, top_level_dir='.')
+    return [test.id() for test in iterate_tests(suite)]
+
+
+def worker_env(index, profile_dir, chromedriver_log_path, port_step=DEFAULT_PORT_STEP) -> Dict[str, str]:
+    """
+    Environment isolating a worker from others (benchmark results of all workers share a run id, though);
+    worker 0 keeps the original ports.
+    """
+    return dict(
+        BENCHMARK_RUN_ID=current_run_id(),
+        PROFILE_DIR=f'{profile_dir}-worker-{index}',
+        CHROMEDRIVER_LOG_PATH=f'{chromedriver_log_path}.worker-{index}',
+        MOCKSERVER_PORT_OFFSET=str(index * port_step),
+    )
+
+
+def run_test(test_id, worker) -> TestOutcome:
+    suite = unittest.TestLoader().loadTestsFromName(test_id)
+    result = unittest.TestResult()
+    start = time.perf_counter()
+    suite.run(result)
+    duration = time.perf_counter() - start
+    if result.errors:
+        status, details = ERROR, '\n'.join(error for _, error in result.errors)
+    elif result.failures or result.unexpectedSuccesses:
+        status, details = FAIL, '\n'.join(failure for _, failure in result.failures) or 'unexpected success'
+    elif result.skipped:
+        status, details = SKIPPED, None
+    else:
+        status, details = OK, None
+    return TestOutcome(test_id, worker, status, duration, details)
+
+
+def worker_main(index, env: Dict[str, str], output_path, tasks: multiprocessing.Queue,
+                outcomes: multiprocessing.Queue):
+    # the environment is set before any test module (and so common.base_test) gets imported
+    os.environ.update(env)
+    with open(output_path, 'ab') as output:
+        os.dup2(output.fileno(), sys.stdout.fileno())
+        os.dup2(output.fileno(), sys.stderr.fileno())
+    while True:
+        test_id = tasks.get()
+        if test_id is None:
+            return
+        try:
+            outcome = run_test(test_id, index)
+        except Exception:
+            outcome = TestOutcome(test_id, index, ERROR, 0.0, traceback.format_exc())
+        outcomes.put(outcome)
+
+
+def run_parallel(test_ids: List[str], workers: int, output_dir, profile_dir, chromedriver_log_path,
+                 port_step=DEFAULT_PORT_STEP) -> Report:
+    """
+    Runs given tests in `workers` processes. Output of worker N (test logs, chromedriver messages) goes to
+    `output_dir/worker-N.log`.
+    """
+    workers = max(1, min(workers, len(test_ids)))
+    context = multiprocessing.get_context('spawn')
+    tasks = context.Queue()
+    outcomes = context.Queue()
+    for test_id in test_ids:
+        tasks.put(test_id)
+    for _ in range(workers):
+        tasks.put(None)
+
+    os.makedirs(output_dir, exist_ok=True)
+    processes = []
+    start = time.perf_counter()
+    for index in range(workers):
+        env = worker_env(index, profile_dir, chromedriver_log_path, port_step)
+        output_path = os.path.join(output_dir, f'worker-{index}.log')
+        process = context.Process(target=worker_main, args=(index, env, output_path, tasks, outcomes),
+                                  name=f'test-worker-{index}')
+        process.start()
+        processes.append(process)
+        logger.info(f"worker {index} started (pid {process.pid}, {env}), output: {output_path}")
+
+    report = Report(workers=workers, wall_time=0.0)
+    while len(report.outcomes) < len(test_ids):
+        try:
+            outcome = outcomes.get(timeout=1)
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+            continue
+        report.outcomes.append(outcome)
+        logger.info(f"[{len(report.outcomes)}/{len(test_ids)}] {outcome.test_id} ... {outcome.status} "
+                    f"({outcome.duration:.2f} s, worker {outcome.worker})")
+    report.wall_time = time.perf_counter() - start
+
+    finished = {outcome.test_id for outcome in report.outcomes}
+    for test_id in test_ids:
+        if test_id not in finished:
+            report.outcomes.append(TestOutcome(test_id, -1, ERROR, 0.0, "worker process died before reporting"))
+    for process in processes:
+        process.join()
+    return report
+
+
+def save_report(report: Report, path):
+    with open(path, 'w') as f:
+        json.dump(report.to_json(), f, indent=2)
@@ -0,0 +1,32 @@
+import logging
+import os
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+from . import DEFAULT_PORT_STEP, discover_test_ids, run_parallel, save_report
+
+if __name__ == '__main__':
+    argument_parser = ArgumentParser(description="Runs tests in parallel worker processes.")
+    argument_parser.add_argument('names', nargs='*',
+                                 help="modules, classes or methods (as for python -m unittest); all tests by default")
+    argument_parser.add_argument('--jobs', '-j', type=int, default=int(os.environ.get('JOBS', 0)) or os.cpu_count())
+    argument_parser.add_argument('--start-dir', '-s', default='.', help="directory to discover tests in")
+    argument_parser.add_argument('--output-dir', '-o', help="where worker logs are written (a temporary directory "
+                                                            "by default)")
+    argument_parser.add_argument('--report', help="save the merged report as JSON to this file")
+    argument_parser.add_argument('--port-step', type=int, default=DEFAULT_PORT_STEP,
+                                 help="distance between port ranges of consecutive workers")
+    arguments = argument_parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    from common.base_test import CHROMEDRIVER_LOG_PATH, PROFILE_DIR
+
+    test_ids = discover_test_ids(arguments.names, arguments.start_dir)
+    output_dir = arguments.output_dir or tempfile.mkdtemp(prefix='fledge-tests-')
+    report = run_parallel(test_ids, arguments.jobs, output_dir, PROFILE_DIR, CHROMEDRIVER_LOG_PATH,
+                          arguments.port_step)
+    report.print()
+    if arguments.report:
+        save_report(report, arguments.report)
+    sys.exit(0 if report.was_successful() else 1)
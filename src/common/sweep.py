@@ -0,0 +1,203 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Scaling sweeps: a measurement (e.g. of bidding worklets concurrency) is run on every point of a grid of buyers,
+interest groups per buyer, auctions and execution modes, then, optionally, on points inserted between neighbours
+where a metric stops growing with the load (the number of bids per auction), to locate where it saturates.
+Results are printed as a table and saved as CSV (one row per point) and JSON (series of metrics vs. load per
+execution mode, ready to be plotted).
+
+    sweep = Sweep(grid(buyers=parse_range('1-32:x2'), buyer_igs=[1], auctions=[2],
+                       execution_modes=['compatibility']), measure=self.measureWorklets)
+    sweep.run(refine_metric='concurrency', max_refinements=3)
+    logger.info(f"sweep:\n{sweep.table()}")
+"""
+import csv
+import itertools
+import json
+import logging
+from dataclasses import asdict, dataclass, field, fields
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__file__)
+
+# neighbours whose metric grows by less than this fraction of the proportional growth (with the load) are refined
+DEFAULT_SATURATION_RATIO = 0.5
+REFINED_AXES = ('buyers', 'buyer_igs')
+
+
+@dataclass(frozen=True, order=True)
+class SweepPoint:
+    execution_mode: str
+    buyers: int
+    buyer_igs: int
+    auctions: int
+
+    @property
+    def load(self) -> int:
+        """Bids (generateBid calls) per auction."""
+        return self.buyers * self.buyer_igs
+
+    @property
+    def label(self) -> str:
+        return f'{self.buyers}_buyers_{self.buyer_igs}_ig_{self.auctions}_auctions_{self.execution_mode}'
+
+
+@dataclass
+class SweepResult:
+    point: SweepPoint
+    metrics: Dict[str, float] = field(default_factory=dict)
+    refined: bool = False  # added by refinement rather than being on the grid
+
+
+def parse_range(value: str) -> List[int]:
+    """
+    Comma-separated values or ranges: `5,16,32`, `1-8` (every integer), `1-32:4` (step 4) or `1-32:x2`
+    (doubling).
+    """
+    result = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        bounds, _, step = part.partition(':')
+        first, _, last = bounds.partition('-')
+        first, last = int(first), int(last or first)
+        if step.startswith('x'):
+            factor = int(step[1:])
+            assert factor > 1, f"range factor must be greater than 1: {part}"
+            while first <= last:
+                result.append(first)
+                first *= factor
+        else:
+            result.extend(range(first, last + 1, int(step or 1)))
+    return sorted(set(result))
+
+
+def grid(buyers: Iterable[int], buyer_igs: Iterable[int], auctions: Iterable[int],
+         execution_modes: Iterable[str]) -> List[SweepPoint]:
+    return [SweepPoint(execution_mode, b, igs, a)
+            for execution_mode, b, igs, a in itertools.product(execution_modes, buyers, buyer_igs, auctions)]
+
+
+def saturated(lower: SweepResult, upper: SweepResult, metric, saturation_ratio=DEFAULT_SATURATION_RATIO) -> bool:
+    """Whether `metric` grows from `lower` to `upper` by less than `saturation_ratio` of the growth of the load."""
+    low, high = lower.metrics.get(metric), upper.metrics.get(metric)
+    if low is None or high is None or upper.point.load <= lower.point.load:
+        return False
+    proportional_growth = low * (upper.point.load / lower.point.load - 1)
+    return high - low < saturation_ratio * proportional_growth
+
+
+def refinement_points(results: Sequence[SweepResult], metric,
+                      saturation_ratio=DEFAULT_SATURATION_RATIO) -> List[SweepPoint]:
+    """
+    Midpoints (along buyers or interest groups per buyer, other parameters being fixed) between the neighbouring
+    measured points where `metric` starts to saturate, i.e. of the first saturated interval of every series,
+    unless the neighbours are adjacent already. Intervals beyond it are flat and are not refined.
+    """
+    measured = {result.point for result in results}
+    new_points = set()
+    for axis in REFINED_AXES:
+        series: Dict[tuple, List[SweepResult]] = {}
+        for result in results:
+            key = tuple(getattr(result.point, f.name) for f in fields(SweepPoint) if f.name != axis)
+            series.setdefault(key, []).append(result)
+        for same_series in series.values():
+            same_series.sort(key=lambda result: getattr(result.point, axis))
+            for lower, upper in zip(same_series, same_series[1:]):
+                if not saturated(lower, upper, metric, saturation_ratio):
+                    continue
+                low, high = getattr(lower.point, axis), getattr(upper.point, axis)
+                point = SweepPoint(**dict(asdict(lower.point), **{axis: (low + high) // 2}))
+                if high - low >= 2 and point not in measured:
+                    new_points.add(point)
+                break
+    return sorted(new_points)
+
+
+class Sweep:
+    """Measurements of a grid of points, with `measure(point)` returning a dict of metrics of a point."""
+
+    def __init__(self, points: Iterable[SweepPoint], measure: Callable[[SweepPoint], Dict[str, float]]):
+        self.points = list(points)
+        self.measure = measure
+        self.results: List[SweepResult] = []
+
+    def measure_point(self, point: SweepPoint, refined=False) -> SweepResult:
+        logger.info(f"sweep point {point.label}{' (refinement)' if refined else ''}")
+        result = SweepResult(point, dict(self.measure(point)), refined)
+        self.results.append(result)
+        return result
+
+    def run(self, refine_metric: Optional[str] = None, max_refinements=0,
+            saturation_ratio=DEFAULT_SATURATION_RATIO) -> List[SweepResult]:
+        """
+        Measures all points of the grid, then up to `max_refinements` rounds of points found by
+        `refinement_points` for `refine_metric`. Returns results sorted by point.
+        """
+        for point in self.points:
+            self.measure_point(point)
+        for _ in range(max_refinements if refine_metric else 0):
+            new_points = refinement_points(self.results, refine_metric, saturation_ratio)
+            if not new_points:
+                break
+            for point in new_points:
+                self.measure_point(point, refined=True)
+        self.results.sort(key=lambda result: result.point)
+        return self.results
+
+    def metric_names(self) -> List[str]:
+        return list(dict.fromkeys(name for result in self.results for name in result.metrics))
+
+    def rows(self) -> List[Dict[str, object]]:
+        return [dict(asdict(result.point), load=result.point.load, refined=result.refined, **result.metrics)
+                for result in self.results]
+
+    def table(self) -> str:
+        columns = ['execution_mode', 'buyers', 'buyer_igs', 'auctions', 'load'] + self.metric_names()
+        rows = [[format_value(row.get(column)) + ('*' if column == 'load' and row['refined'] else '')
+                 for column in columns] for row in self.rows()]
+        widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+        lines = ['  '.join(column.rjust(width) for column, width in zip(columns, widths))]
+        lines.extend('  '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+        if any(result.refined for result in self.results):
+            lines.append('* added by refinement')
+        return '\n'.join(lines)
+
+    def series(self) -> Dict[str, Dict[str, List]]:
+        """Metrics vs. load per execution mode (points of equal load being averaged), for plotting."""
+        by_mode: Dict[str, Dict[int, List[SweepResult]]] = {}
+        for result in self.results:
+            by_mode.setdefault(result.point.execution_mode, {}).setdefault(result.point.load, []).append(result)
+        series = {}
+        for execution_mode, by_load in by_mode.items():
+            loads = sorted(by_load)
+            series[execution_mode] = dict(load=loads, **{
+                name: [mean([result.metrics.get(name) for result in by_load[load]]) for load in loads]
+                for name in self.metric_names()})
+        return series
+
+    def to_csv(self, path):
+        columns = [f.name for f in fields(SweepPoint)] + ['load', 'refined'] + self.metric_names()
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(dict(points=self.rows(), series=self.series()), f, indent=2)
+
+
+def mean(values: Iterable[Optional[float]]) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+def format_value(value) -> str:
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.2f}'
+    return str(value)
@@ -0,0 +1,179 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Trace events collected straight from the browser over the DevTools protocol: tracing is started with
+`transferMode: ReturnAsStream`, so the browser buffers the trace itself and hands it over as a stream which is
+read in chunks (`IO.read`) and parsed incrementally, one event at a time.
+
+    collector = TraceCollector(driver, categories=['fledge'])
+    collector.start()
+    ...
+    for event in collector.collect():
+        ...
+"""
+import itertools
+import json
+import logging
+import re
+import urllib.request
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import websocket
+
+logger = logging.getLogger(__file__)
+
+READ_CHUNK_SIZE = 1 << 20
+TRACE_EVENTS = re.compile(r'"traceEvents"\s*:\s*\[')
+SEPARATORS = ' \t\r\n,'
+
+
+class CdpError(Exception):
+    pass
+
+
+class CdpConnection:
+    """A synchronous DevTools protocol client; events received while waiting for a response are queued."""
+
+    def __init__(self, ws_url, timeout=30):
+        # no Origin header is sent, so the browser does not have to be launched with --remote-allow-origins
+        self.ws = websocket.create_connection(ws_url, timeout=timeout, suppress_origin=True)
+        self.ids = itertools.count(1)
+        self.events: deque = deque()
+
+    @classmethod
+    def for_browser(cls, driver, timeout=30) -> 'CdpConnection':
+        """A connection to the browser target of a chromedriver session."""
+        debugger_address = driver.capabilities['goog:chromeOptions']['debuggerAddress']
+        with urllib.request.urlopen(f'http://{debugger_address}/json/version', timeout=timeout) as response:
+            return cls(json.load(response)['webSocketDebuggerUrl'], timeout)
+
+    def send(self, method, **params) -> Dict[str, Any]:
+        message_id = next(self.ids)
+        self.ws.send(json.dumps(dict(id=message_id, method=method, params=params)))
+        while True:
+            message = json.loads(self.ws.recv())
+            if message.get('id') == message_id:
+                if 'error' in message:
+                    raise CdpError(f"{method}: {message['error']}")
+                return message.get('result', {})
+            if 'method' in message:
+                self.events.append(message)
+
+    def wait_for_event(self, method) -> Dict[str, Any]:
+        for message in list(self.events):
+            if message['method'] == method:
+                self.events.remove(message)
+                return message['params']
+        while True:
+            message = json.loads(self.ws.recv())
+            if message.get('method') == method:
+                return message['params']
+            if 'method' in message:
+                self.events.append(message)
+
+    def close(self):
+        self.ws.close()
+
+
+def iter_json_array_items(chunks: Iterable[str], array_start=TRACE_EVENTS) -> Iterator[Any]:
+    """
+    Incrementally parses the items of a JSON array (by default `traceEvents` of a JSON trace) out of text
+    coming in chunks; only the item being parsed is kept in memory, never the whole document.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = None
+    for chunk in itertools.chain(chunks, [None]):
+        eof = chunk is None
+        buffer += chunk or ''
+        if position is None:
+            match = array_start.search(buffer)
+            if match is None:
+                if eof:
+                    return
+                continue
+            position = match.end()
+        while True:
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                position += 1
+            if position == len(buffer) or buffer[position] == ']':
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break  # incomplete item, wait for the next chunk
+            yield item
+            position = end
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        buffer = buffer[position:]
+        position = 0
+
+
+class TraceCollector:
+    """
+    Records trace events of given categories in a browser. Events are filtered by category both by the browser
+    (only these categories are recorded) and when parsed (trace metadata is dropped).
+    """
+
+    def __init__(self, driver, categories: List[str] = ('fledge',)):
+        self.driver = driver
+        self.categories = set(categories)
+        self.connection: Optional[CdpConnection] = None
+        self.tracing = False
+
+    def start(self):
+        if self.connection is None:
+            self.connection = CdpConnection.for_browser(self.driver)
+        self.connection.send('Tracing.start', transferMode='ReturnAsStream', streamFormat='json',
+                             traceConfig=dict(recordMode='recordAsMuchAsPossible',
+                                              includedCategories=sorted(self.categories)))
+        self.tracing = True
+
+    def stop(self) -> str:
+        """Stops tracing; returns a handle to the stream of recorded data."""
+        self.connection.send('Tracing.end')
+        self.tracing = False
+        return self.connection.wait_for_event('Tracing.tracingComplete')['stream']
+
+    def read_stream(self, handle) -> Iterator[str]:
+        try:
+            while True:
+                result = self.connection.send('IO.read', handle=handle, size=READ_CHUNK_SIZE)
+                if result.get('base64Encoded'):
+                    raise CdpError("unexpected binary trace stream")
+                yield result.get('data', '')
+                if result.get('eof'):
+                    return
+        finally:
+            self.connection.send('IO.close', handle=handle)
+
+    def collect(self, restart=True) -> Iterator[Dict[str, Any]]:
+        """
+        Events recorded since tracing was (re)started, yielded as they are read. The DevTools protocol cannot
+        flush a running trace, so tracing is stopped and (unless `restart` is false) restarted right away, before
+        the recorded stream is read: events emitted between `Tracing.end` and `Tracing.start` (about one round
+        trip to the browser) are lost, so collect at points where nothing of interest is going on.
+        """
+        handle = self.stop()
+        if restart:
+            self.start()
+        return self.filter_events(handle)
+
+    def filter_events(self, handle) -> Iterator[Dict[str, Any]]:
+        for event in iter_json_array_items(self.read_stream(handle)):
+            if not self.categories.isdisjoint(event.get('cat', '').split(',')):
+                yield event
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            if self.tracing:
+                self.connection.send('IO.close', handle=self.stop())
+        finally:
+            self.connection.close()
+            self.connection = None
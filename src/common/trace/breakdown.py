@@ -0,0 +1,214 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Breaks auctions down into stages (script and signals fetches, worklet start, generateBid, scoreAd, reporting)
+from FLEDGE trace events, per buyer and per interest group, so that a regressed stage can be spotted when
+comparing browser builds.
+
+    breakdown = AuctionBreakdown.from_events(self.extract_fledge_trace_events())
+    breakdown.to_csv('breakdown.csv')
+    logger.info(f"auction breakdown: {pretty_json(breakdown.summary())}")
+
+Trace event names differ between browser versions, so stages are defined by regular expressions matched
+against them (see `DEFAULT_STAGES`), which can be overridden. A saved trace can be analysed offline:
+
+    python3 -m common.trace.breakdown trace.json --csv breakdown.csv [--stages stages.json]
+"""
+import csv
+import json
+import re
+import statistics
+import sys
+from argparse import ArgumentParser
+from collections import deque
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Deque, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from .store import async_id
+
+AUCTION = 'auction'
+# stage => regular expression (fully) matching names of async events belonging to the stage
+DEFAULT_STAGES = {
+    'script_fetch': r'.*(script|wasm).*(fetch|download|load).*|.*(fetch|download|load).*(script|wasm).*',
+    'signals_fetch': r'.*signals.*',
+    'worklet_start': r'.*(create|start).*worklet.*|.*worklet.*(create|start).*|wait_.*deps',
+    'bidder_worklet': r'bidder_worklet_generate_bid',
+    'generate_bid': r'generate_bid',
+    'seller_worklet': r'seller_worklet_score_ad',
+    'score_ad': r'score_ad',
+    'report_win': r'(bidder_worklet_)?report_win',
+    'report_result': r'(seller_worklet_)?report_result',
+}
+URL_ARGS = ('bidding_url', 'bidding_logic_url', 'interest_group_owner', 'owner', 'bidder', 'buyer')
+INTEREST_GROUP_ARGS = ('interest_group_name', 'interest_group', 'name')
+
+
+@dataclass
+class Span:
+    name: str
+    id: str
+    start: float  # microseconds
+    end: float
+    args: Dict[str, Any]
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class StageTiming:
+    auction: int
+    stage: str
+    event: str
+    buyer: Optional[str]
+    interest_group: Optional[str]
+    start_ms: float  # since the auction started
+    duration_ms: float
+
+
+def async_spans(events: Iterable[Dict[str, Any]]) -> List[Span]:
+    """
+    Pairs begin and end events (by name and id) into spans, in order of their start. Like
+    `TraceStore.durations`, an end closes the earliest open span of its name and id (first in, first out).
+    """
+    open_spans: Dict[tuple, Deque[Span]] = {}
+    spans = []
+    for event in sorted(events, key=lambda event: event['ts']):
+        key = (event['name'], async_id(event))
+        if event['ph'] == 'b':
+            span = Span(event['name'], key[1], event['ts'], event['ts'], dict(event.get('args') or {}))
+            open_spans.setdefault(key, deque()).append(span)
+            spans.append(span)
+        elif event['ph'] == 'e' and open_spans.get(key):
+            span = open_spans[key].popleft()
+            span.end = event['ts']
+            span.args.update(event.get('args') or {})
+    return spans
+
+
+def origin(value) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    scheme, netloc = urlsplit(value)[:2]
+    return f'{scheme}://{netloc}' if scheme and netloc else None
+
+
+class AuctionBreakdown:
+    def __init__(self, timings: List[StageTiming]):
+        self.timings = timings
+
+    @classmethod
+    def from_events(cls, events: Iterable[Dict[str, Any]], stages: Dict[str, str] = None) -> 'AuctionBreakdown':
+        """
+        Assigns spans to auctions (the latest `auction` span started before them) and to stages; spans of
+        other events, and ones started before the first auction, are skipped (ValueError is raised if there
+        are no `auction` spans at all). Buyer and interest group of a span are taken from arguments of any span
+        sharing its async id (e.g. `generate_bid` runs under the id of its `bidder_worklet_generate_bid`).
+        """
+        patterns = {stage: re.compile(pattern) for stage, pattern in (stages or DEFAULT_STAGES).items()}
+        spans = async_spans(events)
+        args_by_id: Dict[str, Dict[str, Any]] = {}
+        for span in spans:
+            args_by_id.setdefault(span.id, {}).update(span.args)
+
+        timings = []
+        auction_starts = []
+        stage_spans_without_auction = 0
+        for span in spans:
+            if span.name == AUCTION:
+                auction_starts.append(span.start)
+                continue
+            stage = next((stage for stage, pattern in patterns.items() if pattern.fullmatch(span.name)), None)
+            if stage is not None and not auction_starts:
+                stage_spans_without_auction += 1
+            if stage is None or not auction_starts:
+                continue
+            args = args_by_id.get(span.id, {})
+            timings.append(StageTiming(
+                auction=len(auction_starts) - 1,
+                stage=stage,
+                event=span.name,
+                buyer=next(filter(None, (origin(args.get(key)) for key in URL_ARGS)), None),
+                interest_group=next((str(args[key]) for key in INTEREST_GROUP_ARGS if key in args), None),
+                start_ms=(span.start - auction_starts[-1]) / 1000,
+                duration_ms=span.duration / 1000))
+        if stage_spans_without_auction and not auction_starts:
+            raise ValueError(f"{stage_spans_without_auction} stage spans but no '{AUCTION}' events in the trace, "
+                             f"so auctions cannot be broken down (does this browser build record them?)")
+        return cls(timings)
+
+    def stage_spans(self, auction: int) -> Dict[str, float]:
+        """
+        Wall-clock time (ms) each stage of an auction took: from its first span's start to its last span's end,
+        i.e. including the time parallel buyers / interest groups waited for each other.
+        """
+        auction_timings = [timing for timing in self.timings if timing.auction == auction]
+        if not auction_timings:
+            raise ValueError(f"no stages of auction {auction} (auctions: {sorted(self.auctions())})")
+        result = {}
+        for stage in dict.fromkeys(timing.stage for timing in auction_timings):
+            stage_timings = [timing for timing in auction_timings if timing.stage == stage]
+            result[stage] = (max(timing.start_ms + timing.duration_ms for timing in stage_timings) -
+                             min(timing.start_ms for timing in stage_timings))
+        return result
+
+    def auctions(self) -> List[int]:
+        return sorted({timing.auction for timing in self.timings})
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Duration statistics (ms) by stage and buyer."""
+        durations: Dict[str, Dict[str, List[float]]] = {}
+        for timing in self.timings:
+            durations.setdefault(timing.stage, {}).setdefault(timing.buyer or '-', []).append(timing.duration_ms)
+        return {stage: {buyer: dict(count=len(values), mean=statistics.mean(values),
+                                    median=statistics.median(values), max=max(values))
+                        for buyer, values in by_buyer.items()}
+                for stage, by_buyer in durations.items()}
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(dict(
+                timings=[asdict(timing) for timing in self.timings],
+                stage_spans=[dict(auction=auction, stages=self.stage_spans(auction)) for auction in self.auctions()],
+                summary=self.summary(),
+            ), f, indent=2)
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=[field.name for field in fields(StageTiming)])
+            writer.writeheader()
+            writer.writerows(asdict(timing) for timing in self.timings)
+
+
+def load_trace(path) -> List[Dict[str, Any]]:
+    """Trace events saved as a JSON array or as a JSON trace (`{"traceEvents": [...]}`)."""
+    with open(path) as f:
+        trace = json.load(f)
+    return trace['traceEvents'] if isinstance(trace, dict) else trace
+
+
+def main():
+    argument_parser = ArgumentParser(description="Auction latency breakdown from FLEDGE trace events.")
+    argument_parser.add_argument('trace')
+    argument_parser.add_argument('--stages', help="JSON file mapping stages to event name regular expressions")
+    argument_parser.add_argument('--csv', help="save timings of all stages as CSV")
+    argument_parser.add_argument('--json', help="save timings, stage spans and summary as JSON")
+    arguments = argument_parser.parse_args()
+
+    stages = None
+    if arguments.stages:
+        with open(arguments.stages) as f:
+            stages = json.load(f)
+    breakdown = AuctionBreakdown.from_events(load_trace(arguments.trace), stages)
+    if arguments.csv:
+        breakdown.to_csv(arguments.csv)
+    if arguments.json:
+        breakdown.to_json(arguments.json)
+    json.dump(breakdown.summary(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Columnar store of trace events (NumPy arrays of timestamps, phases, name ids and async ids) with vectorized
+analyses of async (`b` / `e`) events: concurrency curves, max / mean concurrency and durations.
+
+    store = TraceStore.from_events(self.extract_fledge_trace_events())
+    generate_bid = store.select('generate_bid')
+    logger.info(f"generate_bid: max concurrency {generate_bid.max_concurrency()}, "
+                f"durations: {percentiles(generate_bid.durations() / 1000)} ms")
+"""
+import json
+import logging
+import re
+from collections import defaultdict, deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__file__)
+
+BEGIN = 'b'
+END = 'e'
+
+
+@lru_cache(maxsize=256)
+def compile_name_pattern(name_pattern) -> re.Pattern:
+    return re.compile(name_pattern, re.ASCII | re.IGNORECASE)
+
+
+def async_id(event: Dict[str, Any]) -> str:
+    if 'id' in event:
+        return str(event['id'])
+    if 'id2' in event:
+        return json.dumps(event['id2'], sort_keys=True)
+    return ''
+
+
+class TraceStore:
+    """
+    Trace events as parallel arrays, sorted by timestamp (events with equal timestamps keep their order).
+    Names and async ids are interned: `names[name_ids[i]]` is the name of the i-th event.
+    """
+
+    def __init__(self, ts: np.ndarray, ph: np.ndarray, name_ids: np.ndarray, ids: np.ndarray, names: List[str]):
+        self.ts = ts
+        self.ph = ph
+        self.name_ids = name_ids
+        self.ids = ids
+        self.names = names
+
+    @classmethod
+    def from_events(cls, events: Iterable[Dict[str, Any]]) -> 'TraceStore':
+        name_index: Dict[str, int] = {}
+        id_index: Dict[str, int] = {}
+        ts, ph, name_ids, ids = [], [], [], []
+        for event in events:
+            ts.append(event['ts'])
+            ph.append(event['ph'])
+            name_ids.append(name_index.setdefault(event['name'], len(name_index)))
+            ids.append(id_index.setdefault(async_id(event), len(id_index)))
+        order = np.argsort(np.asarray(ts, dtype=np.float64), kind='stable')
+        return cls(ts=np.asarray(ts, dtype=np.float64)[order],
+                   ph=np.asarray(ph, dtype='<U1')[order],
+                   name_ids=np.asarray(name_ids, dtype=np.int32)[order],
+                   ids=np.asarray(ids, dtype=np.int64)[order],
+                   names=list(name_index))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def take(self, mask: np.ndarray) -> 'TraceStore':
+        return TraceStore(self.ts[mask], self.ph[mask], self.name_ids[mask], self.ids[mask], self.names)
+
+    def select(self, name_pattern) -> 'TraceStore':
+        """Events whose names match (from the start, case-insensitively) given regular expression."""
+        pattern = compile_name_pattern(name_pattern)
+        matching_name_ids = [name_id for name_id, name in enumerate(self.names) if pattern.match(name)]
+        return self.take(np.isin(self.name_ids, matching_name_ids))
+
+    def count(self, phase) -> int:
+        return int(np.count_nonzero(self.ph == phase))
+
+    def concurrency_curve(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Number of async events in progress after each begin / end event, with timestamps of these events."""
+        steps = (self.ph == BEGIN).astype(np.int64) - (self.ph == END).astype(np.int64)
+        mask = steps != 0
+        return self.ts[mask], np.cumsum(steps[mask])
+
+    def max_concurrency(self) -> int:
+        _, levels = self.concurrency_curve()
+        return int(levels.max(initial=0))
+
+    def mean_concurrency(self) -> float:
+        """Time-weighted mean number of async events in progress, from the first begin to the last end."""
+        times, levels = self.concurrency_curve()
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return float(np.sum(levels[:-1] * np.diff(times)) / (times[-1] - times[0]))
+
+    def durations(self) -> np.ndarray:
+        """
+        Durations (in microseconds) of async events, begin and end events being matched by name and id. Events
+        without a counterpart (e.g. of events cut in half by the start or the end of tracing) are dropped.
+        """
+        begins = self.take(self.ph == BEGIN)
+        ends = self.take(self.ph == END)
+        begin_keys = begins.name_ids.astype(np.int64) << 32 | begins.ids
+        end_keys = ends.name_ids.astype(np.int64) << 32 | ends.ids
+        # stable sorts keep the time order within a key, so the n-th begin of a key pairs with its n-th end
+        begin_order = np.argsort(begin_keys, kind='stable')
+        end_order = np.argsort(end_keys, kind='stable')
+        if np.array_equal(begin_keys[begin_order], end_keys[end_order]):
+            durations = ends.ts[end_order] - begins.ts[begin_order]
+            if np.all(durations >= 0):
+                return durations
+        return self.matched_durations(begin_keys, end_keys)
+
+    def matched_durations(self, begin_keys: np.ndarray, end_keys: np.ndarray) -> np.ndarray:
+        """`durations` of a trace with unmatched events: every end is matched with the earliest open begin."""
+        keys = np.empty(len(self), dtype=np.int64)
+        keys[self.ph == BEGIN] = begin_keys
+        keys[self.ph == END] = end_keys
+        open_begins: Dict[int, deque] = defaultdict(deque)
+        durations = []
+        unmatched_ends = 0
+        for key, phase, ts in zip(keys.tolist(), self.ph.tolist(), self.ts.tolist()):
+            if phase == BEGIN:
+                open_begins[key].append(ts)
+            elif phase == END:
+                if open_begins[key]:
+                    durations.append(ts - open_begins[key].popleft())
+                else:
+                    unmatched_ends += 1
+        unmatched_begins = sum(len(begins) for begins in open_begins.values())
+        if unmatched_begins or unmatched_ends:
+            logger.warning(f"dropped {unmatched_begins} begin and {unmatched_ends} end events without a counterpart")
+        return np.asarray(durations, dtype=np.float64)
+
+    def durations_by_name(self) -> Dict[str, np.ndarray]:
+        return {self.names[name_id]: self.take(self.name_ids == name_id).durations()
+                for name_id in np.unique(self.name_ids)}
+
+
+def percentiles(values: np.ndarray, ps: Sequence[float] = (50, 90, 99)) -> Dict[str, float]:
+    if len(values) == 0:
+        return {}
+    return {f'p{p:g}': float(value) for p, value in zip(ps, np.percentile(values, ps))}
@@ -3,19 +3,27 @@
 
 import json
 import logging
+import math
 import os
 import statistics
-import threading
-import time
 from collections import defaultdict
+from dataclasses import dataclass, replace
 from datetime import datetime
 from functools import wraps
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
 
 from common.base_test import CHROMEDRIVER_LOG_PATH
+from common.results import save_results, save_series
+from common.utils.logtail import LogLines, RtbDebugMetrics, TrackFile
+from common.utils.processes import ProcessSampler
 
 logger = logging.getLogger(__file__)
 
+PROCESS_SAMPLING_INTERVAL = float(os.environ.get('PROCESS_SAMPLING_INTERVAL', '0.25'))
+PROCESS_SAMPLING_PSS = os.environ.get('PROCESS_SAMPLING_PSS', '0').lower() not in ['0', 'false']
+
 
 class MeasureDuration:
     def __init__(self, method_name):
@@ -35,34 +43,72 @@ class MeasureDuration:
         return self.finish - self.start
 
 
-class TrackFile:
-    def __init__(self, path):
-        self.stop = False
-        self.path = path
-        self.thread = threading.Thread(target=self.track)
-
-    def __enter__(self):
-        self.thread.start()
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.stop = True
-        self.thread.join()
-
-    def track(self):
-        with open(self.path) as f:
-            while not self.stop:
-                line = f.readline()
-                if not line:
-                    time.sleep(0.1)
-                elif '[rtb-chromium-debug]' in line:
-                    logger.info(line.rstrip())
-            # reading rest of the file after stop
-            for line in f.readlines():
-                if '[rtb-chromium-debug]' in line:
-                    logger.info(line.rstrip())
+def relative_ci_width(values, mode, z=1.96) -> float:
+    """
+    Width of the ~95% confidence interval of the average relative to the average: for the median the
+    distribution-free interval between order statistics, for the mean the normal one.
+    """
+    n = len(values)
+    if n < 2:
+        return math.inf
+    if mode == AverageBenchmarks.MEDIAN:
+        # the interval between the r-th and s-th smallest values (1-based), r = floor(n/2 - z*sqrt(n)/2) and
+        # s = ceil(1 + n/2 + z*sqrt(n)/2); ranks are 0-based below
+        ordered = sorted(values)
+        lower = max(0, math.floor(n / 2 - z * math.sqrt(n) / 2) - 1)
+        upper = min(n - 1, math.ceil(n / 2 + z * math.sqrt(n) / 2))
+        width, average = ordered[upper] - ordered[lower], statistics.median(values)
+    else:
+        width, average = 2 * z * statistics.stdev(values) / math.sqrt(n), statistics.mean(values)
+    return width / abs(average) if average else math.inf
+
+
+def outliers(values, threshold=3.0) -> List[float]:
+    """Values further than `threshold` scaled MADs (i.e. ~standard deviations) from the median."""
+    median = statistics.median(values)
+    mad = statistics.median(abs(value - median) for value in values) * 1.4826
+    if not mad:
+        return []
+    return [value for value in values if abs(value - median) > threshold * mad]
+
+
+@dataclass
+class BenchmarkSettings:
+    """
+    How `AverageBenchmarks` repeats a benchmark: after `warmups` discarded runs, at least `min_times` and at most
+    `max_times` (`min_times` by default) times, stopping as soon as the confidence intervals of all averaged
+    metrics are narrower than `target_ci` (relative to the average), if given.
+    """
+    warmups: int = 0
+    min_times: int = 1
+    max_times: Optional[int] = None
+    target_ci: Optional[float] = None
+    reject_outliers: bool = False
+    mode: str = 'median'
+
+    def __post_init__(self):
+        self.max_times = max(self.max_times or self.min_times, self.min_times)
+
+    @classmethod
+    def from_env(cls) -> 'BenchmarkSettings':
+        """Settings given by `AVERAGE_BENCHMARKS_*` environment variables (see `average_benchmarks`)."""
+        times = int(os.environ.get('AVERAGE_BENCHMARKS_TIMES', '1'))
+        min_times = int(os.environ.get('AVERAGE_BENCHMARKS_MIN_TIMES', times))
+        target_ci = os.environ.get('AVERAGE_BENCHMARKS_TARGET_CI')
+        return cls(
+            warmups=int(os.environ.get('AVERAGE_BENCHMARKS_WARMUPS', '0')),
+            min_times=min_times,
+            max_times=int(os.environ.get('AVERAGE_BENCHMARKS_MAX_TIMES', max(times, min_times))),
+            target_ci=float(target_ci) if target_ci else None,
+            reject_outliers=os.environ.get('AVERAGE_BENCHMARKS_REJECT_OUTLIERS', '0').lower() not in ['0', 'false'])
 
 
 class AverageBenchmarks:
+    """
+    Repeats a benchmark method (returning a dict of metrics), called with `args` and `kwargs`, as configured by
+    `settings`; averages and other statistics of all metrics are computed from the same samples (outliers
+    excluded, if they are rejected).
+    """
     MEAN = "mean"
     MEDIAN = "median"
     AVERAGE_FUN = {
@@ -70,32 +116,82 @@ class AverageBenchmarks:
         MEDIAN: statistics.median,
     }
 
-    def __init__(self, method, method_self, *args, **kwargs):
+    def __init__(self, method, method_self, args=(), kwargs: Dict[str, Any] = None,
+                 settings: BenchmarkSettings = None):
         self.method = method
         self.method_self = method_self
         self.args = args
-        self.kwargs = kwargs
+        self.kwargs = kwargs or {}
+        self.settings = settings or BenchmarkSettings()
         self.results = defaultdict(list)
 
-    def run(self, times: int):
-        for _ in range(times):
-            one_run_results = self.method(self.method_self, *self.args, **self.kwargs)
+    @property
+    def mode(self) -> str:
+        return self.settings.mode
+
+    def run_once(self):
+        return self.method(self.method_self, *self.args, **self.kwargs)
+
+    def run(self, times: int = None):
+        if times is not None:
+            self.settings = replace(self.settings, min_times=times, max_times=times)
+        for _ in range(self.settings.warmups):
+            self.run_once()
+        for iteration in range(1, self.settings.max_times + 1):
+            one_run_results = self.run_once()
             for k, f in one_run_results.items():
                 self.results[k].append(f)
-
-    def log_averaged_results(self, mode: str = MEDIAN):
-        avg_fun = AverageBenchmarks.AVERAGE_FUN[mode]
-        logger.info(f"{self.method.__name__} benchmarks ({mode})")
+            if iteration >= self.settings.min_times and self.converged():
+                logger.info(f"{self.method.__name__} benchmarks converged after {iteration} runs")
+                break
+
+    def converged(self) -> bool:
+        if not self.settings.target_ci:
+            return False
+        return all(relative_ci_width(self.averaged_values(lst), self.mode) <= self.settings.target_ci
+                   for lst in self.results.values())
+
+    def averaged_values(self, lst):
+        if not self.settings.reject_outliers:
+            return lst
+        rejected = outliers(lst)
+        return [value for value in lst if value not in rejected] or lst
+
+    def stats(self, lst) -> Dict[str, float]:
+        values = self.averaged_values(lst)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        median = statistics.median(values)
+        return dict(
+            average=AverageBenchmarks.AVERAGE_FUN[self.mode](values),
+            p50=float(p50), p90=float(p90), p99=float(p99),
+            stddev=statistics.stdev(values) if len(values) > 1 else 0.0,
+            mad=statistics.median(abs(value - median) for value in values),
+            outliers=len(outliers(lst)),
+            relative_ci=relative_ci_width(values, self.mode),
+            samples=len(lst),
+        )
+
+    def log_averaged_results(self, mode: str = None):
+        if mode:
+            self.settings = replace(self.settings, mode=mode)
+        logger.info(f"{self.method.__name__} benchmarks ({self.mode}"
+                    f"{', outliers rejected' if self.settings.reject_outliers else ''})")
         for k, lst in self.results.items():
-            av = avg_fun(lst)
-            logger.info(f"  - {k}: {av}      {lst}")
+            stats = self.stats(lst)
+            logger.info(f"  - {k}: {stats['average']}      {lst}")
+            logger.info(f"    p50: {stats['p50']:.3f}, p90: {stats['p90']:.3f}, p99: {stats['p99']:.3f}, "
+                        f"stddev: {stats['stddev']:.3f}, MAD: {stats['mad']:.3f}, outliers: {stats['outliers']}, "
+                        f"CI width: {stats['relative_ci']:.1%} of the {self.mode}")
+        save_results(self.method_self.id(), self.results, self.method_self.driver, self.method_self.browser_flags)
 
 
 def measure_time(method):
     @wraps(method)
     def inner_measure_time(self, *args, **kwargs):
         with MeasureDuration(f"{self.__class__.__name__}.{method.__name__,}") as m:
-            return method(self, *args, **kwargs)
+            result = method(self, *args, **kwargs)
+        save_results(self.id(), dict(test_duration_s=[m.duration().total_seconds()]), self.driver, self.browser_flags)
+        return result
 
     return inner_measure_time
 
@@ -115,14 +211,49 @@ def log_exception(method):
 
 
 def print_debug(method):
+    """
+    Logs `[rtb-chromium-debug]` lines written to chromedriver's log during the test. Durations they report are
+    left in `self.debug_metrics` and saved with benchmark results (as `rtb_debug.<what was measured>`).
+    """
     @wraps(method)
     def inner_print_debug(self, *args, **kwargs):
-        with TrackFile(CHROMEDRIVER_LOG_PATH):
-            return method(self, *args, **kwargs)
+        debug_metrics = RtbDebugMetrics()
+        # the log is appended to by every browser session, so only lines of this test are read
+        with TrackFile(CHROMEDRIVER_LOG_PATH, [LogLines(), debug_metrics], from_end=True):
+            result = method(self, *args, **kwargs)
+        self.debug_metrics = debug_metrics.metrics
+        save_results(self.id(), {f'rtb_debug.{name}': durations for name, durations in debug_metrics.by_name().items()},
+                     self.driver, self.browser_flags)
+        return result
 
     return inner_print_debug
 
 
+def sample_processes(method):
+    """
+    Samples CPU time, memory and threads of the browser's processes by type (browser, renderer, auction worklet...)
+    while the test runs. Samples are left in `self.process_samples`, a summary is logged and saved with benchmark
+    results (see `common.results`).
+    """
+    @wraps(method)
+    def inner_sample_processes(self, *args, **kwargs):
+        sampler = ProcessSampler(self.driver.service.process.pid, PROCESS_SAMPLING_INTERVAL, PROCESS_SAMPLING_PSS)
+        try:
+            with sampler:
+                return method(self, *args, **kwargs)
+        finally:
+            self.process_samples = sampler.samples
+            summary = sampler.summary()
+            logger.info(f"browser processes: {pretty_json(summary)}")
+            save_results(self.id(), {f'{key}.{type_name}': [value]
+                                     for type_name, type_summary in summary.items()
+                                     for key, value in type_summary.items()},
+                         self.driver, self.browser_flags)
+            save_series(self.id(), 'processes', sampler.samples)
+
+    return inner_sample_processes
+
+
 def pretty_json(data):
     return json.dumps(data, indent=2, sort_keys=True)
 
@@ -139,19 +270,28 @@ def extract_rtbh_test_stats(signals: Dict[str, Any]) -> Dict[str, float]:
 
         return results
     except KeyError:
-        # If we set AVERAGE_BENCHMARKS_TIMES we apparently wanted to get measurements,
-        # so without them we can't do anything reasonable and just raise an exception.
+        # If we set AVERAGE_BENCHMARKS_TIMES (or other AVERAGE_BENCHMARKS_* settings) we apparently wanted to get
+        # measurements, so without them we can't do anything reasonable and just raise an exception.
         # Otherwise, we don't care about the test statistcs and simply return an empty dictionary.
-        if 'AVERAGE_BENCHMARKS_TIMES' in os.environ:
+        if any(key.startswith('AVERAGE_BENCHMARKS_') for key in os.environ):
             raise RuntimeError("No test statistics in browser singals.")
         return {}
 
 
 def average_benchmarks(method):
+    """
+    Configured with environment variables:
+    * AVERAGE_BENCHMARKS_TIMES - number of runs (1 by default), or the default for both of:
+    * AVERAGE_BENCHMARKS_MIN_TIMES, AVERAGE_BENCHMARKS_MAX_TIMES - bounds on the number of runs (the maximum
+      being at least the minimum)
+    * AVERAGE_BENCHMARKS_TARGET_CI - stop once relative confidence intervals are this narrow (e.g. 0.05)
+    * AVERAGE_BENCHMARKS_WARMUPS - discarded runs before the measured ones
+    * AVERAGE_BENCHMARKS_REJECT_OUTLIERS - exclude outliers (beyond 3 scaled MADs) from averages
+    """
     @wraps(method)
     def inner_average_benchmarks(self, *args, **kwargs):
-        ab = AverageBenchmarks(method, self, *args, **kwargs)
-        ab.run(times=int(os.environ.get('AVERAGE_BENCHMARKS_TIMES', '1')))
+        ab = AverageBenchmarks(method, self, args, kwargs, BenchmarkSettings.from_env())
+        ab.run()
         ab.log_averaged_results()
 
     return inner_average_benchmarks
@@ -0,0 +1,231 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+"""
+Tails a growing log file (e.g. chromedriver's, with chrome logs enabled) in a background thread. The file is
+read in large blocks as soon as inotify reports it was written to (or every 100 ms, if inotify is unavailable),
+and lines are passed to handlers: only lines containing a handler's marker, found by a substring search in
+the whole block, are decoded.
+
+    debug_metrics = RtbDebugMetrics()
+    with TrackFile(CHROMEDRIVER_LOG_PATH, [LogLines(), debug_metrics], from_end=True):
+        ...
+    logger.info(debug_metrics.by_name())
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import re
+import select
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__file__)
+
+BLOCK_SIZE = 1 << 20
+POLLING_INTERVAL = 0.1
+RTB_DEBUG_MARKER = b'[rtb-chromium-debug]'
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+
+class PollingWatcher:
+    """Waits for a file to be written to by sleeping for a fixed interval."""
+
+    def __init__(self, path, interval=POLLING_INTERVAL):
+        self.interval = interval
+        self.woken = threading.Event()
+
+    def wait(self):
+        self.woken.wait(self.interval)
+
+    def wake(self):
+        self.woken.set()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Waits for a file to be written to with inotify. `timeout` bounds the wait anyway, in case the file is
+    replaced (then it is no longer watched).
+    """
+
+    def __init__(self, path, timeout=1.0):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.timeout = timeout
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), IN_MODIFY | IN_CLOSE_WRITE) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed: {path}")
+        # written to by wake(), so that wait() returns at once
+        self.wake_read, self.wake_write = os.pipe()
+
+    def wait(self):
+        readable, _, _ = select.select([self.fd, self.wake_read], [], [], self.timeout)
+        if self.fd in readable:
+            # events themselves do not matter, only that the file was written to
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def wake(self):
+        os.write(self.wake_write, b'\0')
+
+    def close(self):
+        for fd in (self.fd, self.wake_read, self.wake_write):
+            os.close(fd)
+
+
+def file_watcher(path):
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError) as e:
+        # no inotify (other systems than Linux, or the limit of instances reached)
+        logger.debug(f"inotify unavailable ({e!r}), polling {path}")
+        return PollingWatcher(path)
+
+
+class LineHandler:
+    """Gets lines (without line endings) containing `marker`; an empty marker matches every line."""
+    marker: bytes = b''
+
+    def handle(self, line: str):
+        raise NotImplementedError
+
+
+class LogLines(LineHandler):
+    def __init__(self, marker=RTB_DEBUG_MARKER):
+        self.marker = marker
+
+    def handle(self, line: str):
+        logger.info(line)
+
+
+@dataclass
+class DebugMetric:
+    name: str  # e.g. 'AuctionV8Helper::RunScript() generateBid call()'
+    duration_ms: float
+    url: Optional[str]  # e.g. of the script compiled
+    time: float  # when the line was read
+
+
+class RtbDebugMetrics(LineHandler):
+    """
+    Parses `[rtb-chromium-debug] <what> [<url>] duration: <value> <unit>` records (logged by RTB House's
+    chromium builds) into a stream of metrics named after what was measured, URLs excluded.
+    """
+    marker = RTB_DEBUG_MARKER
+    RECORD = re.compile(r'\[rtb-chromium-debug\]\s*(?P<what>.*?)\s+duration:\s*(?P<value>[\d.]+)\s*(?P<unit>ms|us|s)\b')
+    URL = re.compile(r'\s*\b[a-z]+://\S+')
+    UNITS_MS = {'s': 1000.0, 'ms': 1.0, 'us': 0.001}
+
+    def __init__(self, callback: Callable[[DebugMetric], None] = None):
+        self.callback = callback
+        self.metrics: List[DebugMetric] = []
+
+    def handle(self, line: str):
+        match = self.RECORD.search(line)
+        if not match:
+            return
+        url = self.URL.search(match['what'])
+        metric = DebugMetric(
+            name=' '.join(self.URL.sub('', match['what']).split()),
+            duration_ms=float(match['value']) * self.UNITS_MS[match['unit']],
+            url=url.group().strip() if url else None,
+            time=time.time())
+        self.metrics.append(metric)
+        if self.callback:
+            self.callback(metric)
+
+    def by_name(self) -> Dict[str, List[float]]:
+        durations: Dict[str, List[float]] = {}
+        for metric in self.metrics:
+            durations.setdefault(metric.name, []).append(metric.duration_ms)
+        return durations
+
+
+def dispatch(block: bytes, handlers: List[LineHandler]):
+    """Passes lines of a block of whole lines to handlers."""
+    for handler in handlers:
+        if not handler.marker:
+            for line in block.splitlines():
+                handler.handle(line.decode(errors='replace').rstrip())
+            continue
+        position = block.find(handler.marker)
+        while position != -1:
+            start = block.rfind(b'\n', 0, position) + 1
+            end = block.find(b'\n', position)
+            if end == -1:
+                end = len(block)
+            handler.handle(block[start:end].decode(errors='replace').rstrip())
+            position = block.find(handler.marker, end)
+
+
+class TrackFile:
+    """
+    Passes lines of a file to handlers (by default logs `[rtb-chromium-debug]` lines) while in context,
+    including lines written until the context is exited. The file is read from the start, or from its end
+    at the time the context is entered if `from_end`.
+    """
+
+    def __init__(self, path, handlers: List[LineHandler] = None, from_end=False):
+        self.path = path
+        self.handlers = handlers if handlers is not None else [LogLines()]
+        self.from_end = from_end
+        self.stop = False
+        self.file = None
+        self.watcher = None
+        self.thread = threading.Thread(target=self.track, daemon=True)
+
+    def __enter__(self):
+        self.file = open(self.path, 'rb')
+        if self.from_end:
+            self.file.seek(0, os.SEEK_END)
+        self.watcher = file_watcher(self.path)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop = True
+        self.watcher.wake()
+        self.thread.join()
+        self.watcher.close()
+        self.file.close()
+
+    def track(self):
+        pending = b''
+        while True:
+            stopping = self.stop
+            # reading the rest of the file after stop
+            pending = self.read_available(pending)
+            if stopping:
+                break
+            self.watcher.wait()
+        if pending:
+            dispatch(pending, self.handlers)
+
+    def read_available(self, pending: bytes) -> bytes:
+        """Reads the file up to its end, dispatching whole lines; returns the incomplete last line."""
+        if os.fstat(self.file.fileno()).st_size < self.file.tell():
+            # truncated
+            self.file.seek(0)
+        while True:
+            block = self.file.read(BLOCK_SIZE)
+            if not block:
+                return pending
+            block = pending + block
+            last_line_end = block.rfind(b'\n') + 1
+            dispatch(block[:last_line_end], self.handlers)
+            pending = block[last_line_end:]
@@ -0,0 +1,144 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+logger = logging.getLogger(__file__)
+
+BROWSER = 'browser'
+AUCTION_WORKLET = 'auction_worklet'
+AUCTION_WORKLET_SUB_TYPE = 'auction_worklet.mojom.AuctionWorkletService'
+
+
+def process_type(cmdline: List[str]) -> str:
+    """Chrome process type as given by its command line: browser, renderer, gpu-process, auction_worklet..."""
+    arguments = dict(argument[2:].split('=', 1) for argument in cmdline
+                     if argument.startswith('--') and '=' in argument)
+    if 'type' not in arguments:
+        return BROWSER
+    if arguments['type'] == 'utility':
+        sub_type = arguments.get('utility-sub-type', '')
+        return AUCTION_WORKLET if sub_type == AUCTION_WORKLET_SUB_TYPE else f'utility:{sub_type.split(".")[0]}'
+    return arguments['type']
+
+
+class ProcessSampler:
+    """
+    Samples CPU time, memory (RSS and, if `pss`, PSS) and thread counts of a browser's processes (descendants
+    of `root_pid`, e.g. chromedriver's) by process type, every `interval` seconds in a background thread.
+
+    CPU time of a process type is counted since sampling started and includes processes which have already exited.
+    """
+
+    def __init__(self, root_pid, interval=0.25, pss=False):
+        self.root = psutil.Process(root_pid)
+        self.interval = interval
+        self.pss = pss
+        self.processes: Dict[int, psutil.Process] = {}
+        self.types: Dict[int, str] = {}
+        self.cpu_times: Dict[int, float] = {}
+        self.cpu_baseline: Dict[int, float] = {}
+        # CPU time of processes whose pids were reused by other processes
+        self.replaced_cpu: Dict[str, float] = defaultdict(float)
+        self.samples: List[Dict[str, Any]] = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        for process in self.browser_processes():
+            try:
+                cpu_times = process.cpu_times()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            self.cpu_baseline[process.pid] = cpu_times.user + cpu_times.system
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def browser_processes(self) -> List[psutil.Process]:
+        try:
+            children = self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        processes = []
+        for child in children:
+            process = self.processes.get(child.pid)
+            if process is None or process.create_time() != child.create_time():
+                if process is not None:
+                    self.replace_process(child.pid)
+                process = self.processes[child.pid] = child
+            if child.pid not in self.types:
+                try:
+                    self.types[child.pid] = process_type(process.cmdline())
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            processes.append(process)
+        return processes
+
+    def replace_process(self, pid):
+        """Forgets an exited process whose pid is reused by another one, keeping its CPU time."""
+        logger.debug(f"pid {pid} reused")
+        type_name = self.types.pop(pid, None)
+        cpu_time = self.cpu_times.pop(pid, None)
+        baseline = self.cpu_baseline.pop(pid, 0.0)
+        if type_name is not None and cpu_time is not None:
+            self.replaced_cpu[type_name] += cpu_time - baseline
+
+    def sample(self):
+        by_type: Dict[str, Dict[str, float]] = defaultdict(lambda: dict(processes=0, rss=0, pss=0, threads=0))
+        for process in self.browser_processes():
+            try:
+                with process.oneshot():
+                    cpu_times = process.cpu_times()
+                    memory = process.memory_full_info() if self.pss else process.memory_info()
+                    threads = process.num_threads()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+            self.cpu_times[process.pid] = cpu_times.user + cpu_times.system
+            stats = by_type[self.types[process.pid]]
+            stats['processes'] += 1
+            stats['rss'] += memory.rss
+            stats['pss'] += getattr(memory, 'pss', 0)
+            stats['threads'] += threads
+        cpu_by_type: Dict[str, float] = defaultdict(float, self.replaced_cpu)
+        for pid, cpu_time in self.cpu_times.items():
+            cpu_by_type[self.types[pid]] += cpu_time - self.cpu_baseline.get(pid, 0.0)
+        for type_name, cpu_time in cpu_by_type.items():
+            by_type[type_name]['cpu'] = cpu_time
+        self.samples.append(dict(time=time.monotonic() - self.start, types=dict(by_type)))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Peaks (of memory in MiB, of process and thread counts) and total CPU time (s) by process type."""
+        summary: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: dict(max_processes=0, peak_rss_mb=0.0, peak_pss_mb=0.0, max_threads=0, cpu_s=0.0))
+        for sample in self.samples:
+            for type_name, stats in sample['types'].items():
+                type_summary = summary[type_name]
+                type_summary['max_processes'] = max(type_summary['max_processes'], stats['processes'])
+                type_summary['peak_rss_mb'] = max(type_summary['peak_rss_mb'], stats['rss'] / 2 ** 20)
+                type_summary['peak_pss_mb'] = max(type_summary['peak_pss_mb'], stats['pss'] / 2 ** 20)
+                type_summary['max_threads'] = max(type_summary['max_threads'], stats['threads'])
+                type_summary['cpu_s'] = max(type_summary['cpu_s'], stats.get('cpu', 0.0))
+        return dict(summary)
+
+    def peak_rss_per_process_mb(self, type_name) -> Optional[float]:
+        """Highest RSS of processes of a type divided by their number, e.g. memory cost of a worklet process."""
+        per_process = [sample['types'][type_name]['rss'] / sample['types'][type_name]['processes'] / 2 ** 20
+                       for sample in self.samples
+                       if sample['types'].get(type_name, {}).get('processes')]
+        return max(per_process, default=None)
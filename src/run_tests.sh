@@ -1,3 +1,8 @@
 #!/bin/bash
 
-python3 -m unittest $TEST --verbose
+if [[ "${JOBS:-1}" -gt 1 ]]; then
+  # TEST is either empty, "discover -s <dir>" or test names
+  python3 -m common.runner --jobs "$JOBS" ${TEST#discover}
+else
+  python3 -m unittest $TEST --verbose
+fi
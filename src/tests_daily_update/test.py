@@ -5,6 +5,7 @@ import logging
 import time
 
 from assertpy import assert_that
+from selenium.webdriver.common.by import By
 
 from common.base_test import BaseTest
 from common.mockserver import MockServer
@@ -17,6 +18,25 @@ logger = logging.getLogger(__file__)
 
 class DailyUpdateTest(BaseTest):
 
+    def runAuctionUntilAdWins(self, seller_server, ad_text, timeout=10, interval=0.5):
+        """
+        Reruns the auction until the ad containing `ad_text` wins, e.g. until a downloaded interest group update
+        has been parsed and stored by the browser (which happens after update.json was requested). Returns the
+        time the winning auction was started at.
+        """
+        deadline = time.time() + timeout
+        while True:
+            auction_time = time.time()
+            self.driver.get(seller_server.address)
+            self.findFrameAndSwitchToIt()
+            self.assertDriverContainsText('body', 'TC AD')
+            ad = self.driver.find_element(By.CSS_SELECTOR, 'body').text
+            if ad_text in ad:
+                return auction_time
+            assert_that(time.time(), description=f"'{ad_text}' won no auction in {timeout} seconds "
+                                                 f"(last winner: '{ad}')").is_less_than(deadline)
+            time.sleep(interval)
+
     @print_debug
     @measure_time
     @log_exception
@@ -32,22 +52,21 @@ class DailyUpdateTest(BaseTest):
             self.driver.get(seller_server.address)
             self.findFrameAndSwitchToIt()
             self.assertDriverContainsText('body', 'TC AD 1')
-            report_win_signals = buyer_server.get_last_request("/reportWin").get_first_json_param('signals')
+            report_win_signals = buyer_server.wait_for_request("/reportWin").get_first_json_param('signals')
             assert_that(report_win_signals.get('browserSignals').get('renderUrl')) \
-                .is_equal_to("https://localhost:8201/ad-1.html")
+                .is_equal_to(buyer_server.address + "/ad-1.html")
 
             # update interest group
             self.driver.get(buyer_server.address + "/do_update.html")
             self.assertDriverContainsText('body', 'updated interest group')
 
             # wait for the browser to download updates
-            time.sleep(5)
+            buyer_server.wait_for_request("/update.json")
 
             # run auction again to check if the update was successful
             # (note that now we expect a different ad to win)
-            self.driver.get(seller_server.address)
-            self.findFrameAndSwitchToIt()
-            self.assertDriverContainsText('body', 'TC AD 2')
-            report_win_signals = buyer_server.get_last_request("/reportWin").get_first_json_param('signals')
+            auction_time = self.runAuctionUntilAdWins(seller_server, 'TC AD 2')
+            report_win_signals = buyer_server.wait_for_request("/reportWin", since=auction_time) \
+                .get_first_json_param('signals')
             assert_that(report_win_signals.get('browserSignals').get('renderUrl')) \
-                .is_equal_to("https://localhost:8201/ad-2.html")
+                .is_equal_to(buyer_server.address + "/ad-2.html")
@@ -37,13 +37,13 @@ class FunctionalTest(BaseTest):
         report_result_signals = seller_server.get_last_request("/reportResult").get_first_json_param('signals')
         logger.info(f"reportResult() signals: {pretty_json(report_result_signals)}")
         assert_that(report_result_signals.get('browserSignals').get('interestGroupOwner'))\
-            .is_equal_to("https://localhost:8091")
+            .is_equal_to(buyer_server.address)
         assert_that(report_result_signals.get('browserSignals').get('renderUrl')) \
-            .is_equal_to("https://localhost:8091/ad-1.html")
+            .is_equal_to(buyer_server.address + "/ad-1.html")
 
         report_win_signals = buyer_server.get_last_request("/reportWin").get_first_json_param('signals')
         logger.info(f"reportWin() signals: {pretty_json(report_win_signals)}")
         assert_that(report_win_signals.get('browserSignals').get('interestGroupOwner')) \
-            .is_equal_to("https://localhost:8091")
+            .is_equal_to(buyer_server.address)
         assert_that(report_win_signals.get('browserSignals').get('renderUrl')) \
-            .is_equal_to("https://localhost:8091/ad-1.html")
+            .is_equal_to(buyer_server.address + "/ad-1.html")
@@ -3,13 +3,15 @@
 
 import logging
 import os
-import time
 import urllib.parse
 
 from assertpy import assert_that
 
 from common.base_test import BaseTest
+from common.mockserver import ASYNCIO_ENGINE
 from common.mockserver import MockServer
+from common.mockserver.shaping import Fixed
+from common.mockserver.shaping import NetworkShaper
 from common.utils import MeasureDuration
 from common.utils import log_exception
 from common.utils import measure_time
@@ -37,21 +39,16 @@ class PerBuyerCumulativeTimeoutsTest(BaseTest):
     def fetch_timeout_logs(self):
         return filter(lambda entry: entry['source']=='other' and "perBuyerCumulativeTimeout exceeded during bid generation" in entry['message'], self.extract_browser_log())
 
-    def serveRequest(self, request):
-        # If igslow's trusted_bidding_signals.json is requested, delay it.
-        # This may result in BrokenPipeError: [Errno 32] Broken pipe
-        if "/igslow/trusted_bidding_signals.json" == request.path:
-            logger.info(f"{request} => sleep 750 ms ...")
-            time.sleep(0.75)
-        elif "trusted_bidding_signals" in request.path:
-            logger.info(f"{request} => no sleep")
-        return None
+    def shaper(self):
+        # If igslow's trusted_bidding_signals.json is requested, delay it (the browser may give up on it
+        # and close the connection meanwhile).
+        return NetworkShaper().add("/igslow/trusted_bidding_signals.json", ttfb=Fixed(0.75))
 
     @print_debug
     @measure_time
     @log_exception
     def test__perbuyer_cumulative_timeouts_igslow(self):
-        with MockServer(port=8081, directory='resources/buyer', response_provider=self.serveRequest) as buyer_server,\
+        with MockServer(port=8081, directory='resources/buyer', shaper=self.shaper(), engine=ASYNCIO_ENGINE) as buyer_server,\
                 MockServer(port=8083, directory='resources/seller') as seller_server:
 
             self.joinAdInterestGroup(buyer_server, name='igslow', bid=100)
@@ -62,12 +59,8 @@ class PerBuyerCumulativeTimeoutsTest(BaseTest):
             # check browser logs
             assert_that(list(self.fetch_timeout_logs())).is_not_empty()
 
-            # wait for the (missing) reports
-            logger.info("sleep 1 sec ...")
-            time.sleep(1)
-
             # It looks we are not getting any reports:
-            assert_that(buyer_server.get_last_request("/reportWin")).is_none()
+            buyer_server.assert_no_request("/reportWin", within=1)
             assert_that(buyer_server.get_last_request("/debugReportWin")).is_none()
             assert_that(buyer_server.get_last_request("/debugReportLoss")).is_none()
 
@@ -75,7 +68,7 @@ class PerBuyerCumulativeTimeoutsTest(BaseTest):
     @measure_time
     @log_exception
     def test__perbuyer_cumulative_timeouts_twoigs(self):
-        with MockServer(port=8081, directory='resources/buyer', response_provider=self.serveRequest) as buyer_server, \
+        with MockServer(port=8081, directory='resources/buyer', shaper=self.shaper(), engine=ASYNCIO_ENGINE) as buyer_server, \
                 MockServer(port=8083, directory='resources/seller') as seller_server:
 
             self.joinAdInterestGroup(buyer_server, name='igslow', bid=100)
@@ -88,18 +81,14 @@ class PerBuyerCumulativeTimeoutsTest(BaseTest):
             assert_that(list(self.fetch_timeout_logs())).is_not_empty()
 
             # analyze reports
-            report_win_signals = buyer_server.get_last_request('/reportWin').get_first_json_param('signals')
+            report_win_signals = buyer_server.wait_for_request('/reportWin').get_first_json_param('signals')
             assert_that(report_win_signals.get('browserSignals').get('bid')).is_equal_to(50)
 
-            report_result_signals = seller_server.get_last_request('/reportResult').get_first_json_param('signals')
+            report_result_signals = seller_server.wait_for_request('/reportResult').get_first_json_param('signals')
             assert_that(report_result_signals.get('browserSignals').get('bid')).is_equal_to(50)
 
-            debug_win_signals = buyer_server.get_last_request("/debugReportWin").get_first_json_param('signals')
+            debug_win_signals = buyer_server.wait_for_request("/debugReportWin").get_first_json_param('signals')
             assert_that(debug_win_signals.get('interestGroup').get('name')).is_equal_to('igfast')
 
-            # wait for the final (missing) report
-            logger.info("sleep 1 sec ...")
-            time.sleep(1)
-
-            # it looks we're not getting this one
-            assert_that(buyer_server.get_last_request("/debugReportLoss")).is_none()
+            # it looks we're not getting the final report
+            buyer_server.assert_no_request("/debugReportLoss", within=1)
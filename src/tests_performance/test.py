@@ -10,6 +10,7 @@ from common.utils import log_exception
 from common.utils import measure_time
 from common.utils import pretty_json
 from common.utils import print_debug
+from common.utils import sample_processes
 from common.utils import average_benchmarks
 from common.utils import extract_rtbh_test_stats
 
@@ -21,6 +22,7 @@ class PerformanceTest(BaseTest):
     @print_debug
     @measure_time
     @log_exception
+    @sample_processes
     @average_benchmarks
     def test__check_nn_with_static_weights_computation_time(self):
         with MockServer(port=9011, directory='resources/buyer') as buyer_server,\
@@ -0,0 +1,9 @@
+function generateBid(interestGroup, auctionSignals, perBuyerSignals, trustedBiddingSignals, browserSignals) {
+  // every interest group bids the value of its own (single) trusted bidding signals key
+  const ad = interestGroup.ads[0];
+  const key = interestGroup.trustedBiddingSignalsKeys[0];
+  return {'ad': 'example', 'bid': trustedBiddingSignals[key], 'render': ad.renderUrl};
+}
+
+function reportWin(auctionSignals, perBuyerSignals, sellerSignals, browserSignals) {
+}
@@ -0,0 +1,6 @@
+function scoreAd(adMetadata, bid, auctionConfig, trustedScoringSignals, browserSignals) {
+  return bid;
+}
+
+function reportResult(auctionConfig, browserSignals) {
+}
@@ -2,11 +2,18 @@
 # Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
 
 import logging
+import statistics
 
 from assertpy import assert_that
 
+from common.auction_replay import AuctionReplay, auction_config, summary
 from common.base_test import BaseTest
+from common.interest_groups import InterestGroupSpec, clear_interest_groups, join_interest_groups
+from common.mockserver import ASYNCIO_ENGINE
 from common.mockserver import MockServer
+from common.mockserver.shaping import Fixed
+from common.mockserver.signals import KeyValueIndex, TrustedSignalsProvider
+from common.results import save_results
 from common.utils import MeasureDuration
 from common.utils import log_exception
 from common.utils import measure_time
@@ -15,9 +22,49 @@ from common.utils import print_debug
 
 logger = logging.getLogger(__file__)
 
+BATCHING_INTEREST_GROUPS = 20
+BATCHING_AUCTIONS = 20
+# latency of every trusted signals fetch (a batched one being as slow as its slowest key)
+SIGNALS_LATENCY = Fixed(0.05)
+
 
 class TrustedBiddingSignalsTest(BaseTest):
 
+    def runAuctionsWithSignals(self, batched, interest_groups=BATCHING_INTEREST_GROUPS, auctions=BATCHING_AUCTIONS):
+        """
+        Runs auctions of a buyer whose interest groups bid values of their own trusted bidding signals keys,
+        served by a `TrustedSignalsProvider`. With `batched`, all groups share one trustedBiddingSignalsUrl, so the
+        browser can fetch their keys in a single request; otherwise every group has its own url. Returns auction
+        results and the provider's summary.
+        """
+        signals = TrustedSignalsProvider(KeyValueIndex({f'key{i}': i + 1 for i in range(interest_groups)}),
+                                         default_latency=SIGNALS_LATENCY)
+        with MockServer(directory='resources/batching', response_provider=signals,
+                        engine=ASYNCIO_ENGINE) as buyer_server, \
+                MockServer(directory='resources/batching') as seller_server:
+            clear_interest_groups(self.driver, [buyer_server.address])
+            join_interest_groups(self.driver, [
+                InterestGroupSpec(
+                    owner=buyer_server.address,
+                    name=f'ig_{i}',
+                    trusted_bidding_signals_path='/trusted_bidding_signals' if batched
+                    else f'/ig_{i}/trusted_bidding_signals',
+                    params=dict(trustedBiddingSignalsKeys=[f'key{i}']))
+                for i in range(interest_groups)])
+
+            replay = AuctionReplay(self.driver, seller_server.blank_page_address)
+            config = auction_config(seller_server.address, [buyer_server.address])
+            results = replay.run_many([config] * auctions)
+            auctions_summary = summary(results, replay.wall_time_ms)
+            signals_summary = signals.summary()
+            logger.info(f"{'batched' if batched else 'unbatched'} trusted signals: "
+                        f"auctions {pretty_json(auctions_summary)}, signals {pretty_json(signals_summary)}")
+
+            assert_that(auctions_summary['errors']).is_equal_to(0)
+            assert_that(auctions_summary['no_winner']).is_equal_to(0)
+            assert_that(signals_summary['missing_keys']).is_equal_to(0)
+            return results, signals_summary
+
     @print_debug
     @measure_time
     @log_exception
@@ -38,3 +85,25 @@ class TrustedBiddingSignalsTest(BaseTest):
         logger.info(f"reportWin() signals: {pretty_json(report_win_signals)}")
         # generateBid() in this test case uses one of trustedBiddingSignals as a bid value
         assert_that(report_win_signals.get('browserSignals').get('bid')).is_equal_to(15)
+
+    @print_debug
+    @measure_time
+    @log_exception
+    def test__trusted_bidding_signals_batching_latency(self):
+        """Auction latency with trusted bidding signals of all interest groups fetched in batches vs. one by one."""
+        batched_results, batched_signals = self.runAuctionsWithSignals(batched=True)
+        unbatched_results, unbatched_signals = self.runAuctionsWithSignals(batched=False)
+
+        batched_ms = [result.duration_ms for result in batched_results]
+        unbatched_ms = [result.duration_ms for result in unbatched_results]
+        save_results(self.id(), dict(batched_auction_duration_ms=batched_ms, unbatched_auction_duration_ms=unbatched_ms),
+                     self.driver, self.browser_flags)
+        batched_median, unbatched_median = statistics.median(batched_ms), statistics.median(unbatched_ms)
+        logger.info(f"auction duration (median): batched {batched_median:.1f} ms "
+                    f"({batched_signals['fetches']} fetches, up to {batched_signals['keys_per_fetch_max']} keys), "
+                    f"unbatched {unbatched_median:.1f} ms ({unbatched_signals['fetches']} fetches), "
+                    f"difference {unbatched_median - batched_median:+.1f} ms")
+
+        # every unbatched url carries a single key; batching can only reduce the number of fetches
+        assert_that(unbatched_signals['keys_per_fetch_max']).is_equal_to(1)
+        assert_that(batched_signals['fetches']).is_less_than_or_equal_to(unbatched_signals['fetches'])
@@ -0,0 +1,96 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import json
+import os
+import tempfile
+import unittest
+
+from assertpy import assert_that
+
+from common.trace.breakdown import AuctionBreakdown, async_spans
+
+BUYER = 'https://localhost:8081'
+
+
+def span(name, id, begin, end, **args):
+    """Begin and end events of an async span, timestamps in ms (trace timestamps are in us)."""
+    return [dict(name=name, id=id, ph='b', ts=begin * 1000, cat='fledge', args=args),
+            dict(name=name, id=id, ph='e', ts=end * 1000, cat='fledge')]
+
+
+class AsyncSpansTest(unittest.TestCase):
+
+    def test__overlapping_spans_of_one_id_are_paired_first_in_first_out(self):
+        events = span('generate_bid', 1, 0, 10) + span('generate_bid', 1, 5, 20)
+        # as TraceStore.durations: the first end closes the first begin
+        assert_that([(s.start, s.end) for s in async_spans(events)]).is_equal_to([(0, 10000), (5000, 20000)])
+
+    def test__nested_spans_of_other_names(self):
+        events = span('bidder_worklet_generate_bid', 1, 0, 30, interest_group_name='ig') + \
+            span('generate_bid', 1, 10, 20)
+        spans = async_spans(events)
+        assert_that([(s.name, s.duration) for s in spans]) \
+            .is_equal_to([('bidder_worklet_generate_bid', 30000), ('generate_bid', 10000)])
+
+    def test__unmatched_end_is_ignored(self):
+        events = [dict(name='generate_bid', id=1, ph='e', ts=0)] + span('generate_bid', 1, 5, 7)
+        assert_that([(s.start, s.end) for s in async_spans(events)]).is_equal_to([(5000, 7000)])
+
+
+class AuctionBreakdownTest(unittest.TestCase):
+
+    def events(self):
+        return (span('auction', 'a1', 0, 100) +
+                span('bidder_worklet_generate_bid', 7, 10, 40, bidding_url=BUYER + '/buyer.js',
+                     interest_group_name='ig0') +
+                span('generate_bid', 7, 20, 30) +
+                span('bidder_worklet_generate_bid', 8, 15, 50, bidding_url=BUYER + '/buyer.js',
+                     interest_group_name='ig1') +
+                span('seller_worklet_score_ad', 9, 55, 60) +
+                span('unrelated', 10, 1, 2) +
+                span('auction', 'a2', 200, 250) +
+                span('generate_bid', 11, 210, 215))
+
+    def test__stages_are_assigned_to_auctions_with_buyers_and_interest_groups(self):
+        breakdown = AuctionBreakdown.from_events(self.events())
+        assert_that(breakdown.auctions()).is_equal_to([0, 1])
+        generate_bid = [timing for timing in breakdown.timings if timing.stage == 'generate_bid']
+        assert_that([(timing.auction, timing.start_ms, timing.duration_ms) for timing in generate_bid]) \
+            .is_equal_to([(0, 20.0, 10.0), (1, 10.0, 5.0)])
+        # generate_bid inherits arguments of the bidder worklet span of the same id
+        assert_that(generate_bid[0].buyer).is_equal_to(BUYER)
+        assert_that(generate_bid[0].interest_group).is_equal_to('ig0')
+        assert_that({timing.event for timing in breakdown.timings}).does_not_contain('unrelated', 'auction')
+
+    def test__stage_spans_cover_parallel_spans(self):
+        breakdown = AuctionBreakdown.from_events(self.events())
+        assert_that(breakdown.stage_spans(0)).is_equal_to(
+            dict(bidder_worklet=40.0, generate_bid=10.0, seller_worklet=5.0))
+        assert_that(breakdown.stage_spans(1)).is_equal_to(dict(generate_bid=5.0))
+
+    def test__stage_spans_of_unknown_auction(self):
+        breakdown = AuctionBreakdown.from_events(self.events())
+        assert_that(breakdown.stage_spans).raises(ValueError).when_called_with(2)
+
+    def test__spans_before_the_first_auction_are_skipped(self):
+        breakdown = AuctionBreakdown.from_events(span('generate_bid', 1, 0, 5) + span('auction', 'a', 10, 20) +
+                                                 span('generate_bid', 2, 12, 15))
+        assert_that([timing.start_ms for timing in breakdown.timings]).is_equal_to([2.0])
+
+    def test__missing_auction_events(self):
+        assert_that(AuctionBreakdown.from_events).raises(ValueError) \
+            .when_called_with(span('generate_bid', 1, 0, 5)).contains("'auction'")
+        assert_that(AuctionBreakdown.from_events(span('unrelated', 1, 0, 5)).timings).is_empty()
+
+    def test__summary_and_json(self):
+        breakdown = AuctionBreakdown.from_events(self.events())
+        summary = breakdown.summary()
+        assert_that(summary['bidder_worklet'][BUYER]).is_equal_to(dict(count=2, mean=32.5, median=32.5, max=35.0))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'breakdown.json')
+            breakdown.to_json(path)
+            with open(path) as f:
+                saved = json.load(f)
+        assert_that(saved['stage_spans']).is_length(2)
+        assert_that(saved['timings']).is_length(len(breakdown.timings))
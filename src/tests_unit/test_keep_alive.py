@@ -0,0 +1,70 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import asyncio
+import http.client
+import io
+import ssl
+import unittest
+from http import HTTPStatus
+
+from assertpy import assert_that
+
+from common.mockserver import ASYNCIO_ENGINE, THREADING_ENGINE, MockServer, Request, Response, read_chunked
+from common.mockserver.aio import read_body
+from common.mockserver.benchmark import CA_CERT
+
+CHUNKED_BODY = b'5;ext=1\r\nhello\r\n7\r\n, world\r\n0\r\nX-Checksum: 42\r\nX-Other: 1\r\n\r\nNEXT'
+
+
+async def read_body_async(data: bytes, headers):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return await read_body(reader, headers), await reader.read()
+
+
+class ChunkedBodyTest(unittest.TestCase):
+
+    def test__threading_engine_reads_chunks_with_extensions_and_trailers(self):
+        rfile = io.BytesIO(CHUNKED_BODY)
+        assert_that(read_chunked(rfile)).is_equal_to(b'hello, world')
+        assert_that(rfile.read()).is_equal_to(b'NEXT')
+
+    def test__asyncio_engine_reads_chunks_with_extensions_and_trailers(self):
+        body, rest = asyncio.run(read_body_async(CHUNKED_BODY, {'Transfer-Encoding': 'chunked'}))
+        assert_that(body).is_equal_to(b'hello, world')
+        assert_that(rest).is_equal_to(b'NEXT')
+
+    def test__asyncio_engine_reads_body_of_content_length(self):
+        body, rest = asyncio.run(read_body_async(b'hello, worldNEXT', {'Content-Length': '12'}))
+        assert_that(body).is_equal_to(b'hello, world')
+        assert_that(rest).is_equal_to(b'NEXT')
+
+
+def echo(request: Request):
+    return Response(HTTPStatus.OK, [('Content-Type', 'application/octet-stream')], request.body or b'')
+
+
+class KeepAliveTest(unittest.TestCase):
+
+    def check_requests_share_connection(self, engine):
+        with MockServer(engine=engine, response_provider=echo, keep_alive=True) as server:
+            connection = http.client.HTTPSConnection(server.server_name, server.server_port,
+                                                     context=ssl.create_default_context(cafile=CA_CERT))
+            try:
+                connection.request('GET', '/first')
+                assert_that(connection.getresponse().read()).is_empty()
+                connection.request('POST', '/second', body=iter([b'hello', b', world']), encode_chunked=True)
+                response = connection.getresponse()
+                assert_that(response.status).is_equal_to(HTTPStatus.OK)
+                assert_that(response.read()).is_equal_to(b'hello, world')
+            finally:
+                connection.close()
+            assert_that(server.stats).contains_entry({'connections': 1}, {'requests': 2})
+
+    def test__threading_engine_reuses_connections(self):
+        self.check_requests_share_connection(THREADING_ENGINE)
+
+    def test__asyncio_engine_reuses_connections(self):
+        self.check_requests_share_connection(ASYNCIO_ENGINE)
@@ -0,0 +1,91 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import os
+import tempfile
+import time
+import unittest
+
+from assertpy import assert_that
+
+from common.utils.logtail import LineHandler, RtbDebugMetrics, TrackFile, dispatch
+
+COMPILE_LINE = b'[1:2:INFO:auction_v8_helper.cc(42)] [rtb-chromium-debug] AuctionV8Helper::Compile() ' \
+               b'https://localhost:8081/buyer.js duration: 253.986 ms'
+CALL_LINE = b'[rtb-chromium-debug] AuctionV8Helper::RunScript() generateBid call() duration: 2253 us'
+
+
+class Lines(LineHandler):
+    def __init__(self, marker=b''):
+        self.marker = marker
+        self.lines = []
+
+    def handle(self, line: str):
+        self.lines.append(line)
+
+
+class RtbDebugMetricsTest(unittest.TestCase):
+
+    def test__parses_names_urls_and_units(self):
+        metrics = RtbDebugMetrics()
+        for line in (COMPILE_LINE, CALL_LINE, b'[rtb-chromium-debug] no duration here'):
+            metrics.handle(line.decode())
+        compile_metric, call_metric = metrics.metrics
+        assert_that(compile_metric.name).is_equal_to('AuctionV8Helper::Compile()')
+        assert_that(compile_metric.url).is_equal_to('https://localhost:8081/buyer.js')
+        assert_that(compile_metric.duration_ms).is_close_to(253.986, 1e-9)
+        assert_that(call_metric.name).is_equal_to('AuctionV8Helper::RunScript() generateBid call()')
+        assert_that(call_metric.url).is_none()
+        assert_that(call_metric.duration_ms).is_close_to(2.253, 1e-9)
+        assert_that(metrics.by_name()).is_equal_to({'AuctionV8Helper::Compile()': [253.986],
+                                                    'AuctionV8Helper::RunScript() generateBid call()': [2.253]})
+
+    def test__callback_gets_every_metric(self):
+        received = []
+        RtbDebugMetrics(received.append).handle(CALL_LINE.decode())
+        assert_that(received).is_length(1)
+
+
+class DispatchTest(unittest.TestCase):
+
+    def test__only_lines_with_the_marker_are_passed(self):
+        marked, every = Lines(b'[rtb-chromium-debug]'), Lines()
+        dispatch(b'first\n' + COMPILE_LINE + b'\nsecond\r\n' + CALL_LINE, [marked, every])
+        assert_that(marked.lines).is_equal_to([COMPILE_LINE.decode(), CALL_LINE.decode()])
+        assert_that(every.lines).is_equal_to(['first', COMPILE_LINE.decode(), 'second', CALL_LINE.decode()])
+
+    def test__marker_found_twice_in_a_line(self):
+        marked = Lines(b'x')
+        dispatch(b'axbx\ncx\n', [marked])
+        assert_that(marked.lines).is_equal_to(['axbx', 'cx'])
+
+
+class TrackFileTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def append(self, content: bytes):
+        with open(self.path, 'ab') as f:
+            f.write(content)
+
+    def test__passes_lines_written_while_tracking(self):
+        self.append(b'old line\n')
+        lines = Lines()
+        with TrackFile(self.path, [lines], from_end=True):
+            self.append(b'first\nsec')
+            time.sleep(0.2)
+            self.append(b'ond\nthird')
+        # an incomplete last line is passed as well, once tracking stops
+        assert_that(lines.lines).is_equal_to(['first', 'second', 'third'])
+
+    def test__reads_from_the_start(self):
+        self.append(b'old line\n')
+        lines = Lines()
+        with TrackFile(self.path, [lines]):
+            pass
+        assert_that(lines.lines).is_equal_to(['old line'])
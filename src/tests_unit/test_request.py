@@ -0,0 +1,40 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import json
+import unittest
+from urllib.parse import quote
+
+from assertpy import assert_that
+
+from common.mockserver import Request, request_size
+
+
+class RequestTest(unittest.TestCase):
+
+    def test__params_are_parsed_lazily_and_memoized(self):
+        request = Request('/reportWin', 'a=1&a=2&b=x')
+        assert_that(request._params).is_none()
+        assert_that(request.get_params('a')).is_equal_to(['1', '2'])
+        assert_that(request.get_first_param('b')).is_equal_to('x')
+        assert_that(request.params).is_same_as(request.params)
+
+    def test__json_params_are_memoized(self):
+        signals = dict(browserSignals=dict(bid=42))
+        request = Request('/reportWin', 'signals=' + quote(json.dumps(signals)))
+        assert_that(request.get_first_json_param('signals')).is_equal_to(signals)
+        assert_that(request.get_first_json_param('signals')).is_same_as(request.get_first_json_param('signals'))
+
+    def test__missing_param(self):
+        assert_that(Request('/reportWin').get_first_param).raises(KeyError).when_called_with('signals')
+
+    def test__is_read_only_and_slotted(self):
+        request = Request('/reportWin', timestamp=1.0)
+        assert_that(setattr).raises(AttributeError).when_called_with(request, 'path', '/other')
+        assert_that(setattr).raises(AttributeError).when_called_with(request, 'extra', 1)
+        assert_that(hasattr(request, '__dict__')).is_false()
+        assert_that(request.timestamp).is_equal_to(1.0)
+        assert_that(repr(request)).contains("path='/reportWin'")
+
+    def test__size(self):
+        assert_that(request_size(Request('/r', 'a=1', body=b'1234'))).is_equal_to(9)
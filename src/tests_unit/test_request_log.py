@@ -0,0 +1,66 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import threading
+import time
+import unittest
+
+from assertpy import assert_that
+
+from common.mockserver import Request, RequestLog
+
+
+class RequestLogTest(unittest.TestCase):
+
+    def test__first_last_and_count_by_path(self):
+        log = RequestLog()
+        for i in range(3):
+            log.append(Request('/reportWin', f'i={i}'))
+        log.append(Request('/reportResult'))
+        assert_that(log).is_length(4)
+        assert_that(log.first('/reportWin').query).is_equal_to('i=0')
+        assert_that(log.last('/reportWin').query).is_equal_to('i=2')
+        assert_that(log.count('/reportWin')).is_equal_to(3)
+        assert_that(log.get('/reportResult')).is_length(1)
+        assert_that(log.last('/debugReportWin')).is_none()
+        assert_that(log.count('/debugReportWin')).is_equal_to(0)
+
+    def test__evicts_oldest_beyond_max_requests(self):
+        log = RequestLog(max_requests=2)
+        for i in range(3):
+            log.append(Request('/a' if i != 1 else '/b', f'i={i}'))
+        assert_that([request.query for request in log.all()]).is_equal_to(['i=1', 'i=2'])
+        assert_that(log.first('/a').query).is_equal_to('i=2')
+        assert_that(log.count('/a')).is_equal_to(2)  # counts include evicted requests
+        assert_that(log.evicted).is_equal_to(1)
+
+    def test__evicts_oldest_beyond_max_bytes(self):
+        log = RequestLog(max_bytes=100)
+        log.append(Request('/a', body=b'x' * 60))
+        log.append(Request('/b', body=b'x' * 60))
+        assert_that(log.get('/a')).is_empty()
+        assert_that(log.get('/b')).is_length(1)
+        assert_that(log.bytes).is_equal_to(62)
+
+    def test__find_last_with_predicate_and_out_of_order_timestamps(self):
+        log = RequestLog()
+        log.append(Request('/report', 'bid=1', timestamp=10.0))
+        log.append(Request('/report', 'bid=2', timestamp=30.0))
+        # appended last, but received before the previous one
+        log.append(Request('/report', 'bid=3', timestamp=20.0))
+        assert_that(log.find_last('/report', since=25.0).query).is_equal_to('bid=2')
+        assert_that(log.find_last('/report', lambda request: request.get_first_param('bid') == '1').query) \
+            .is_equal_to('bid=1')
+        assert_that(log.find_last('/report', since=40.0)).is_none()
+
+    def test__wait_for_wakes_up_on_append(self):
+        log = RequestLog()
+        timer = threading.Timer(0.1, lambda: log.append(Request('/reportWin')))
+        timer.start()
+        start = time.monotonic()
+        assert_that(log.wait_for('/reportWin', timeout=5)).is_not_none()
+        assert_that(time.monotonic() - start).is_less_than(5)
+        timer.join()
+
+    def test__wait_for_times_out(self):
+        assert_that(RequestLog().wait_for('/reportWin', timeout=0.05)).is_none()
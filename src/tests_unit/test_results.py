@@ -0,0 +1,82 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from assertpy import assert_that
+
+import common.results
+from common.results import MetricKind, ResultsStore, bootstrap_ci, compare, mann_whitney_u, metric_kind, save_results
+
+
+class MannWhitneyTest(unittest.TestCase):
+
+    def test__p_value_with_ties(self):
+        # U = 8, 4 pairs of ties: z = (|8 - 32| - 0.5) / sqrt(64 / 12 * (17 - 24 / 240)) = 2.4753
+        assert_that(mann_whitney_u(range(1, 9), range(5, 13))).is_close_to(0.01331, 1e-4)
+
+    def test__symmetric(self):
+        x, y = [3.1, 2.7, 4.0, 3.3, 2.9], [4.2, 3.9, 5.1, 4.4, 4.0, 4.8]
+        assert_that(mann_whitney_u(x, y)).is_close_to(mann_whitney_u(y, x), 1e-12)
+
+    def test__identical_samples(self):
+        assert_that(mann_whitney_u([1.0] * 10, [1.0] * 10)).is_equal_to(1.0)
+        assert_that(mann_whitney_u([], [1.0])).is_equal_to(1.0)
+
+
+class CompareTest(unittest.TestCase):
+    BASELINE = [10.0, 10.2, 9.9, 10.1, 10.0, 9.8, 10.3, 10.1, 9.9, 10.0]
+    SLOWER = [value * 1.5 for value in BASELINE]
+
+    def test__bootstrap_ci_contains_the_change(self):
+        low, high = bootstrap_ci(self.BASELINE, self.SLOWER)
+        assert_that(low).is_less_than_or_equal_to(0.5)
+        assert_that(high).is_greater_than_or_equal_to(0.5)
+
+    def test__increase_of_a_duration_is_a_regression(self):
+        comparison, = compare({('t', 'auction_duration_ms'): self.BASELINE},
+                              {('t', 'auction_duration_ms'): self.SLOWER})
+        assert_that(comparison.change).is_close_to(0.5, 1e-9)
+        assert_that(comparison.regression).is_true()
+        assert_that(comparison.improvement).is_false()
+        assert_that(comparison.unit).is_equal_to('ms')
+
+    def test__decrease_of_a_higher_is_better_metric_is_a_regression(self):
+        kinds = {('t', 'throughput'): MetricKind('req/s', higher_is_better=True)}
+        comparison, = compare({('t', 'throughput'): self.SLOWER}, {('t', 'throughput'): self.BASELINE}, kinds=kinds)
+        assert_that(comparison.regression).is_true()
+        assert_that(comparison.improvement).is_false()
+
+    def test__insignificant_change(self):
+        comparison, = compare({('t', 'm_ms'): self.BASELINE}, {('t', 'm_ms'): list(reversed(self.BASELINE))})
+        assert_that(comparison.regression).is_false()
+        assert_that(comparison.improvement).is_false()
+
+    def test__only_common_metrics_are_compared(self):
+        assert_that(compare({('t', 'a_ms'): [1.0]}, {('t', 'b_ms'): [1.0]})).is_empty()
+
+    def test__metric_kinds_by_name(self):
+        assert_that(metric_kind('max_processes.renderer')).is_equal_to(MetricKind('processes'))
+        assert_that(metric_kind('peak_rss_mb.browser').unit).is_equal_to('MiB')
+        assert_that(metric_kind('rtb_debug.AuctionV8Helper::Compile()').unit).is_equal_to('ms')
+        assert_that(metric_kind('test_duration_s').unit).is_equal_to('s')
+        assert_that(metric_kind('concurrency').higher_is_better).is_true()
+
+
+class ResultsStoreTest(unittest.TestCase):
+
+    def test__saves_samples_with_run_ids_and_kinds(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(common.results, 'BENCHMARK_RESULTS_DIR', directory), \
+                mock.patch.dict(os.environ, BENCHMARK_RUN_ID='run-1'):
+            save_results('t', dict(auction_duration_ms=[1, 2], cpu_s=[0.5]), flags=['--flag'])
+            save_results('t', dict(auction_duration_ms=[3]), kinds=dict(auction_duration_ms=MetricKind('us')))
+            store = ResultsStore(directory)
+            assert_that(store.samples('run-1')).is_equal_to({('t', 'auction_duration_ms'): [1.0, 2.0, 3.0],
+                                                             ('t', 'cpu_s'): [0.5]})
+            assert_that(store.records('run-1')[0].flags).is_equal_to(['--flag'])
+            assert_that(store.kinds('run-1')[('t', 'auction_duration_ms')]).is_equal_to(MetricKind('us'))
+            assert_that(store.samples('run-2')).is_empty()
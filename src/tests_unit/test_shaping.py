@@ -0,0 +1,63 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import unittest
+
+from assertpy import assert_that
+
+from common.mockserver.shaping import Fixed, LogNormal, NetworkShaper, ShapingPlan, Uniform
+
+
+class ShapingPlanTest(unittest.TestCase):
+
+    def test__unthrottled_body_is_one_chunk(self):
+        chunks = list(ShapingPlan().chunks(b'x' * 100))
+        assert_that([(offset, len(chunk), pause) for offset, chunk, pause in chunks]).is_equal_to([(0, 100, 0.0)])
+
+    def test__throttled_body_is_split_into_chunks(self):
+        chunks = list(ShapingPlan(bandwidth=1000, chunk_size=40).chunks(b'x' * 100))
+        assert_that([(offset, len(chunk)) for offset, chunk, _ in chunks]).is_equal_to([(0, 40), (40, 40), (80, 20)])
+
+    def test__stall_splits_the_chunk_it_falls_into(self):
+        plan = ShapingPlan(bandwidth=1000, chunk_size=40, stall_at=0.5, stall=2.0)
+        chunks = list(plan.chunks(b'x' * 100))
+        assert_that([(offset, len(chunk), pause) for offset, chunk, pause in chunks]) \
+            .is_equal_to([(0, 40, 0.0), (40, 10, 0.0), (50, 40, 2.0), (90, 10, 0.0)])
+
+    def test__stall_position_is_relative_to_the_whole_body(self):
+        plan = ShapingPlan(stall_at=0.75, stall=1.0)
+        # the second half of a 100 bytes body, written separately
+        chunks = list(plan.chunks(b'x' * 50, offset=50, total=100))
+        assert_that([(offset, len(chunk), pause) for offset, chunk, pause in chunks]) \
+            .is_equal_to([(50, 25, 0.0), (75, 25, 1.0)])
+
+    def test__empty_body(self):
+        assert_that(list(ShapingPlan().chunks(b''))).is_empty()
+
+
+class NetworkShaperTest(unittest.TestCase):
+
+    def test__first_fully_matching_rule_applies(self):
+        shaper = NetworkShaper(seed=0) \
+            .add('/igslow/.*', ttfb=Fixed(0.75)) \
+            .add('/.*\\.js', ttfb=Fixed(0.1), bandwidth=1024)
+        assert_that(shaper.plan('/igslow/trusted_bidding_signals.json').ttfb).is_equal_to(0.75)
+        assert_that(shaper.plan('/igslow/buyer.js').ttfb).is_equal_to(0.75)
+        assert_that(shaper.plan('/buyer.js').bandwidth).is_equal_to(1024)
+        assert_that(shaper.plan('/buyer.js.map')).is_none()
+        assert_that(shaper.plan('/ad.html')).is_none()
+
+    def test__plans_are_reproducible_with_a_seed(self):
+        def plans():
+            shaper = NetworkShaper(seed=42).add('/.*', ttfb=LogNormal(median=0.05, sigma=0.5),
+                                                  body_delay=Uniform(0.0, 0.1), stall=Fixed(1.0),
+                                                  stall_probability=0.5, reset_probability=0.2)
+            return [shaper.plan('/buyer.js') for _ in range(20)]
+
+        first, second = plans(), plans()
+        assert_that(first).is_equal_to(second)
+        assert_that({plan.reset for plan in first}).is_equal_to({False, True})
+        assert_that({plan.stall for plan in first}).is_equal_to({0.0, 1.0})
+        for plan in first:
+            assert_that(plan.body_delay).is_between(0.0, 0.1)
+            assert_that(plan.stall_at is None).is_equal_to(plan.stall == 0.0)
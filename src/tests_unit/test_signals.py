@@ -0,0 +1,101 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from http import HTTPStatus
+from urllib.parse import urlencode
+
+from assertpy import assert_that
+
+from common.mockserver import Request
+from common.mockserver.shaping import Fixed
+from common.mockserver.signals import KeyValueIndex, TrustedSignalsProvider
+
+AD_URL = 'https://localhost:8081/ad.html'
+COMPONENT_URL = 'https://localhost:8081/component.html'
+
+
+def request(path='/trusted_bidding_signals', **params) -> Request:
+    return Request(path, urlencode(params))
+
+
+class KeyValueIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.temporary_directory.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test__load_json(self):
+        index = KeyValueIndex.load(self.write('signals.json', json.dumps(dict(key1=[1, 2], key2='x'))))
+        assert_that(index.values).is_equal_to(dict(key1=[1, 2], key2='x'))
+
+    def test__load_csv(self):
+        index = KeyValueIndex.load(self.write('signals.csv', 'key,value\nkey1,42\nkey2,"{""a"": [1, 2]}"\n'
+                                                           'key3,plain text\nkey4,a,b\n\n'))
+        assert_that(index.values).is_equal_to(dict(key1=42, key2=dict(a=[1, 2]), key3='plain text', key4='a,b'))
+        assert_that(index).is_length(4)
+
+    def test__lookup_leaves_out_missing_keys(self):
+        assert_that(KeyValueIndex(dict(key1=1)).lookup(['key1', 'missing'])).is_equal_to(dict(key1=1))
+
+
+class TrustedSignalsProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.provider = TrustedSignalsProvider(
+            KeyValueIndex({'key1': 1, 'key2': [2], AD_URL: dict(score=3), COMPONENT_URL: 4}),
+            per_interest_group_data=dict(ig1=dict(priorityVector=dict(signal=1))))
+
+    def body(self, response):
+        assert_that(response.status).is_equal_to(HTTPStatus.OK)
+        assert_that(dict(response.headers)).contains_entry({'Ad-Auction-Allowed': 'true'}) \
+            .contains_entry({'X-fledge-bidding-signals-format-version': '2'})
+        return json.loads(response.body)
+
+    def test__bidding_signals(self):
+        response = self.provider(request(hostname='localhost', keys='key1,key2,missing',
+                                         interestGroupNames='ig1,ig2'))
+        assert_that(self.body(response)).is_equal_to(dict(
+            keys=dict(key1=1, key2=[2]), perInterestGroupData=dict(ig1=dict(priorityVector=dict(signal=1)))))
+        fetch, = self.provider.fetches
+        assert_that(fetch.hostname).is_equal_to('localhost')
+        assert_that(fetch.keys).is_equal_to(['key1', 'key2', 'missing'])
+        assert_that(fetch.missing_keys).is_equal_to(['missing'])
+
+    def test__scoring_signals(self):
+        response = self.provider(request('/trusted_scoring_signals', hostname='localhost',
+                                         renderUrls=AD_URL + ',https://localhost:8081/missing.html',
+                                         adComponentRenderUrls=COMPONENT_URL))
+        assert_that(self.body(response)).is_equal_to(dict(
+            renderUrls={AD_URL: dict(score=3)}, adComponentRenderUrls={COMPONENT_URL: 4}))
+
+    def test__request_without_keys(self):
+        assert_that(self.body(self.provider(request(hostname='localhost')))) \
+            .is_equal_to(dict(keys={}, perInterestGroupData={}))
+
+    def test__other_paths_are_left_to_the_server(self):
+        assert_that(self.provider(request('/buyer.js', keys='key1'))).is_none()
+        assert_that(self.provider.fetches).is_empty()
+
+    def test__batched_fetch_is_as_slow_as_its_slowest_key(self):
+        provider = TrustedSignalsProvider(KeyValueIndex(dict(key1=1, key2=2)), key_latency=dict(key2=Fixed(0.02)),
+                                          default_latency=Fixed(0.01))
+        response = provider(request(keys='key1,key2'))
+        assert_that(asyncio.iscoroutine(response)).is_true()
+        assert_that(json.loads(asyncio.run(response).body)['keys']).is_equal_to(dict(key1=1, key2=2))
+        provider(request(keys='key1')).close()
+        assert_that([fetch.latency for fetch in provider.fetches]).is_equal_to([0.02, 0.01])
+        assert_that(provider.summary()).contains_entry({'fetches': 2}, {'keys': 3}, {'keys_per_fetch_max': 2},
+                                                      {'missing_keys': 0})
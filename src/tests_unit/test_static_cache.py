@@ -0,0 +1,85 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import gzip
+import os
+import tempfile
+import unittest
+from http import HTTPStatus
+
+from assertpy import assert_that
+
+from common.mockserver import guess_type
+from common.mockserver.static import GZIP, StaticFileCache
+
+
+class StaticFileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.directory = self.temporary_directory.name
+        self.write('buyer.js', b'fetch("https://localhost:8081/bid"); ' * 100)
+        self.write('ad.png', b'\x89PNG https://localhost:8081/')
+        self.write('sub/index.html', b'<html></html>')
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def write(self, name, content: bytes):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test__serves_preloaded_files_with_validators(self):
+        cache = StaticFileCache(self.directory)
+        assert_that(cache.entries).is_length(3)
+        entry = cache.lookup('/buyer.js')
+        status, headers, body = entry.response()
+        assert_that(status).is_equal_to(HTTPStatus.OK)
+        assert_that(dict(headers)).contains_entry({'Content-Type': guess_type('buyer.js')}) \
+            .contains_entry({'Content-Length': str(len(body))}).contains_key('ETag', 'Last-Modified')
+        status, _, body = entry.response(if_none_match=entry.etag)
+        assert_that(status).is_equal_to(HTTPStatus.NOT_MODIFIED)
+        assert_that(body).is_empty()
+
+    def test__directory_index_and_missing_files(self):
+        cache = StaticFileCache(self.directory)
+        assert_that(cache.lookup('/sub/').body).is_equal_to(b'<html></html>')
+        assert_that(cache.lookup('/missing.js')).is_none()
+        assert_that(cache.lookup('/sub')).is_none()
+
+    def test__reloads_modified_files(self):
+        cache = StaticFileCache(self.directory)
+        etag = cache.lookup('/sub/index.html').etag
+        self.write('sub/index.html', b'<html>changed</html>')
+        entry = cache.lookup('/sub/index.html')
+        assert_that(entry.body).is_equal_to(b'<html>changed</html>')
+        assert_that(entry.etag).is_not_equal_to(etag)
+
+    def test__compressed_variants_of_text_files(self):
+        cache = StaticFileCache(self.directory, encodings=[GZIP])
+        entry = cache.lookup('/buyer.js')
+        status, headers, body = entry.response(accept_encoding='br;q=1.0, gzip;q=0.8')
+        assert_that(dict(headers)).contains_entry({'Content-Encoding': GZIP}) \
+            .contains_entry({'Vary': 'Accept-Encoding'})
+        assert_that(gzip.decompress(body)).is_equal_to(entry.body)
+        assert_that(dict(entry.response(accept_encoding='identity')[1])).does_not_contain_key('Content-Encoding')
+        assert_that(cache.lookup('/ad.png').variants).is_empty()
+
+    def test__zero_copy_of_large_files(self):
+        cache = StaticFileCache(self.directory, zero_copy_threshold=1024)
+        assert_that(cache.lookup('/buyer.js').body).is_instance_of(memoryview)
+        assert_that(cache.lookup('/sub/index.html').body).is_instance_of(bytes)
+
+    def test__transform_applies_to_text_files_only(self):
+        cache = StaticFileCache(self.directory, transform=lambda content: content.replace(b'8081', b'9081'))
+        assert_that(bytes(cache.lookup('/buyer.js').body)).contains(b'localhost:9081').does_not_contain(b'8081')
+        assert_that(cache.lookup('/ad.png').body).contains(b'localhost:8081')
+
+    def test__added_transform_reloads_entries(self):
+        cache = StaticFileCache(self.directory)
+        cache.add_transform(lambda content: content.replace(b'fetch', b'load'))
+        cache.add_transform(lambda content: content.replace(b'load', b'import'))
+        assert_that(bytes(cache.lookup('/buyer.js').body[:7])).is_equal_to(b'import(')
@@ -0,0 +1,86 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from assertpy import assert_that
+
+from common.sweep import Sweep, SweepPoint, SweepResult, grid, parse_range, refinement_points, saturated
+
+
+def capped_concurrency(point: SweepPoint):
+    """Concurrency growing with the load up to 16."""
+    return dict(concurrency=min(point.load, 16), duration_ms=10.0 * point.load)
+
+
+class ParseRangeTest(unittest.TestCase):
+
+    def test__values_and_ranges(self):
+        assert_that(parse_range('5,16,32')).is_equal_to([5, 16, 32])
+        assert_that(parse_range('1-4')).is_equal_to([1, 2, 3, 4])
+        assert_that(parse_range('1-32:8')).is_equal_to([1, 9, 17, 25])
+        assert_that(parse_range('1-32:x2')).is_equal_to([1, 2, 4, 8, 16, 32])
+        assert_that(parse_range('3, 1-3, ')).is_equal_to([1, 2, 3])
+
+    def test__factor_has_to_grow(self):
+        assert_that(parse_range).raises(AssertionError).when_called_with('1-8:x1')
+
+
+class RefinementTest(unittest.TestCase):
+
+    def results(self, buyers):
+        return [SweepResult(point, capped_concurrency(point))
+                for point in grid(buyers=buyers, buyer_igs=[1], auctions=[2], execution_modes=['compatibility'])]
+
+    def test__saturation(self):
+        lower, upper, flat = self.results([8, 32, 64])
+        assert_that(saturated(lower, upper, 'concurrency')).is_true()
+        assert_that(saturated(*self.results([2, 4]), 'concurrency')).is_false()
+        assert_that(saturated(upper, flat, 'missing')).is_false()
+
+    def test__only_the_first_saturated_interval_is_refined(self):
+        points = refinement_points(self.results([1, 4, 32, 64]), 'concurrency')
+        assert_that(points).is_equal_to([SweepPoint('compatibility', 18, 1, 2)])
+
+    def test__adjacent_points_are_not_refined(self):
+        assert_that(refinement_points(self.results([16, 17]), 'concurrency')).is_empty()
+
+    def test__refinement_converges_on_the_saturation_point(self):
+        sweep = Sweep(grid(buyers=[1, 4, 32, 64], buyer_igs=[1], auctions=[2], execution_modes=['compatibility']),
+                      capped_concurrency)
+        results = sweep.run(refine_metric='concurrency', max_refinements=10)
+        assert_that([result.point for result in results]).is_sorted()
+        assert_that(refinement_points(results, 'concurrency')).is_empty()
+        # the first saturated interval narrowed down to adjacent points, past the knee at 16 buyers
+        lower, upper = next((lower, upper) for lower, upper in zip(results, results[1:])
+                            if saturated(lower, upper, 'concurrency'))
+        assert_that(upper.point.buyers - lower.point.buyers).is_equal_to(1)
+        assert_that(lower.point.buyers).is_between(16, 31)
+
+
+class SweepOutputTest(unittest.TestCase):
+
+    def test__table_csv_and_json(self):
+        sweep = Sweep(grid(buyers=[1, 2], buyer_igs=[1, 2], auctions=[1], execution_modes=['a', 'b']),
+                      capped_concurrency)
+        sweep.run()
+        assert_that(sweep.table().splitlines()).is_length(9)
+        series = sweep.series()
+        assert_that(series['a']['load']).is_equal_to([1, 2, 4])
+        # two points of load 2 are averaged
+        assert_that(series['a']['duration_ms']).is_equal_to([10.0, 20.0, 40.0])
+        with tempfile.TemporaryDirectory() as directory:
+            sweep.to_csv(os.path.join(directory, 'sweep.csv'))
+            sweep.to_json(os.path.join(directory, 'sweep.json'))
+            with open(os.path.join(directory, 'sweep.csv')) as f:
+                rows = list(csv.DictReader(f))
+            with open(os.path.join(directory, 'sweep.json')) as f:
+                saved = json.load(f)
+        assert_that(rows).is_length(8)
+        assert_that(rows[0]).contains_key('execution_mode', 'load', 'refined', 'concurrency')
+        assert_that(saved['points']).is_length(8)
+        assert_that(saved['series']).contains_key('a', 'b')
@@ -0,0 +1,74 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import unittest
+
+from assertpy import assert_that
+
+from common.trace.store import TraceStore, percentiles
+
+
+def event(name, ph, ts, id=1):
+    return dict(name=name, ph=ph, ts=ts, id=id, cat='fledge')
+
+
+def durations(events):
+    return sorted(TraceStore.from_events(events).durations().tolist())
+
+
+class DurationsTest(unittest.TestCase):
+
+    def test__matched_events(self):
+        events = [event('generate_bid', 'b', 0, 1), event('generate_bid', 'b', 1, 2),
+                  event('generate_bid', 'e', 5, 2), event('generate_bid', 'e', 10, 1),
+                  event('score_ad', 'b', 3, 1), event('score_ad', 'e', 4, 1)]
+        assert_that(durations(events)).is_equal_to([1.0, 4.0, 10.0])
+
+    def test__events_of_one_id_are_paired_first_in_first_out(self):
+        events = [event('generate_bid', 'b', 0), event('generate_bid', 'b', 5),
+                  event('generate_bid', 'e', 10), event('generate_bid', 'e', 20)]
+        assert_that(durations(events)).is_equal_to([10.0, 15.0])
+
+    def test__unmatched_events_are_dropped(self):
+        # an end whose begin was before tracing started, a begin whose end is after it stopped
+        events = [event('generate_bid', 'e', 0), event('generate_bid', 'b', 2), event('generate_bid', 'e', 5),
+                  event('generate_bid', 'b', 8), event('score_ad', 'b', 1, 2), event('score_ad', 'e', 3, 2)]
+        with self.assertLogs(level='WARNING') as logs:
+            assert_that(durations(events)).is_equal_to([2.0, 3.0])
+        assert_that(logs.output[0]).contains('dropped 1 begin and 1 end events')
+
+    def test__interleaved_unmatched_events(self):
+        # equal counts of begins and ends per key, but an end comes first
+        events = [event('generate_bid', 'e', 0), event('generate_bid', 'b', 1), event('generate_bid', 'e', 4),
+                  event('generate_bid', 'b', 6)]
+        with self.assertLogs(level='WARNING'):
+            assert_that(durations(events)).is_equal_to([3.0])
+
+    def test__no_warning_without_unmatched_events(self):
+        store = TraceStore.from_events([event('generate_bid', 'b', 0), event('generate_bid', 'e', 2)])
+        with self.assertNoLogs(level='WARNING'):
+            assert_that(store.matched_durations(store.name_ids[:1].astype('int64') << 32,
+                                                store.name_ids[1:].astype('int64') << 32).tolist()) \
+                .is_equal_to([2.0])
+
+    def test__durations_by_name(self):
+        store = TraceStore.from_events([event('generate_bid', 'b', 0), event('generate_bid', 'e', 2),
+                                        event('score_ad', 'b', 1), event('score_ad', 'e', 4)])
+        assert_that({name: values.tolist() for name, values in store.durations_by_name().items()}) \
+            .is_equal_to(dict(generate_bid=[2.0], score_ad=[3.0]))
+
+
+class ConcurrencyTest(unittest.TestCase):
+
+    def test__concurrency(self):
+        store = TraceStore.from_events([event('generate_bid', 'b', 0, 1), event('generate_bid', 'b', 1, 2),
+                                        event('generate_bid', 'e', 2, 1), event('generate_bid', 'e', 4, 2),
+                                        event('generate_bid', 'n', 3, 3)])
+        assert_that(store.max_concurrency()).is_equal_to(2)
+        # 1 for 1 us, 2 for 1 us, 1 for 2 us over 4 us
+        assert_that(store.mean_concurrency()).is_close_to(1.25, 1e-9)
+        assert_that(store.select('GENERATE').count('b')).is_equal_to(2)
+        assert_that(store.select('score')).is_empty()
+
+    def test__percentiles(self):
+        assert_that(percentiles(TraceStore.from_events([]).durations())).is_empty()
@@ -0,0 +1,49 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import json
+import unittest
+
+from assertpy import assert_that
+
+from common.trace import iter_json_array_items
+
+EVENTS = [
+    dict(name='generate_bid', cat='fledge', ph='b', ts=1, id='0x1'),
+    dict(name='a [bracketed] "quoted" name', cat='fledge', ph='e', ts=2, args=dict(url='https://x/?a=[1]')),
+    dict(name='escapes \\" ] } , and unicode é', cat='fledge', ph='n', ts=3),
+]
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class IterJsonArrayItemsTest(unittest.TestCase):
+
+    def test__items_split_across_chunks_at_every_position(self):
+        text = json.dumps(dict(traceEvents=EVENTS))
+        for size in range(1, len(text) + 1):
+            assert_that(list(iter_json_array_items(split(text, size)))).described_as(f"chunks of {size}") \
+                .is_equal_to(EVENTS)
+
+    def test__metadata_before_and_after_the_array(self):
+        text = json.dumps(dict(metadata=dict(note='[not events]', traceEvents=0), traceEvents=EVENTS,
+                               systemTraceEvents='[]', more=[{'x': 1}]))
+        assert_that(list(iter_json_array_items(split(text, 7)))).is_equal_to(EVENTS)
+
+    def test__metadata_after_the_array_is_not_read(self):
+        text = json.dumps(dict(traceEvents=EVENTS[:1])) + ' trailing garbage ['
+        assert_that(list(iter_json_array_items(split(text, 5)))).is_equal_to(EVENTS[:1])
+
+    def test__empty_array(self):
+        assert_that(list(iter_json_array_items(['{"traceEvents": [', ' ]}']))).is_empty()
+        assert_that(list(iter_json_array_items(['{"traceEvents":[]}']))).is_empty()
+
+    def test__no_array(self):
+        assert_that(list(iter_json_array_items(['{"other": ', '1}']))).is_empty()
+        assert_that(list(iter_json_array_items([]))).is_empty()
+
+    def test__truncated_item(self):
+        chunks = ['{"traceEvents": [{"name": "a"}, {"name": ']
+        assert_that(list).raises(json.JSONDecodeError).when_called_with(iter_json_array_items(chunks))
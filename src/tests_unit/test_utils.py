@@ -0,0 +1,57 @@
+# Copyright 2024 RTBHOUSE. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import unittest
+
+from assertpy import assert_that
+
+from common.utils import AverageBenchmarks, BenchmarkSettings, relative_ci_width
+
+
+class RelativeCiWidthTest(unittest.TestCase):
+
+    def test__median_ci_of_100_samples_spans_40th_to_61st_value(self):
+        # n = 100: order statistics r = floor(50 - 9.8) = 40 and s = ceil(1 + 50 + 9.8) = 61 (1-based)
+        values = list(range(1, 101))
+        assert_that(relative_ci_width(values, AverageBenchmarks.MEDIAN)).is_close_to((61 - 40) / 50.5, 1e-9)
+
+    def test__median_ci_does_not_depend_on_order(self):
+        values = [5.0, 1.0, 4.0, 2.0, 3.0, 9.0, 7.0, 8.0, 6.0, 10.0]
+        assert_that(relative_ci_width(values, AverageBenchmarks.MEDIAN)) \
+            .is_equal_to(relative_ci_width(sorted(values), AverageBenchmarks.MEDIAN))
+
+    def test__mean_ci(self):
+        values = [1.0, 2.0, 3.0, 4.0]
+        # stdev 1.291, half-width 1.96 * 1.291 / 2
+        assert_that(relative_ci_width(values, AverageBenchmarks.MEAN)).is_close_to(2 * 1.96 * 1.2909944 / 2 / 2.5, 1e-6)
+
+    def test__too_few_samples(self):
+        assert_that(relative_ci_width([1.0], AverageBenchmarks.MEDIAN)).is_equal_to(float('inf'))
+
+
+class AverageBenchmarksTest(unittest.TestCase):
+
+    def test__max_times_defaults_to_min_times(self):
+        assert_that(BenchmarkSettings(min_times=5).max_times).is_equal_to(5)
+        assert_that(BenchmarkSettings(min_times=5, max_times=2).max_times).is_equal_to(5)
+
+    def test__method_kwargs_do_not_clash_with_settings(self):
+        calls = []
+
+        def method(_, mode, warmups):
+            calls.append((mode, warmups))
+            return dict(duration_ms=1.0)
+
+        benchmarks = AverageBenchmarks(method, None, kwargs=dict(mode='fast', warmups='none'),
+                                       settings=BenchmarkSettings(warmups=1, min_times=2))
+        benchmarks.run()
+        assert_that(calls).is_equal_to([('fast', 'none')] * 3)
+        assert_that(benchmarks.results['duration_ms']).is_length(2)
+
+    def test__stats_exclude_rejected_outliers(self):
+        benchmarks = AverageBenchmarks(None, None, settings=BenchmarkSettings(reject_outliers=True))
+        stats = benchmarks.stats([10.0, 10.5, 9.5, 10.2, 9.8, 10.1, 1000.0])
+        assert_that(stats['p99']).is_less_than(11.0)
+        assert_that(stats['stddev']).is_less_than(1.0)
+        assert_that(stats['outliers']).is_equal_to(1)
+        assert_that(stats['samples']).is_equal_to(7)
@@ -3,66 +3,68 @@
 
 import logging
 import os
-import re
 import time
+import unittest
 import urllib.parse
 
+import numpy as np
 from assertpy import assert_that
 
+from common.auction_replay import AuctionReplay, auction_config, summary
 from common.base_test import BaseTest
+from common.interest_groups import InterestGroupSpec, clear_interest_groups, join_interest_groups
 from common.mockserver import MockServer
+from common.mockserver import MockServerPool
+from common.results import save_results
+from common.sweep import Sweep, SweepPoint, grid, parse_range
+from common.trace.store import TraceStore, percentiles
 from common.utils import MeasureDuration
+from common.utils import PROCESS_SAMPLING_INTERVAL
 from common.utils import log_exception
 from common.utils import measure_time
+from common.utils import pretty_json
 from common.utils import print_debug
+from common.utils.processes import AUCTION_WORKLET, ProcessSampler
 
 logger = logging.getLogger(__file__)
 here = os.path.dirname(__file__)
 
+EXECUTION_MODES = ['compatibility', 'frozen-context', 'group-by-origin']
+# The scaling sweep (see `test__worklets_scaling_sweep`) is long, so it only runs with WORKLETS_SWEEP=1.
+WORKLETS_SWEEP = os.environ.get('WORKLETS_SWEEP', '0').lower() not in ['0', 'false']
+WORKLETS_SWEEP_BUYERS = os.environ.get('WORKLETS_SWEEP_BUYERS', '1-32:x2')
+WORKLETS_SWEEP_IGS = os.environ.get('WORKLETS_SWEEP_IGS', '1,7')
+WORKLETS_SWEEP_AUCTIONS = os.environ.get('WORKLETS_SWEEP_AUCTIONS', '2')
+WORKLETS_SWEEP_MODES = os.environ.get('WORKLETS_SWEEP_MODES', ','.join(EXECUTION_MODES))
+WORKLETS_SWEEP_REFINEMENTS = int(os.environ.get('WORKLETS_SWEEP_REFINEMENTS', '3'))
+# the sweep's table is saved as CSV and its series (for plotting) as JSON to this directory, if set
+WORKLETS_SWEEP_DIR = os.environ.get('WORKLETS_SWEEP_DIR')
 
-def generate_buyers(count, start_port=8500):
-    servers = []
-    for i in range(0,count):
-        ms = MockServer(port=start_port+i+1, directory='resources/buyer')
-        ms.__enter__()
-        servers.append(ms)
-    return servers
 
+def generate_buyers(pool, count):
+    """Creates buyer servers on ephemeral ports, all hosted by a single pool's event loop."""
+    return [pool.add(directory='resources/buyer') for _ in range(0, count)]
 
-def shutdown_servers(servers):
-    for s in servers:
-        s.__exit__(None, None, None)
 
+def concurrency_level(trace: TraceStore):
+    count_b = trace.count('b')
+    count_e = trace.count('e')
+    _, levels = trace.concurrency_curve()
+    count_max = trace.max_concurrency()
 
-def concurrency_level(fledge_trace_sorted):
-    count_max = 0
-    count_par = 0
-    count_b = 0
-    count_e = 0
-    count_all = 0
-
-    for x in fledge_trace_sorted:
-        if 'b' == x['ph']:
-            count_par += 1
-            count_b += 1
-        if 'e' == x['ph']:
-            count_par -= 1
-            count_e += 1
-
-        count_max = max(count_max, count_par)
-        count_all += 1
-
-    assert_that(count_par).is_equal_to(0)
-    assert_that(count_all).is_equal_to(count_b+count_e)
+    assert_that(int(levels[-1]) if len(levels) else 0).is_equal_to(0)
+    assert_that(len(trace)).is_equal_to(count_b+count_e)
     assert_that(count_b).is_equal_to(count_e)
     assert_that(count_max).is_less_than_or_equal_to(count_b)
     return (count_b, count_max)
 
 
-def concurrency_level_with_filter(fledge_trace_sorted, name_pattern):
-    patt_comp = re.compile(name_pattern, re.ASCII | re.IGNORECASE)
-    (count_events, count_par) = concurrency_level(filter(lambda x: patt_comp.match(x['name']), fledge_trace_sorted))
-    logger.info(f"concurrency level ({name_pattern}): {count_par} (total: {count_events})")
+def concurrency_level_with_filter(trace: TraceStore, name_pattern):
+    filtered = trace.select(name_pattern)
+    (count_events, count_par) = concurrency_level(filtered)
+    logger.info(f"concurrency level ({name_pattern}): {count_par} (total: {count_events}, "
+                f"mean: {filtered.mean_concurrency():.2f}, "
+                f"durations [ms]: {percentiles(filtered.durations() / 1000)})")
     return (count_events, count_par)
 
 
@@ -88,11 +90,29 @@ class WorkletsConcurrencyTest(BaseTest):
     """
 
     def joinAdInterestGroup(self, buyer_server, name, execution_mode, bid):
-        assert execution_mode in ['compatibility', 'frozen-context', 'group-by-origin']
+        assert execution_mode in EXECUTION_MODES
         with MeasureDuration("joinAdInterestGroup"):
             self.driver.get(buyer_server.address + "?name=" + name + "&executionMode=" + execution_mode + "&bid=" + str(bid))
             self.assertDriverContainsText('body', 'joined interest group')
 
+    def joinAdInterestGroups(self, buyer_servers, buyer_igs, execution_mode):
+        """
+        Joins `buyer_igs` interest groups of every buyer, with one page load per buyer. Groups left in the browser
+        by earlier servers on the same ports (e.g. of previous points of a sweep) are removed first, so that only
+        the joined ones bid.
+        """
+        assert execution_mode in EXECUTION_MODES
+        clear_interest_groups(self.driver, [buyer_server.address for buyer_server in buyer_servers])
+        with MeasureDuration("joinAdInterestGroups"):
+            join_interest_groups(self.driver, [
+                InterestGroupSpec(
+                    owner=buyer_server.address,
+                    name='ig_'+str(i)+'_'+str(j),
+                    execution_mode=execution_mode,
+                    bid=precomputeBid(i, j))
+                for i, buyer_server in enumerate(buyer_servers)
+                for j in range(0, buyer_igs)])
+
     def runAdAuction(self, seller_server, *buyer_servers):
         with MeasureDuration("runAdAuction"):
             seller_url_params = "?buyer=" + "&buyer=".join([urllib.parse.quote_plus(bs.address) for bs in buyer_servers])
@@ -100,65 +120,91 @@ class WorkletsConcurrencyTest(BaseTest):
             self.findFrameAndSwitchToIt()
             self.assertDriverContainsText('body', 'TC AD')
 
-    def genericTest(self, buyers, buyer_igs, auctions, execution_mode):
+    def genericTest(self, buyers, buyer_igs, auctions, execution_mode, check_limit=True):
+        """
+        Runs auctions of `buyers` buyers with `buyer_igs` interest groups each and returns metrics of bidding
+        worklets and auctions; with `check_limit`, asserts the expected limit of concurrent bidding worklets.
+        """
         assert 1 <= buyers
         assert 1 <= buyer_igs
         assert 1 <= auctions
-        assert execution_mode in ['compatibility', 'frozen-context', 'group-by-origin']
+        assert execution_mode in EXECUTION_MODES
 
-        with MockServer(port=8483, directory='resources/seller') as seller_server:
-            shutdown_ok = False
+        with MockServer(port=8483, directory='resources/seller') as seller_server, \
+                MockServerPool() as buyer_pool:
+            # Create buyer servers
+            buyer_servers = generate_buyers(buyer_pool, buyers)
 
-            try:
-                # Create buyer servers
-                buyer_servers = generate_buyers(buyers, 8500)
-
-                # Join ad interest groups
-                for i in range(0, buyers):
-                    for j in range(0, buyer_igs):
-                        self.joinAdInterestGroup(
-                            buyer_servers[i],
-                            name='ig_'+str(i)+'_'+str(j),
-                            execution_mode=execution_mode,
-                            bid=precomputeBid(i, j))
-
-                # Run a number of auctions ...
+            # Join ad interest groups
+            self.joinAdInterestGroups(buyer_servers, buyer_igs, execution_mode)
+
+            # Run a number of auctions (sampling browser processes meanwhile) ...
+            auction_durations_ms = []
+            with ProcessSampler(self.driver.service.process.pid, PROCESS_SAMPLING_INTERVAL) as sampler:
                 for testcase in range(0, auctions):
+                    last_auction_time = time.time()
+                    auction_start = time.perf_counter()
                     self.runAdAuction(seller_server, *buyer_servers)
+                    auction_durations_ms.append((time.perf_counter() - auction_start) * 1000)
 
-                # shutdown servers
-                shutdown_servers(buyer_servers)
-                shutdown_ok = True
-
-                # Inspect fledge trace events
-                fledge_trace = self.extract_fledge_trace_events()
-                logger.info(f"fledge_trace: {len(fledge_trace)} events")
+                # wait for the report of the last auction
+                buyer_servers[-1].wait_for_request('/reportWin', since=last_auction_time)
 
-                # inspect bidder worklet events
-                (count_events, count_par) = concurrency_level_with_filter(fledge_trace, 'bidder_worklet_generate_bid')
-                assert_that(count_events).is_equal_to(auctions * buyers * buyer_igs)
+            # shutdown servers
+            buyer_pool.close()
 
-                ################################################################
-                # Exactly 10 bidding worklets (or less, if not enough buyers),
-                # times the number of IGs per buyer, running in parallel!
-                ################################################################
+            # Inspect fledge trace events
+            fledge_events = self.extract_fledge_trace_events()
+            fledge_trace = TraceStore.from_events(fledge_events)
+            logger.info(f"fledge_trace: {len(fledge_trace)} events")
+            try:
+                breakdown = self.auction_breakdown(fledge_events)
+            except ValueError as e:
+                # the breakdown is diagnostic only, not every browser build records the events it needs
+                logger.warning(f"skipping auction breakdown: {e}")
+            else:
+                for auction in breakdown.auctions():
+                    logger.info(f"auction {auction} stage spans [ms]: {breakdown.stage_spans(auction)}")
+
+            # inspect bidder worklet events
+            (count_events, count_par) = concurrency_level_with_filter(fledge_trace, 'bidder_worklet_generate_bid')
+            assert_that(count_events).is_equal_to(auctions * buyers * buyer_igs)
+            worklet_processes = sampler.summary().get(AUCTION_WORKLET, {})
+            logger.info(f"auction worklet processes: {worklet_processes.get('max_processes', 0)} "
+                        f"(peak RSS {worklet_processes.get('peak_rss_mb', 0):.1f} MiB, "
+                        f"{sampler.peak_rss_per_process_mb(AUCTION_WORKLET) or 0:.1f} MiB per process, "
+                        f"CPU {worklet_processes.get('cpu_s', 0):.2f} s) for {count_par} concurrent bidding worklets")
+
+            bidder_worklets = fledge_trace.select('bidder_worklet_generate_bid')
+            worklet_durations_ms = percentiles(bidder_worklets.durations() / 1000)
+            auction_durations = percentiles(np.asarray(auction_durations_ms))
+            metrics = dict(
+                concurrency=count_par,
+                mean_concurrency=bidder_worklets.mean_concurrency(),
+                worklet_p50_ms=worklet_durations_ms.get('p50'),
+                worklet_p90_ms=worklet_durations_ms.get('p90'),
+                auction_p50_ms=auction_durations.get('p50'),
+                auction_p90_ms=auction_durations.get('p90'),
+                worklet_processes=worklet_processes.get('max_processes', 0),
+                worklet_rss_mb=worklet_processes.get('peak_rss_mb', 0.0),
+            )
+
+            ################################################################
+            # Exactly 10 bidding worklets (or less, if not enough buyers),
+            # times the number of IGs per buyer, running in parallel!
+            ################################################################
+            if check_limit:
                 expected_par = min(10, buyers) * buyer_igs
                 assert_that(count_par, description=f"Exactly {expected_par} bidding worklets running in parallel").is_equal_to(expected_par)
 
-                # inspect generate_bid events
-                (count_events, count_par) = concurrency_level_with_filter(fledge_trace, 'generate_bid')
-                assert_that(count_events).is_equal_to(auctions * buyers * buyer_igs)
-
-                # wait for the (missing) reports
-                logger.info("sleep 1 sec ...")
-                time.sleep(1)
+            # inspect generate_bid events
+            (count_events, count_par) = concurrency_level_with_filter(fledge_trace, 'generate_bid')
+            assert_that(count_events).is_equal_to(auctions * buyers * buyer_igs)
 
-                # analyze the reports
-                report_win_signals = buyer_servers[-1].get_last_request('/reportWin').get_first_json_param('signals')
-                assert_that(report_win_signals.get('browserSignals').get('bid')).is_equal_to(precomputeBid(buyers-1, buyer_igs-1))
-            finally:
-                if not shutdown_ok:
-                    shutdown_servers(buyer_servers)
+            # analyze the reports
+            report_win_signals = buyer_servers[-1].get_last_request('/reportWin').get_first_json_param('signals')
+            assert_that(report_win_signals.get('browserSignals').get('bid')).is_equal_to(precomputeBid(buyers-1, buyer_igs-1))
+            return metrics
 
 
     @print_debug
@@ -180,6 +226,7 @@ class WorkletsConcurrencyTest(BaseTest):
 
             for entry in fledge_trace:
                 logger.info(f"trace: {entry}")
+            fledge_trace = TraceStore.from_events(fledge_trace)
 
             (count_events, count_par) = concurrency_level_with_filter(fledge_trace, 'generate_bid')
             assert_that(count_events).is_equal_to(1)
@@ -193,12 +240,8 @@ class WorkletsConcurrencyTest(BaseTest):
             assert_that(count_events).is_equal_to(5)
             assert_that(count_par).is_equal_to(1)
 
-            # wait for the (missing) reports
-            logger.info("sleep 1 sec ...")
-            time.sleep(1)
-
-            # analyze reports
-            report_win_signals = buyer_server.get_last_request('/reportWin').get_first_json_param('signals')
+            # wait for and analyze reports
+            report_win_signals = buyer_server.wait_for_request('/reportWin').get_first_json_param('signals')
             assert_that(report_win_signals.get('browserSignals').get('bid')).is_equal_to(101)
 
 
@@ -326,3 +369,65 @@ class WorkletsConcurrencyTest(BaseTest):
     @log_exception
     def test__worklets_32_buyers_17_ig_2_auctions_groupbyorigin(self):
         self.genericTest(32, 17, 2, 'group-by-origin')
+
+
+    @print_debug
+    @measure_time
+    @log_exception
+    def test__replayed_auctions_5_buyers_2_ig_100_auctions(self):
+        """Auctions run back to back from a single page, to measure their throughput."""
+        buyers, buyer_igs, auctions = 5, 2, 100
+        with MockServer(port=8483, directory='resources/seller') as seller_server, \
+                MockServerPool() as buyer_pool:
+            buyer_servers = generate_buyers(buyer_pool, buyers)
+            self.joinAdInterestGroups(buyer_servers, buyer_igs, 'compatibility')
+
+            replay = AuctionReplay(self.driver, seller_server.address + '/replay.html')
+            config = auction_config(seller_server.address, [buyer_server.address for buyer_server in buyer_servers])
+            results = replay.run_many([config] * auctions)
+            auctions_summary = summary(results, replay.wall_time_ms)
+            logger.info(f"replayed auctions: {pretty_json(auctions_summary)}")
+            save_results(self.id(), dict(auction_duration_ms=[result.duration_ms for result in results]),
+                         self.driver, self.browser_flags)
+
+            assert_that(auctions_summary['errors']).is_equal_to(0)
+            assert_that(auctions_summary['no_winner']).is_equal_to(0)
+            winning_ad = buyer_servers[-1].address + '/ad.html'
+            assert_that([result.ad_url for result in results if result.ad_url]).contains_only(winning_ad)
+
+            # replayed auctions render no ads, so render the last winner to get its reports
+            replay.render(results[-1].winner)
+            report_win_signals = buyer_servers[-1].wait_for_request('/reportWin').get_first_json_param('signals')
+            assert_that(report_win_signals.get('browserSignals').get('bid')).is_equal_to(precomputeBid(buyers-1, buyer_igs-1))
+
+
+    @unittest.skipUnless(WORKLETS_SWEEP, "set WORKLETS_SWEEP=1 to run the scaling sweep")
+    @print_debug
+    @measure_time
+    @log_exception
+    def test__worklets_scaling_sweep(self):
+        """
+        Bidding worklets concurrency, worklet durations and auction latencies over a grid of buyers,
+        interest groups per buyer, auctions and execution modes (WORKLETS_SWEEP_* variables), refined
+        around the load where concurrency saturates, to find the browser's actual scaling limits.
+        """
+        def measure(point: SweepPoint):
+            return self.genericTest(point.buyers, point.buyer_igs, point.auctions, point.execution_mode,
+                                    check_limit=False)
+
+        sweep = Sweep(grid(buyers=parse_range(WORKLETS_SWEEP_BUYERS),
+                           buyer_igs=parse_range(WORKLETS_SWEEP_IGS),
+                           auctions=parse_range(WORKLETS_SWEEP_AUCTIONS),
+                           execution_modes=[mode for mode in WORKLETS_SWEEP_MODES.split(',') if mode]),
+                      measure)
+        sweep.run(refine_metric='concurrency', max_refinements=WORKLETS_SWEEP_REFINEMENTS)
+        logger.info(f"worklets scaling sweep:\n{sweep.table()}")
+        for result in sweep.results:
+            save_results(f"{self.id()}.{result.point.label}",
+                         {name: [value] for name, value in result.metrics.items()
+                          if name.endswith('_ms') and value is not None},
+                         self.driver, self.browser_flags)
+        if WORKLETS_SWEEP_DIR:
+            os.makedirs(WORKLETS_SWEEP_DIR, exist_ok=True)
+            sweep.to_csv(os.path.join(WORKLETS_SWEEP_DIR, self.id() + '.csv'))
+            sweep.to_json(os.path.join(WORKLETS_SWEEP_DIR, self.id() + '.json'))